@@ -3,12 +3,17 @@
 cmake_minimum_required(VERSION 2.8)
 enable_language(Fortran)
 
+set(CMAKE_CXX_STANDARD 11)
+set(CMAKE_CXX_STANDARD_REQUIRED ON)
+
 find_package(BLAS REQUIRED)
 find_package(LAPACK REQUIRED)
 find_package(LAPACKE REQUIRED)
 
 include_directories(${LAPACKE_INCLUDE_DIRS})
 
+find_package(Threads REQUIRED)
+
 find_package(SlicerExecutionModel REQUIRED)
 find_package(MeshLib REQUIRED)
 
@@ -22,4 +27,14 @@ include_directories(src)
 
 include_directories(wrapper)
 add_subdirectory(wrapper)
-add_subdirectory(src)
\ No newline at end of file
+add_subdirectory(src)
+
+option(Groups_BUILD_BENCHMARK "Build GroupsBenchmark, the headless benchmark on synthetic cohorts." ON)
+if(Groups_BUILD_BENCHMARK)
+  add_subdirectory(benchmark)
+endif()
+
+if(BUILD_TESTING)
+  enable_testing()
+  add_subdirectory(Testing)
+endif()
\ No newline at end of file
@@ -0,0 +1,165 @@
+/*************************************************
+*	CoefficientWriterTest.cxx
+*
+*	Unit test of CoefficientWriter
+*	Part of the Groups command line module
+*************************************************/
+
+// the background writer only writes every maxPending improvements (or at flush and destruction), always the latest
+// solution, and the files are replaced as a whole: no temporary file is left behind. The binary container is read back.
+
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <thread>
+#include <vector>
+#include "AtomicFile.h"
+#include "CoefficientWriter.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+static bool exists(const string &filename)
+{
+	FILE *fp = fopen(filename.c_str(), "r");
+	if (fp == NULL) return false;
+	fclose(fp);
+	return true;
+}
+
+// first latitude of a .coeff file (-1 if it cannot be read)
+static float firstLatitude(const string &filename)
+{
+	FILE *fp = fopen(filename.c_str(), "r");
+	if (fp == NULL) return -1;
+	float pole[3], lat = -1, lon;
+	int degree;
+	if (fscanf(fp, "%f %f %f %d %f %f", &pole[0], &pole[1], &pole[2], &degree, &lat, &lon) != 6) lat = -1;
+	fclose(fp);
+	return lat;
+}
+
+// the background thread writes within a few seconds
+static bool waitFor(const string &filename, float lat)
+{
+	for (int i = 0; i < 500 && firstLatitude(filename) != lat; i++) this_thread::sleep_for(chrono::milliseconds(10));
+	return firstLatitude(filename) == lat;
+}
+
+int main(void)
+{
+	int nSubj = 2, degree = 1;
+	const char *output[] = {"CoefficientWriterTest_a.coeff", "CoefficientWriterTest_b.coeff"};
+	float pole[] = {0, 0, 1, 0, 0, 1};
+	vector<float> coeff((degree + 1) * (degree + 1) * nSubj * 2, 0);
+	for (int subj = 0; subj < nSubj; subj++) remove(output[subj]);
+
+	// no timed write (1 hour), a write every 3 improvements
+	{
+		CoefficientWriter writer(nSubj, degree, output, pole, 3600, 3);
+		coeff[0] = 1;
+		writer.update(&coeff[0]);
+		coeff[0] = 2;
+		writer.update(&coeff[0]);
+		this_thread::sleep_for(chrono::milliseconds(200));
+		check(!exists(output[0]), "no write before maxPending improvements");
+
+		coeff[0] = 3;
+		writer.update(&coeff[0]);
+		check(waitFor(output[0], 3), "write after maxPending improvements");
+
+		coeff[0] = 4;
+		writer.update(&coeff[0]);
+		writer.flush();
+		check(firstLatitude(output[0]) == 4, "flush writes the latest solution");
+
+		coeff[0] = 5;
+		writer.update(&coeff[0]);
+	}
+	check(firstLatitude(output[0]) == 5, "the destructor writes the latest solution");
+	for (int subj = 0; subj < nSubj; subj++)
+	{
+		check(!exists(AtomicFile::temporary(output[subj])), "no temporary file left");
+		remove(output[subj]);
+	}
+
+	// timed writes
+	{
+		CoefficientWriter writer(nSubj, degree, output, pole, 0.05f, 1000);
+		coeff[0] = 6;
+		writer.update(&coeff[0]);
+		check(waitFor(output[0], 6), "write after the interval");
+	}
+	for (int subj = 0; subj < nSubj; subj++) remove(output[subj]);
+
+	// replacement of an existing file, and a temporary file which is not complete
+	{
+		const char *filename = "CoefficientWriterTest.txt";
+		string tmp = AtomicFile::temporary(filename);
+		FILE *fp = fopen(filename, "w");
+		fprintf(fp, "old\n");
+		fclose(fp);
+
+		fp = fopen(tmp.c_str(), "w");
+		fprintf(fp, "partial\n");
+		check(!AtomicFile::commit(fp, tmp, filename, false), "an incomplete file is not committed");
+		check(!exists(tmp), "the incomplete file is removed");
+
+		fp = fopen(tmp.c_str(), "w");
+		fprintf(fp, "new\n");
+		check(AtomicFile::commit(fp, tmp, filename), "commit");
+		char line[16] = "";
+		fp = fopen(filename, "r");
+		check(fp != NULL && fscanf(fp, "%15s", line) == 1 && string(line) == "new", "the destination is replaced");
+		if (fp != NULL) fclose(fp);
+		check(!exists(tmp), "the temporary file is renamed");
+		check(!AtomicFile::replace(tmp, filename) && exists(filename), "nothing to replace with");
+		remove(filename);
+	}
+
+	// binary container: the latest solution with the names and poles, and coefficients aligned for memory mapping
+	{
+		const char *container = "CoefficientWriterTest.coeffs";
+		for (int i = 0; i < coeff.size(); i++) coeff[i] = 0.25f * i - 1;
+		{
+			CoefficientWriter writer(nSubj, degree, output, pole, 3600, 1000, container, false);
+			writer.update(&coeff[0]);
+		}
+		check(!exists(output[0]), "no text file without text output");
+
+		vector<string> name;
+		vector<float> loadedPole, loadedCoeff;
+		int loadedDegree = -1;
+		check(CoefficientWriter::loadContainer(container, name, loadedPole, loadedDegree, loadedCoeff), "load the container");
+		check(name.size() == 2 && name[0] == "CoefficientWriterTest_a" && name[1] == "CoefficientWriterTest_b", "container: names");
+		check(loadedDegree == degree && loadedPole == vector<float>(pole, pole + nSubj * 3) && loadedCoeff == coeff, "container: values");
+
+		FILE *fp = fopen(container, "rb");
+		char magic[8];
+		int header[4];
+		check(fp != NULL && fread(magic, 1, 8, fp) == 8 && fread(header, sizeof(int), 4, fp) == 4, "container: header");
+		check(header[2] % 16 == 0, "container: aligned coefficients");
+		float first;
+		check(fseek(fp, header[2], SEEK_SET) == 0 && fread(&first, sizeof(float), 1, fp) == 1 && first == coeff[0], "container: coefficients at the offset");
+		if (fp != NULL) fclose(fp);
+
+		fp = fopen(container, "r+b");
+		fwrite("GRPCOEF0", 1, 8, fp);
+		fclose(fp);
+		check(!CoefficientWriter::loadContainer(container, name, loadedPole, loadedDegree, loadedCoeff), "container: wrong magic");
+		remove(container);
+	}
+
+	if (failures == 0) cout << "CoefficientWriterTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
@@ -0,0 +1,98 @@
+/*************************************************
+*	FaceLocatorTest.cxx
+*
+*	Unit test of FaceLocator
+*	Part of the Groups command line module
+*************************************************/
+
+// the faces found by the walks of a FaceLocator on a deforming sphere agree with the closest faces of an AABB tree
+// rebuilt after every deformation: same face, or a face which contains the point as well (point on an edge or a vertex)
+
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <iostream>
+#include <random>
+#include <vector>
+#include "Mesh.h"
+#include "AABB.h"
+#include "FaceLocator.h"
+#include "SyntheticCohort.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+int main(void)
+{
+	const char *filename = "FaceLocatorTest_sphere.vtk";
+	vector<float> query, vertex;
+	vector<int> face;
+	icosphere(3, query, face);
+	int nQuery = query.size() / 3;	// the vertices of a coarser sphere are the sampling points
+	icosphere(4, vertex, face);
+	if (!saveVTK(filename, vertex, face))
+	{
+		cout << "FAILED: cannot write " << filename << endl;
+		return EXIT_FAILURE;
+	}
+
+	Mesh mesh;
+	mesh.openFile(filename);
+	remove(filename);
+	AABB tree(&mesh);
+	AABB reference(&mesh);
+	FaceLocator locator(&mesh, &tree);
+
+	// small random deformations, as between two evaluations of the cost
+	mt19937 rng(1);
+	uniform_real_distribution<float> uniform(-1, 1);
+	vector<int> cache(nQuery, -1);
+	FaceLocator::Counters total;
+	int nDeformation = 20, disagree = 0;
+	for (int it = 0; it < nDeformation; it++)
+	{
+		float angle = 0.01f;
+		for (int i = 0; i < mesh.nVertex(); i++)
+		{
+			Vertex *v = (Vertex *)mesh.vertex(i);
+			const float *p = v->fv();
+			float q[3] = {p[0] * cos(angle) - p[1] * sin(angle), p[0] * sin(angle) + p[1] * cos(angle), p[2]};
+			float norm = 0;
+			for (int k = 0; k < 3; k++) q[k] += 2e-3f * uniform(rng), norm += q[k] * q[k];
+			norm = sqrt(norm);
+			for (int k = 0; k < 3; k++) q[k] /= norm;
+			v->setVertex(q);
+		}
+		locator.invalidate();
+		reference.update();
+
+		FaceLocator::Counters counters;
+		for (int i = 0; i < nQuery; i++)
+		{
+			float coeff[3], refCoeff[3];
+			int fid = locator.locate(&query[i * 3], cache[i], coeff, counters);
+			int ref = reference.closestFace(&query[i * 3], refCoeff);
+			bool inside = coeff[0] >= -1e-5f && coeff[1] >= -1e-5f && coeff[2] >= -1e-5f;
+			if (fid != ref && !inside) disagree++;
+			cache[i] = fid;
+		}
+		check(counters.hit + counters.walk + counters.fallback == nQuery, "every query is counted once");
+		check(counters.rebuild <= 1, "at most one rebuild per deformation");
+		if (it > 0) check(counters.fallback < nQuery / 10, "the walks find most of the faces");
+		total += counters;
+	}
+	check(disagree == 0, "same faces as the AABB tree");
+	check(total.hit + total.walk > 0, "faces found by walks");
+
+	cout << "hit " << total.hit << ", walk " << total.walk << ", fallback " << total.fallback << ", rebuild " << total.rebuild << endl;
+	if (failures == 0) cout << "FaceLocatorTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
@@ -0,0 +1,262 @@
+/*************************************************
+*	GroupwiseRegistrationTest.cxx
+*
+*	Unit test of GroupwiseRegistration
+*	Part of the Groups command line module
+*************************************************/
+
+// internal computations of the registration on a synthetic cohort (SyntheticCohort.h), checked against the reference
+// computations they replace
+
+#include <algorithm>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <random>
+#include <string>
+#include <vector>
+#include "GroupwiseRegistration.h"
+#include "SyntheticCohort.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+struct Cohort
+{
+	string dir;
+	vector<string> sphere, surf, property, landmark, output;
+	vector<float> weight;
+};
+
+class GroupwiseRegistrationTest
+{
+public:
+	static GroupwiseRegistration *registration(Cohort &cohort, int basisMode = GroupwiseRegistration::FullBasis, bool incrementalCovariance = true,
+											   int optimizer = GroupwiseRegistration::NewuoaOptimizer, int nThreads = 2)
+	{
+		vector<const char *> sphere = cstr(cohort.sphere), property = cstr(cohort.property), output = cstr(cohort.output);
+		return new GroupwiseRegistration(&sphere[0], sphere.size(), &property[0], property.size() / sphere.size(), &output[0], &cohort.weight[0], 4,
+										 NULL, 0, NULL, NULL, 200, 0, 0, NULL, 5, 100, NULL, true, NULL, NULL, nThreads, basisMode, incrementalCovariance, optimizer);
+	}
+
+	// random coefficients of a subject (-1: all the subjects) up to the incremental degree
+	static void perturb(GroupwiseRegistration *groups, int subj, float scale, int seed)
+	{
+		mt19937 rng(seed);
+		uniform_real_distribution<float> uniform(-scale, scale);
+		int n = (groups->m_degree_inc + 1) * (groups->m_degree_inc + 1), nBasis = (groups->m_degree + 1) * (groups->m_degree + 1);
+		for (int s = 0; s < groups->m_nSubj; s++)
+			for (int i = 0; i < n && (subj < 0 || s == subj); i++)
+			{
+				*groups->m_spharm[s].coeff[i] = uniform(rng);
+				*groups->m_spharm[s].coeff[nBasis + i] = uniform(rng);
+			}
+	}
+
+	// the displacements of all the vertices of a subject (one SGEMM per subject) are those of the scalar sum over the
+	// basis functions of each vertex (updateCoordinate), for the coefficients up to the incremental degree
+	static void deformation(Cohort &cohort)
+	{
+		GroupwiseRegistration *groups = registration(cohort);
+		check(groups->m_degree_inc < groups->m_degree, "deformation: part of the basis");
+		perturb(groups, -1, 0.05f, 2);
+		float error = 0, displacement = 0;
+		for (int subj = 0; subj < groups->m_nSubj; subj++)
+		{
+			check(groups->updateDeformation(subj), "deformation: new coefficients");
+			for (int i = 0; i < groups->m_spharm[subj].vertex.size(); i++)
+			{
+				const float *p0 = groups->m_spharm[subj].vertex[i]->p, *p = groups->m_spharm[subj].sphere->vertex(i)->fv();
+				float v1[3];
+				groups->updateCoordinate(p0, v1, groups->m_spharm[subj].vertex[i]->Y, (const float **)groups->m_spharm[subj].coeff, groups->m_degree_inc, groups->m_spharm[subj].pole);
+				Vector V(v1); V.unit();
+				const float *q = V.fv();
+				error = max(error, (float)sqrt((p[0] - q[0]) * (p[0] - q[0]) + (p[1] - q[1]) * (p[1] - q[1]) + (p[2] - q[2]) * (p[2] - q[2])));
+				displacement = max(displacement, (float)sqrt((p[0] - p0[0]) * (p[0] - p0[0]) + (p[1] - p0[1]) * (p[1] - p0[1]) + (p[2] - p0[2]) * (p[2] - p0[2])));
+			}
+		}
+		check(displacement > 1e-2, "deformation: deformed spheres");
+		check(error < 1e-5, "deformation: same as the scalar path");
+		// the coefficients of the last evaluation are those of the deformation
+		memcpy(groups->m_coeff_prev_step, groups->m_coeff, sizeof(float) * groups->m_csize * 2);
+		check(!groups->updateDeformation(0), "deformation: unchanged coefficients");
+		delete groups;
+	}
+
+	// largest distance between the vertices of the deformed spheres of a subject
+	static float distance(GroupwiseRegistration *a, GroupwiseRegistration *b, int subj)
+	{
+		float d = 0;
+		for (int i = 0; i < a->m_spharm[subj].sphere->nVertex(); i++)
+		{
+			const float *p = a->m_spharm[subj].sphere->vertex(i)->fv(), *q = b->m_spharm[subj].sphere->vertex(i)->fv();
+			d = max(d, sqrt((p[0] - q[0]) * (p[0] - q[0]) + (p[1] - q[1]) * (p[1] - q[1]) + (p[2] - q[2]) * (p[2] - q[2])));
+		}
+		return d;
+	}
+
+	// the compact basis modes deform the spheres as the full basis: exactly when recomputed on the fly (block by block),
+	// within the half-precision rounding when stored in half precision
+	static void compactBasis(Cohort &cohort)
+	{
+		GroupwiseRegistration *full = registration(cohort, GroupwiseRegistration::FullBasis);
+		GroupwiseRegistration *half = registration(cohort, GroupwiseRegistration::HalfBasis);
+		GroupwiseRegistration *fly = registration(cohort, GroupwiseRegistration::OnTheFlyBasis);
+		check(full->m_spharm[0].basis != NULL && half->m_spharm[0].basis == NULL && fly->m_spharm[0].basis == NULL, "compact basis: no float basis");
+		check(half->m_spharm[0].basisHalf != NULL && fly->m_spharm[0].basisHalf == NULL, "compact basis: storage");
+		fly->m_basisBlock = 100;	// several blocks, the last one partial
+		half->m_basisBlock = 100;
+
+		GroupwiseRegistration *groups[] = {full, half, fly};
+		for (int k = 0; k < 3; k++)
+		{
+			perturb(groups[k], -1, 0.01f, 3);	// small deformations: no fold
+			for (int subj = 0; subj < groups[k]->m_nSubj; subj++) groups[k]->updateDeformation(subj);
+		}
+		float errorHalf = 0, errorFly = 0;
+		for (int subj = 0; subj < full->m_nSubj; subj++)
+		{
+			errorHalf = max(errorHalf, distance(full, half, subj));
+			errorFly = max(errorFly, distance(full, fly, subj));
+		}
+		check(errorFly < 1e-5, "compact basis: on the fly");
+		check(errorHalf < 1e-3, "compact basis: half precision");
+
+		// same cost
+		float cost[3];
+		for (int k = 0; k < 3; k++) cost[k] = groups[k]->cost(groups[k]->m_coeff);
+		check(full->m_nFolds == 0, "compact basis: no fold");
+		check(fabs(cost[2] - cost[0]) <= 1e-4 * fabs(cost[0]) + 1e-5, "compact basis: cost on the fly");
+		check(fabs(cost[1] - cost[0]) <= 1e-2 * fabs(cost[0]) + 1e-3, "compact basis: cost in half precision");
+		for (int k = 0; k < 3; k++) delete groups[k];
+	}
+
+	// the covariance derived from the Gram matrix, whose rows are only recomputed for the subjects which changed, is the
+	// covariance of Statistics::wcov_trans, and the cost is the one of the full computation
+	static void incrementalCovariance(Cohort &cohort)
+	{
+		GroupwiseRegistration *incremental = registration(cohort, GroupwiseRegistration::FullBasis, true);
+		GroupwiseRegistration *full = registration(cohort, GroupwiseRegistration::FullBasis, false);
+		GroupwiseRegistration *groups[] = {incremental, full};
+		int nSubj = incremental->m_nSubj;
+		int dim = incremental->m_propertySamples.size() * (incremental->m_nProperties + incremental->m_nSurfaceProperties);
+		vector<float> cov(nSubj * nSubj), ref(nSubj * nSubj);
+		for (int step = 0; step <= nSubj; step++)
+		{
+			// one subject changes at a time, then all of them
+			float cost[2];
+			for (int k = 0; k < 2; k++)
+			{
+				perturb(groups[k], (step < nSubj) ? step: -1, 0.01f, 10 + step);
+				cost[k] = groups[k]->cost(groups[k]->m_coeff);
+			}
+			check(incremental->m_incrementalCov, "incremental covariance: calibrated");
+			check(fabs(cost[0] - cost[1]) <= 1e-4 * fabs(cost[1]) + 1e-5, "incremental covariance: cost");
+
+			incremental->centeredCovariance(incremental->m_gram, &cov[0]);
+			fill(ref.begin(), ref.end(), 0.0f);
+			Statistics::wcov_trans(incremental->m_feature, nSubj, dim, &ref[0], incremental->m_feature_weight);
+			double err = 0, norm = 0;
+			for (int i = 0; i < nSubj; i++)
+				for (int j = 0; j <= i; j++)	// wcov_trans may fill a single triangle
+				{
+					double r = (ref[i * nSubj + j] != 0) ? ref[i * nSubj + j]: ref[j * nSubj + i];
+					err = max(err, fabs(cov[i * nSubj + j] - r));
+					norm = max(norm, fabs(r));
+				}
+			check(norm > 0 && err <= 1e-3 * norm, "incremental covariance: wcov_trans");
+		}
+		delete incremental;
+		delete full;
+	}
+
+	// only the subjects whose coefficients changed are deformed, tested for folds and sampled again, and the cost is the
+	// one of a full recomputation
+	static void unchangedSubjects(Cohort &cohort)
+	{
+		GroupwiseRegistration *groups = registration(cohort);
+		int nSubj = groups->m_nSubj, changed = 2;
+		float initial = groups->cost(groups->m_coeff);
+		vector<unsigned int> version(nSubj);
+		for (int subj = 0; subj < nSubj; subj++) version[subj] = groups->m_spharm[subj].version;
+		long long recomputed = groups->m_nRecomputed;
+		check(groups->cost(groups->m_coeff) == initial, "unchanged subjects: same cost");
+		check(groups->m_nRecomputed == recomputed, "unchanged subjects: nothing recomputed");
+
+		perturb(groups, changed, 0.01f, 20);
+		float cost = groups->cost(groups->m_coeff);
+		check(groups->m_nRecomputed == recomputed + 1, "unchanged subjects: a single subject recomputed");
+		for (int subj = 0; subj < nSubj; subj++)
+			check((groups->m_spharm[subj].version != version[subj]) == (subj == changed), "unchanged subjects: versions");
+
+		// every subject recomputed
+		for (int subj = 0; subj < nSubj; subj++) groups->m_spharm[subj].deformDegree = -1;
+		float full = groups->cost(groups->m_coeff);
+		check(groups->m_nRecomputed == recomputed + 1 + nSubj, "unchanged subjects: full recomputation");
+		check(fabs(full - cost) <= 1e-5 * fabs(cost) + 1e-6, "unchanged subjects: cost of the full recomputation");
+		delete groups;
+	}
+
+	// the calibration of the incremental covariance fails during an L-BFGS stage: the gradient, which needs the Gram
+	// matrix, stops L-BFGS and the stage goes on with NEWUOA
+	static void gradientFallback(Cohort &cohort)
+	{
+		GroupwiseRegistration *groups = registration(cohort, GroupwiseRegistration::FullBasis, true, GroupwiseRegistration::LbfgsOptimizer);
+		int nSubj = groups->m_nSubj, n = 4 * nSubj * 2;	// coefficients up to degree 1
+		groups->beginStage(n);
+		float initial = groups->cost(groups->m_coeff);
+		check(groups->m_incrementalCov && groups->m_covCalibrated, "fallback: calibrated covariance");
+
+		// a Gram matrix which no longer matches the features: the next calibration falls back to the full covariance
+		groups->m_gram[1] += 1e3 * (fabs(groups->m_gram[1]) + 1);
+		groups->m_gram[nSubj] = groups->m_gram[1];
+		groups->m_covCalibrated = false;
+		groups->beginStage(n);
+		groups->minimize(0, n, 1e-5f);
+		check(!groups->m_incrementalCov, "fallback: full covariance");
+		check(groups->m_stopReason == NULL || strstr(groups->m_stopReason, "gradient") == NULL, "fallback: the stage is not stopped by the gradient");
+		check(groups->nIter > n, "fallback: NEWUOA evaluations");
+		check(groups->m_mincost <= initial, "fallback: no worse solution");
+
+		// the gradient is not computed from the stale Gram matrix
+		vector<double> grad(n, 1);
+		groups->beginStage(n);
+		groups->gradient(0, n, &grad[0]);
+		bool zero = true;
+		for (int i = 0; i < n; i++) zero = zero && grad[i] == 0;
+		check(groups->stopped() && zero, "fallback: no gradient");
+		delete groups;
+	}
+};
+
+int main(void)
+{
+	Cohort cohort;
+	cohort.dir = "GroupwiseRegistrationTest-data";
+	if (!generateCohort(cohort.dir, 4, 3, 1, 0, 1, cohort.sphere, cohort.surf, cohort.property, cohort.landmark, cohort.output))
+	{
+		cout << "FAILED: cannot write the cohort in " << cohort.dir << endl;
+		return EXIT_FAILURE;
+	}
+	cohort.weight.assign(1, 1);
+
+	GroupwiseRegistrationTest::deformation(cohort);
+	GroupwiseRegistrationTest::compactBasis(cohort);
+	GroupwiseRegistrationTest::incrementalCovariance(cohort);
+	GroupwiseRegistrationTest::unchangedSubjects(cohort);
+	GroupwiseRegistrationTest::gradientFallback(cohort);
+
+	removeCohort(cohort.dir, cohort.sphere, cohort.surf, cohort.property, cohort.landmark, cohort.output);
+	if (failures == 0) cout << "GroupwiseRegistrationTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
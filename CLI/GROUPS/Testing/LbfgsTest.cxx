@@ -0,0 +1,132 @@
+/*************************************************
+*	LbfgsTest.cxx
+*
+*	Unit test of the L-BFGS minimizer (lbfgs.h)
+*	Part of the Groups command line module
+*************************************************/
+
+// minimization of functions with a known minimum, with the step limit and the early stop of the registration
+
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <vector>
+#include "lbfgs.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+// weighted quadratic sum(w_i (x_i - c_i)^2): minimum 0 at c
+// once stopped, it returns the last cost without evaluating, like the cost function of the registration
+class quadratic
+{
+public:
+	quadratic(int n): m_n(n), m_nEval(0), m_maxEval(0), m_lastCost(0), m_nStale(0), m_nStaleGrad(0) {}
+	double operator () (float *x)
+	{
+		if (stop())
+		{
+			m_nStale++;
+			return m_lastCost;
+		}
+		m_nEval++;
+		double f = 0;
+		for (int i = 0; i < m_n; i++) f += (i + 1) * (x[i] - center(i)) * (x[i] - center(i));
+		m_lastCost = f;
+		return f;
+	}
+	void operator () (float *x, double *g)
+	{
+		if (stop()) m_nStaleGrad++;
+		for (int i = 0; i < m_n; i++) g[i] = 2 * (i + 1) * (x[i] - center(i));
+	}
+	bool stop(void) { return m_maxEval > 0 && m_nEval >= m_maxEval; }
+	static float center(int i) { return (i % 2 == 0) ? 0.5f: -0.25f * i; }
+
+	int m_n;
+	int m_nEval;
+	int m_maxEval;	// early stop after this number of evaluations (0: none)
+	double m_lastCost;
+	int m_nStale;	// calls after the stop
+	int m_nStaleGrad;
+};
+
+// Rosenbrock function (1 - x)^2 + 100 (y - x^2)^2: minimum 0 at (1, 1) at the end of a curved valley
+class rosenbrock
+{
+public:
+	double operator () (float *x)
+	{
+		return (1 - x[0]) * (1 - x[0]) + 100 * (x[1] - x[0] * x[0]) * (x[1] - x[0] * x[0]);
+	}
+	void operator () (float *x, double *g)
+	{
+		g[0] = -2 * (1 - x[0]) - 400 * x[0] * (x[1] - x[0] * x[0]);
+		g[1] = 200 * (x[1] - x[0] * x[0]);
+	}
+	bool stop(void) { return false; }
+};
+
+int main(void)
+{
+	// quadratic: the minimum is reached, and the returned cost is the cost at the returned point
+	{
+		int n = 20;
+		vector<float> x(n, 0);
+		quadratic f(n);
+		double fmin = min_lbfgs(n, &x[0], f, f, 0.1f, 1e-12, 1000);
+		double error = 0;
+		for (int i = 0; i < n; i++) error = max(error, (double)fabs(x[i] - quadratic::center(i)));
+		check(error < 1e-3, "quadratic: minimum");
+		check(fabs(fmin - f(&x[0])) < 1e-9, "quadratic: cost of the returned point");
+	}
+
+	// Rosenbrock from the classical starting point (-1.2, 1)
+	{
+		float x[2] = {-1.2f, 1.0f};
+		rosenbrock f;
+		double fmin = min_lbfgs(2, x, f, f, 0.1f, 1e-12, 5000);
+		check(fabs(x[0] - 1) < 1e-2 && fabs(x[1] - 1) < 2e-2, "rosenbrock: minimum");
+		check(fmin < 1e-4, "rosenbrock: cost");
+	}
+
+	// the first step is limited to maxStep per variable
+	{
+		int n = 4;
+		vector<float> x(n, 0);
+		quadratic f(n);
+		min_lbfgs(n, &x[0], f, f, 0.1f, 1e-12, 1);
+		double step = 0;
+		for (int i = 0; i < n; i++) step = max(step, (double)fabs(x[i]));
+		check(step <= 0.1 + 1e-6, "maxStep");
+	}
+
+	// early stop at any point of the minimization (first evaluation, line search, accepted step): neither the cost nor
+	// the gradient is called after the stop, and the minimization ends at an evaluated point not worse than the start
+	for (int maxEval = 1; maxEval <= 30; maxEval++)
+	{
+		int n = 20;
+		vector<float> x(n, 0);
+		quadratic f(n);
+		double f0 = f(&x[0]);
+		f.m_nEval = 0;
+		f.m_maxEval = maxEval;
+		double fmin = min_lbfgs(n, &x[0], f, f, 0.1f, 1e-12, 1000);
+		check(f.m_nStale == 0, "stop: no cost after the stop");
+		check(f.m_nStaleGrad == 0, "stop: no gradient after the stop");
+		check(fmin <= f0, "stop: no worse than the start");
+		f.m_maxEval = 0;
+		check(fabs(fmin - f(&x[0])) < 1e-9, "stop: cost of the returned point");
+	}
+
+	if (failures == 0) cout << "LbfgsTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
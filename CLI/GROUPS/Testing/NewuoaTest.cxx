@@ -0,0 +1,83 @@
+/*************************************************
+*	NewuoaTest.cxx
+*
+*	Unit test of the NEWUOA minimizer (newuoa.h)
+*	Part of the Groups command line module
+*************************************************/
+
+// minimization of a function with a known minimum, and the early stop of the registration at any evaluation: the
+// returned point is the best evaluated one, during the initial interpolation as well as during the iterations
+
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <vector>
+#include "newuoa.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+// weighted quadratic sum(w_i (x_i - c_i)^2): minimum 0 at c, with the best evaluated point
+class quadratic
+{
+public:
+	quadratic(int n): m_n(n), m_nEval(0), m_maxEval(0), m_best(n), m_bestCost(0) {}
+	float operator () (float *x)
+	{
+		float f = 0;
+		for (int i = 0; i < m_n; i++) f += (i + 1) * (x[i] - center(i)) * (x[i] - center(i));
+		if (m_nEval == 0 || f < m_bestCost)
+		{
+			m_best.assign(x, x + m_n);
+			m_bestCost = f;
+		}
+		m_nEval++;
+		return f;
+	}
+	bool stop(void) { return m_maxEval > 0 && m_nEval >= m_maxEval; }
+	static float center(int i) { return (i % 2 == 0) ? 0.5f: -0.25f * i; }
+
+	int m_n;
+	int m_nEval;
+	int m_maxEval;	// early stop after this number of evaluations (0: none)
+	vector<float> m_best;
+	float m_bestCost;
+};
+
+int main(void)
+{
+	int n = 6;
+
+	// minimum
+	{
+		vector<float> x(n, 0);
+		quadratic f(n);
+		min_newuoa(n, &x[0], f, 1.0f, 1e-6f, 5000);
+		double error = 0;
+		for (int i = 0; i < n; i++) error = max(error, (double)fabs(x[i] - quadratic::center(i)));
+		check(error < 1e-3, "minimum");
+	}
+
+	// early stop during the initial interpolation (2n + 1 points) and after it
+	for (int maxEval = 1; maxEval <= 4 * n; maxEval++)
+	{
+		vector<float> x(n, 0);
+		quadratic f(n);
+		f.m_maxEval = maxEval;
+		float fmin = min_newuoa(n, &x[0], f, 0.5f, 1e-6f, 5000);
+		check(f.m_nEval == maxEval, "stop: no evaluation after the stop");
+		check(x == f.m_best, (maxEval <= 2 * n + 1) ? "stop: best point of the initial interpolation": "stop: best point");
+		check(fmin == f.m_bestCost, "stop: cost of the best point");
+	}
+
+	if (failures == 0) cout << "NewuoaTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
@@ -0,0 +1,121 @@
+/*************************************************
+*	PropertyCacheTest.cxx
+*
+*	Unit test of PropertyCache
+*	Part of the Groups command line module
+*************************************************/
+
+// a cache gives back the values and statistics of its property file, and only of this file: property files of the
+// same name in other directories have their own caches, and a cache is not used once its property file changed
+
+#include <cstdio>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <vector>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <utime.h>
+#include "PropertyCache.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+// property file: 3 header lines followed by one value per vertex
+static void writeProperty(const string &filename, const vector<float> &value)
+{
+	FILE *fp = fopen(filename.c_str(), "w");
+	fprintf(fp, "NUMBER_OF_POINTS=%d\nDIMENSION=1\nTYPE=Scalar\n", (int)value.size());
+	for (int i = 0; i < value.size(); i++) fprintf(fp, "%f\n", value[i]);
+	fclose(fp);
+}
+
+static bool load(const string &property, const string &cache, vector<float> &value, float *stat)
+{
+	return PropertyCache::load(property.c_str(), cache.c_str(), value.size(), &value[0], stat);
+}
+
+int main(void)
+{
+	string root = "PropertyCacheTest-data", cacheDir = root + "/cache";
+	string property[2] = {root + "/a/subj_pp_paraPhi.txt", root + "/b/subj_pp_paraPhi.txt"};
+	mkdir(root.c_str(), 0755);
+	mkdir((root + "/a").c_str(), 0755);
+	mkdir((root + "/b").c_str(), 0755);
+	mkdir(cacheDir.c_str(), 0755);
+
+	// two cohorts with the same file name and different values
+	int n = 100;
+	vector<float> value[2] = {vector<float>(n), vector<float>(n)};
+	for (int i = 0; i < n; i++)
+	{
+		value[0][i] = 0.5f * i;
+		value[1][i] = 100 - i;
+	}
+	string cache[2];
+	for (int k = 0; k < 2; k++)
+	{
+		writeProperty(property[k], value[k]);
+		cache[k] = PropertyCache::cacheName(property[k].c_str(), cacheDir.c_str());
+		remove(cache[k].c_str());
+	}
+	check(cache[0] != cache[1], "one cache per property file");
+	check(cache[0].find("subj_pp_paraPhi.txt") != string::npos, "the cache name keeps the file name");
+	check(PropertyCache::cacheName(property[0].c_str(), cacheDir.c_str()) == cache[0], "stable cache name");
+	check(PropertyCache::cacheName(("./" + property[0]).c_str(), cacheDir.c_str()) == cache[0], "cache name of the full path");
+
+	vector<float> loaded(n);
+	float statistic[4];
+	check(!load(property[0], cache[0], loaded, statistic), "no cache yet");
+	for (int k = 0; k < 2; k++) check(PropertyCache::build(property[k].c_str(), cache[k].c_str(), 3), "build");
+	for (int k = 0; k < 2; k++)
+	{
+		check(load(property[k], cache[k], loaded, statistic), "load");
+		check(loaded == value[k], "values of its own property file");
+		float expected[4];
+		PropertyCache::statistics(&value[k][0], n, expected);
+		check(statistic[0] == expected[0] && statistic[1] == expected[1] && statistic[2] == expected[2] && statistic[3] == expected[3], "statistics");
+	}
+
+	// a cache of another file (e.g. an older cache name, or a shared directory) is not used
+	check(!load(property[1], cache[0], loaded, statistic), "cache of another property file");
+	loaded.resize(n + 1);
+	check(!load(property[0], cache[0], loaded, statistic), "other number of values");
+	loaded.resize(n);
+
+	// the property file changes: same size, other modification time
+	struct stat info;
+	stat(property[0].c_str(), &info);
+	struct utimbuf times = {info.st_atime, info.st_mtime - 10};
+	utime(property[0].c_str(), &times);
+	check(!load(property[0], cache[0], loaded, statistic), "modified property file");
+	check(PropertyCache::build(property[0].c_str(), cache[0].c_str(), 3) && load(property[0], cache[0], loaded, statistic), "rebuilt cache");
+
+	// other size
+	value[0].push_back(1);
+	writeProperty(property[0], value[0]);
+	times.modtime = info.st_mtime - 10;
+	utime(property[0].c_str(), &times);
+	check(!load(property[0], cache[0], loaded, statistic), "property file of another size");
+
+	for (int k = 0; k < 2; k++)
+	{
+		remove(cache[k].c_str());
+		remove(property[k].c_str());
+	}
+	rmdir(cacheDir.c_str());
+	rmdir((root + "/a").c_str());
+	rmdir((root + "/b").c_str());
+	rmdir(root.c_str());
+
+	if (failures == 0) cout << "PropertyCacheTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
@@ -0,0 +1,117 @@
+/*************************************************
+*	RunReportTest.cxx
+*
+*	Unit test of RunReport
+*	Part of the Groups command line module
+*************************************************/
+
+// the wall time of a phase covers its calls once even if they run concurrently, while its thread time sums them; the
+// memory growth of a phase is measured during the phase, not as the high-water mark of the process
+
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <thread>
+#include <vector>
+#include "RunReport.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << endl;
+	failures++;
+}
+
+// value of a field of a phase in the JSON report (-1 if it is not found)
+static double field(const string &report, const string &phase, const string &name)
+{
+	size_t pos = report.find("{\"name\": \"" + phase + "\"");
+	if (pos == string::npos) return -1;
+	pos = report.find("\"" + name + "\": ", pos);
+	if (pos == string::npos || pos > report.find('}', report.find("{\"name\": \"" + phase + "\""))) return -1;
+	return atof(report.c_str() + pos + name.size() + 4);
+}
+
+// resident memory kept by a phase
+static void allocate(vector<char> &buffer, size_t size)
+{
+	buffer.resize(size);
+	for (size_t i = 0; i < size; i += 4096) buffer[i] = 1;	// touch every page
+}
+
+int main(void)
+{
+	RunReport report;
+	const size_t mb = 1 << 20;
+
+	// sequential calls
+	for (int i = 0; i < 2; i++)
+	{
+		RunReport::Mark t = RunReport::mark();
+		this_thread::sleep_for(chrono::milliseconds(50));
+		report.add("sequential", t);
+	}
+
+	// 4 concurrent calls
+	vector<thread> worker;
+	for (int i = 0; i < 4; i++)
+		worker.push_back(thread([&report]()
+		{
+			RunReport::Mark t = RunReport::mark();
+			this_thread::sleep_for(chrono::milliseconds(200));
+			report.add("concurrent", t);
+		}));
+	for (int i = 0; i < worker.size(); i++) worker[i].join();
+
+	// memory kept by a phase, then memory released at the end of a phase
+	vector<char> kept, released;
+	RunReport::Mark t = RunReport::mark();
+	allocate(kept, 64 * mb);
+	report.add("kept", t);
+	t = RunReport::mark();
+	allocate(released, 128 * mb);
+	vector<char>().swap(released);
+	report.add("released", t);
+	t = RunReport::mark();
+	report.add("idle", t);
+	report.count("cost", 3);
+
+	const char *filename = "RunReportTest.json";
+	check(report.save(filename, true), "save");
+	FILE *fp = fopen(filename, "r");
+	string json;
+	char buffer[1024];
+	for (size_t n; fp != NULL && (n = fread(buffer, 1, sizeof(buffer), fp)) > 0; ) json.append(buffer, n);
+	if (fp != NULL) fclose(fp);
+	remove(filename);
+
+	check(json.find("\"completed\": true") != string::npos && json.find("\"cost\": 3") != string::npos, "report");
+	check(field(json, "sequential", "calls") == 2, "sequential: calls");
+	double seconds = field(json, "sequential", "seconds"), threadSeconds = field(json, "sequential", "thread_seconds");
+	check(seconds >= 0.1 && seconds < 0.5 && fabs(seconds - threadSeconds) < 1e-6, "sequential: wall time is the thread time");
+	check(field(json, "concurrent", "calls") == 4, "concurrent: calls");
+	seconds = field(json, "concurrent", "seconds");
+	threadSeconds = field(json, "concurrent", "thread_seconds");
+	check(seconds >= 0.2 && seconds < 0.6, "concurrent: wall time");
+	check(threadSeconds >= 0.8 && threadSeconds > 3 * seconds, "concurrent: thread time");
+
+	if (RunReport::currentRSS() > 0)
+	{
+		check(field(json, "kept", "rss_growth") >= 48 * mb, "kept: resident memory growth");
+		check(field(json, "kept", "peak_rss_growth") >= 48 * mb, "kept: peak growth");
+		check(field(json, "released", "rss_growth") < 32 * mb, "released: no resident memory growth");
+		check(field(json, "released", "peak_rss_growth") >= 96 * mb, "released: peak growth");
+		check(field(json, "idle", "rss_growth") < 32 * mb && field(json, "idle", "peak_rss_growth") == 0, "idle: the high-water mark is not reported");
+	}
+	else cout << "Resident memory not available: memory not tested" << endl;
+
+	if (failures == 0) cout << "RunReportTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
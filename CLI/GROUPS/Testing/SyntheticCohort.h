@@ -0,0 +1,179 @@
+/*************************************************
+*	SyntheticCohort.h
+*
+*	Synthetic cohorts of the tests and the benchmark
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <cmath>
+#include <cstdio>
+#include <map>
+#include <random>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <sys/stat.h>
+#include <unistd.h>
+
+using namespace std;
+
+// icosahedron subdivided level times, projected onto the unit sphere (10 * 4^level + 2 vertices)
+inline void icosphere(int level, vector<float> &vertex, vector<int> &face)
+{
+	float t = (1 + sqrt(5.0)) / 2.0;
+	float v[12][3] = {{-1, t, 0}, {1, t, 0}, {-1, -t, 0}, {1, -t, 0}, {0, -1, t}, {0, 1, t}, {0, -1, -t}, {0, 1, -t}, {t, 0, -1}, {t, 0, 1}, {-t, 0, -1}, {-t, 0, 1}};
+	int f[20][3] = {{0, 11, 5}, {0, 5, 1}, {0, 1, 7}, {0, 7, 10}, {0, 10, 11}, {1, 5, 9}, {5, 11, 4}, {11, 10, 2}, {10, 7, 6}, {7, 1, 8},
+					{3, 9, 4}, {3, 4, 2}, {3, 2, 6}, {3, 6, 8}, {3, 8, 9}, {4, 9, 5}, {2, 4, 11}, {6, 2, 10}, {8, 6, 7}, {9, 8, 1}};
+	vertex.clear();
+	face.clear();
+	for (int i = 0; i < 12; i++)
+	{
+		float norm = sqrt(v[i][0] * v[i][0] + v[i][1] * v[i][1] + v[i][2] * v[i][2]);
+		for (int k = 0; k < 3; k++) vertex.push_back(v[i][k] / norm);
+	}
+	for (int i = 0; i < 20; i++) for (int k = 0; k < 3; k++) face.push_back(f[i][k]);
+
+	for (int l = 0; l < level; l++)
+	{
+		map<pair<int, int>, int> midpoint;
+		vector<int> subdivided;
+		for (int i = 0; i < face.size(); i += 3)
+		{
+			int m[3];
+			for (int k = 0; k < 3; k++)
+			{
+				int a = face[i + k], b = face[i + (k + 1) % 3];
+				pair<int, int> edge(min(a, b), max(a, b));
+				if (midpoint.find(edge) == midpoint.end())
+				{
+					float p[3], norm = 0;
+					for (int j = 0; j < 3; j++) p[j] = vertex[a * 3 + j] + vertex[b * 3 + j], norm += p[j] * p[j];
+					norm = sqrt(norm);
+					midpoint[edge] = vertex.size() / 3;
+					for (int j = 0; j < 3; j++) vertex.push_back(p[j] / norm);
+				}
+				m[k] = midpoint[edge];
+			}
+			int sub[12] = {face[i], m[0], m[2], face[i + 1], m[1], m[0], face[i + 2], m[2], m[1], m[0], m[1], m[2]};
+			subdivided.insert(subdivided.end(), sub, sub + 12);
+		}
+		face.swap(subdivided);
+	}
+}
+
+// VTK polydata of a triangle mesh
+inline bool saveVTK(const string &filename, const vector<float> &vertex, const vector<int> &face)
+{
+	FILE *fp = fopen(filename.c_str(), "w");
+	if (fp == NULL) return false;
+	fprintf(fp, "# vtk DataFile Version 3.0\nGroups synthetic mesh\nASCII\nDATASET POLYDATA\n");
+	fprintf(fp, "POINTS %d float\n", (int)vertex.size() / 3);
+	for (int i = 0; i < vertex.size(); i += 3) fprintf(fp, "%f %f %f\n", vertex[i], vertex[i + 1], vertex[i + 2]);
+	fprintf(fp, "POLYGONS %d %d\n", (int)face.size() / 3, (int)face.size() / 3 * 4);
+	for (int i = 0; i < face.size(); i += 3) fprintf(fp, "3 %d %d %d\n", face[i], face[i + 1], face[i + 2]);
+	fclose(fp);
+	return true;
+}
+
+// cohort of nSubj randomly rotated icospheres written in dir (created if needed): the properties are smooth bumps
+// defined on the unrotated sphere, so the rotations are the misalignments to be recovered; surfaces are the spheres
+// with a radius modulated by the first property
+inline bool generateCohort(const string &dir, int nSubj, int level, int nProperties, int nLandmarks, int seed, vector<string> &sphere,
+						   vector<string> &surf, vector<string> &property, vector<string> &landmark, vector<string> &output)
+{
+	mt19937 rng(seed);
+	uniform_real_distribution<float> uniform(-1, 1);
+	vector<float> vertex;
+	vector<int> face;
+	icosphere(level, vertex, face);
+	int nVertex = vertex.size() / 3;
+
+	// bump centers and widths shared by the cohort
+	int nBump = 6;
+	vector<float> center(nProperties * nBump * 3), width(nProperties * nBump);
+	for (int i = 0; i < nProperties * nBump; i++)
+	{
+		float p[3] = {uniform(rng), uniform(rng), uniform(rng)};
+		float norm = sqrt(p[0] * p[0] + p[1] * p[1] + p[2] * p[2]) + 1e-6f;
+		for (int k = 0; k < 3; k++) center[i * 3 + k] = p[k] / norm;
+		width[i] = 0.1f + 0.2f * fabs(uniform(rng));
+	}
+
+	mkdir(dir.c_str(), 0755);
+	for (int subj = 0; subj < nSubj; subj++)
+	{
+		stringstream name;
+		name << dir << "/subject" << subj;
+
+		// random rotation of up to 0.3 rad around a random axis (Rodrigues)
+		float axis[3] = {uniform(rng), uniform(rng), uniform(rng)};
+		float norm = sqrt(axis[0] * axis[0] + axis[1] * axis[1] + axis[2] * axis[2]) + 1e-6f;
+		for (int k = 0; k < 3; k++) axis[k] /= norm;
+		float theta = 0.3f * uniform(rng), ct = cos(theta), st = sin(theta);
+		vector<float> rotated(vertex.size()), surface(vertex.size());
+		vector<float> value(nProperties * nVertex, 0);
+		for (int i = 0; i < nVertex; i++)
+		{
+			const float *p = &vertex[i * 3];
+			float d = axis[0] * p[0] + axis[1] * p[1] + axis[2] * p[2];
+			float x[3] = {axis[1] * p[2] - axis[2] * p[1], axis[2] * p[0] - axis[0] * p[2], axis[0] * p[1] - axis[1] * p[0]};
+			for (int k = 0; k < 3; k++) rotated[i * 3 + k] = p[k] * ct + x[k] * st + axis[k] * d * (1 - ct);
+			for (int n = 0; n < nProperties; n++)
+				for (int b = 0; b < nBump; b++)
+				{
+					const float *q = &center[(n * nBump + b) * 3];
+					float dot = p[0] * q[0] + p[1] * q[1] + p[2] * q[2];
+					value[n * nVertex + i] += exp(-(1 - dot) / width[n * nBump + b]) * (1 + 0.05f * uniform(rng));
+				}
+			float radius = 1 + 0.1f * ((nProperties > 0) ? value[i]: 0);
+			for (int k = 0; k < 3; k++) surface[i * 3 + k] = rotated[i * 3 + k] * radius;
+		}
+
+		sphere.push_back(name.str() + ".sphere.vtk");
+		surf.push_back(name.str() + ".surf.vtk");
+		output.push_back(name.str() + ".coeff");
+		if (!saveVTK(sphere.back(), rotated, face) || !saveVTK(surf.back(), surface, face)) return false;
+
+		// property files: 3 header lines followed by one value per vertex
+		for (int n = 0; n < nProperties; n++)
+		{
+			stringstream pname;
+			pname << name.str() << ".property" << n << ".txt";
+			property.push_back(pname.str());
+			FILE *fp = fopen(pname.str().c_str(), "w");
+			if (fp == NULL) return false;
+			fprintf(fp, "NUMBER_OF_POINTS=%d\nDIMENSION=1\nTYPE=Scalar\n", nVertex);
+			for (int i = 0; i < nVertex; i++) fprintf(fp, "%f\n", value[n * nVertex + i]);
+			fclose(fp);
+		}
+
+		// landmarks: the same vertex indices for all the subjects
+		if (nLandmarks > 0)
+		{
+			landmark.push_back(name.str() + ".landmark.txt");
+			FILE *fp = fopen(landmark.back().c_str(), "w");
+			if (fp == NULL) return false;
+			for (int i = 0; i < nLandmarks; i++) fprintf(fp, "%d\n", (int)((long long)i * nVertex / nLandmarks));
+			fclose(fp);
+		}
+	}
+	return true;
+}
+
+// files of a synthetic cohort
+inline void removeCohort(const string &dir, const vector<string> &sphere, const vector<string> &surf, const vector<string> &property,
+						 const vector<string> &landmark, const vector<string> &output)
+{
+	const vector<string> *list[] = {&sphere, &surf, &property, &landmark, &output};
+	for (int l = 0; l < 5; l++)
+		for (int i = 0; i < list[l]->size(); i++) remove((*list[l])[i].c_str());
+	rmdir(dir.c_str());
+}
+
+inline vector<const char *> cstr(const vector<string> &list)
+{
+	vector<const char *> p;
+	for (int i = 0; i < list.size(); i++) p.push_back(list[i].c_str());
+	return p;
+}
@@ -0,0 +1,62 @@
+/*************************************************
+*	ThreadPoolTest.cxx
+*
+*	Unit test of ThreadPool
+*	Part of the Groups command line module
+*************************************************/
+
+// every task runs exactly once per run(), whatever the number of threads and tasks, and run() returns once they are all done
+
+#include <atomic>
+#include <cstdlib>
+#include <iostream>
+#include <vector>
+#include "ThreadPool.h"
+
+using namespace std;
+
+static int failures = 0;
+
+static void check(bool condition, const char *what, int nThreads, int n)
+{
+	if (condition) return;
+	cout << "FAILED: " << what << " (threads " << nThreads << ", tasks " << n << ")" << endl;
+	failures++;
+}
+
+int main(void)
+{
+	int threads[] = {1, 2, 4, 0};
+	int tasks[] = {0, 1, 2, 3, 17, 1000};
+	for (int t = 0; t < 4; t++)
+	{
+		ThreadPool pool(threads[t]);
+		check(pool.size() >= 1, "size", threads[t], 0);
+		if (threads[t] > 0) check(pool.size() == threads[t], "size", threads[t], 0);
+
+		for (int k = 0; k < 6; k++)
+		{
+			int n = tasks[k];
+			// many runs on the same pool: the workers go through many generations
+			for (int r = 0; r < 50; r++)
+			{
+				vector<atomic<int> > count(n);
+				for (int i = 0; i < n; i++) count[i] = 0;
+				pool.run(n, [&](int i) { count[i]++; });
+				bool once = true;
+				for (int i = 0; i < n; i++) once = once && (count[i] == 1);
+				check(once, "each task runs once", threads[t], n);
+			}
+
+			// the results are complete when run() returns
+			vector<double> result(n, 0);
+			pool.run(n, [&](int i) { double s = 0; for (int j = 0; j <= i % 100; j++) s += j; result[i] = s; });
+			bool complete = true;
+			for (int i = 0; i < n; i++) complete = complete && (result[i] == (i % 100) * (i % 100 + 1) / 2);
+			check(complete, "results are complete", threads[t], n);
+		}
+	}
+
+	if (failures == 0) cout << "ThreadPoolTest passed" << endl;
+	return (failures == 0) ? EXIT_SUCCESS: EXIT_FAILURE;
+}
@@ -0,0 +1,325 @@
+/*************************************************
+*	GroupsBenchmark.cxx
+*
+*	Benchmark of the Groups kernels
+*	Part of the Groups command line module
+*************************************************/
+
+// headless benchmark of the registration hot paths on synthetic cohorts (no Slicer, no input data):
+//	GroupsBenchmark [--subjects 8,32] [--vertices 2562] [--degrees 5] [--properties 2] [--landmarks 0] [--repeat 5]
+//	                [--maxIter 200] [--threads 0] [--seed 1] [--workDir dir] [--label name] [--output results.json] [--noRun]
+// every combination of subjects x vertices x degrees is a case; timings (seconds) are written as JSON
+
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <ctime>
+#include <fstream>
+#include <iostream>
+#include <map>
+#include <random>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <sys/stat.h>
+#include <lapacke.h>
+#include "Mesh.h"
+#include "AABB.h"
+#include "FaceLocator.h"
+#include "GroupwiseRegistration.h"
+#include "SyntheticCohort.h"
+
+using namespace std;
+
+struct Options
+{
+	vector<int> subjects;
+	vector<int> vertices;
+	vector<int> degrees;
+	int properties;
+	int landmarks;
+	int repeat;
+	int maxIter;
+	int threads;
+	int seed;
+	bool run;
+	string workDir;
+	string label;
+	string output;
+};
+
+struct Case
+{
+	int nSubj;
+	int level;	// icosphere subdivision level of the synthetic spheres
+	int nVertex;
+	int degree;
+	map<string, vector<double> > timing;
+	int nSamples;
+};
+
+static double now(void)
+{
+	return chrono::duration<double>(chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+static vector<int> intList(const char *arg)
+{
+	vector<int> list;
+	stringstream ss(arg);
+	string item;
+	while (getline(ss, item, ',')) if (!item.empty()) list.push_back(atoi(item.c_str()));
+	return list;
+}
+
+static void runCase(const Options &opt, Case &c)
+{
+	vector<string> sphere, surf, property, landmark, output;
+	double t0 = now();
+	stringstream dir;
+	dir << opt.workDir << "/s" << c.nSubj << "_v" << c.nVertex;
+	mkdir(opt.workDir.c_str(), 0755);
+	if (!generateCohort(dir.str(), c.nSubj, c.level, opt.properties, opt.landmarks, opt.seed, sphere, surf, property, landmark, output))
+	{
+		cerr << " Fatal error: the synthetic cohort cannot be written in " << opt.workDir << endl;
+		exit(EXIT_FAILURE);
+	}
+	c.timing["generate"].push_back(now() - t0);
+
+	vector<const char *> sphereList = cstr(sphere), propertyList = cstr(property), landmarkList = cstr(landmark), outputList = cstr(output);
+	vector<float> weight(max(opt.properties, 1), 1);
+
+	// the library is verbose: its log is discarded during the measurements
+	ofstream null;
+	streambuf *log = cout.rdbuf(null.rdbuf());
+
+	// initialization: meshes, spherical harmonics, AABB trees, properties and first feature vectors
+	GroupwiseRegistration *groups = NULL;
+	for (int r = 0; r < opt.repeat; r++)
+	{
+		delete groups;
+		t0 = now();
+		groups = new GroupwiseRegistration(&sphereList[0], c.nSubj, (opt.properties > 0) ? &propertyList[0]: NULL, opt.properties, &outputList[0], &weight[0], c.degree,
+										   (opt.landmarks > 0) ? &landmarkList[0]: NULL, 0, NULL, NULL, opt.maxIter, 0, 0, NULL, 5, 100, NULL, false, NULL, NULL, opt.threads);
+		c.timing["init"].push_back(now() - t0);
+	}
+
+	// cost evaluations: all the subjects changed, a single subject changed, nothing changed
+	mt19937 rng(opt.seed);
+	uniform_real_distribution<float> uniform(-1e-3f, 1e-3f);
+	float *coeff = groups->coefficients();
+	int nActive = 16 * c.nSubj * 2;	// coefficients of the first stage (degree 3)
+	groups->cost(coeff);
+	for (int r = 0; r < opt.repeat; r++)
+	{
+		for (int i = 0; i < nActive; i++) coeff[i] += uniform(rng);
+		t0 = now();
+		groups->cost(coeff);
+		c.timing["cost_all"].push_back(now() - t0);
+
+		for (int i = 0; i < 16; i++) coeff[i * c.nSubj * 2] += uniform(rng);
+		t0 = now();
+		groups->cost(coeff);
+		c.timing["cost_one"].push_back(now() - t0);
+
+		t0 = now();
+		groups->cost(coeff);
+		c.timing["cost_unchanged"].push_back(now() - t0);
+	}
+	delete groups;
+
+	// AABB tree of a single sphere: construction, update and closest face queries of an icosphere of level 4,
+	// and face walks from the faces of the queries to the faces of the queries slightly rotated (one evaluation step)
+	Mesh mesh;
+	mesh.openFile(sphere[0].c_str());
+	vector<float> query;
+	vector<int> queryFace;
+	icosphere(4, query, queryFace);
+	c.nSamples = query.size() / 3;
+	vector<float> moved(query.size());
+	for (int i = 0; i < c.nSamples; i++)
+	{
+		float angle = 0.01f, *p = &query[i * 3];
+		moved[i * 3] = p[0] * cos(angle) - p[1] * sin(angle);
+		moved[i * 3 + 1] = p[0] * sin(angle) + p[1] * cos(angle);
+		moved[i * 3 + 2] = p[2];
+	}
+	vector<int> cache(c.nSamples);
+	for (int r = 0; r < opt.repeat; r++)
+	{
+		t0 = now();
+		AABB tree(&mesh);
+		c.timing["aabb_build"].push_back(now() - t0);
+
+		t0 = now();
+		tree.update();
+		c.timing["aabb_update"].push_back(now() - t0);
+
+		t0 = now();
+		float bary[3];
+		for (int i = 0; i < c.nSamples; i++) cache[i] = tree.closestFace(&query[i * 3], bary);
+		c.timing["closest_face"].push_back(now() - t0);
+
+		FaceLocator locator(&mesh, &tree);
+		FaceLocator::Counters counters;
+		t0 = now();
+		for (int i = 0; i < c.nSamples; i++) locator.locate(&moved[i * 3], cache[i], bary, counters);
+		c.timing["face_walk"].push_back(now() - t0);
+	}
+
+	// dual covariance and its eigenvalues for a feature vector of the same size as in the registration
+	int dim = opt.landmarks * 3 + c.nSamples * opt.properties;
+	if (dim > 0)
+	{
+		vector<float> feature(c.nSubj * dim), featureWeight(dim, 1), cov(c.nSubj * c.nSubj), eig(c.nSubj), work(c.nSubj * 3 - 1);
+		for (int i = 0; i < feature.size(); i++) feature[i] = uniform(rng) * 1e3f;
+		for (int r = 0; r < opt.repeat; r++)
+		{
+			t0 = now();
+			Statistics::wcov_trans(&feature[0], c.nSubj, dim, &cov[0], &featureWeight[0]);
+			c.timing["wcov_trans"].push_back(now() - t0);
+
+			char jobz = 'N', uplo = 'L';
+			int n = c.nSubj, lda = c.nSubj, lwork = c.nSubj * 3 - 1, info;
+			t0 = now();
+			ssyev_(&jobz, &uplo, &n, &cov[0], &lda, &eig[0], &work[0], &lwork, &info);
+			c.timing["ssyev"].push_back(now() - t0);
+		}
+	}
+
+	// end-to-end optimization
+	if (opt.run)
+	{
+		t0 = now();
+		GroupwiseRegistration run(&sphereList[0], c.nSubj, (opt.properties > 0) ? &propertyList[0]: NULL, opt.properties, &outputList[0], &weight[0], c.degree,
+								  (opt.landmarks > 0) ? &landmarkList[0]: NULL, 0, NULL, NULL, opt.maxIter, 0, 0, NULL, 5, 100, NULL, true, NULL, NULL, opt.threads);
+		run.run();
+		c.timing["run"].push_back(now() - t0);
+	}
+	cout.rdbuf(log);
+}
+
+static void summary(const vector<double> &t, double &minimum, double &median, double &mean)
+{
+	vector<double> sorted(t);
+	sort(sorted.begin(), sorted.end());
+	minimum = sorted[0];
+	median = (sorted.size() % 2 == 1) ? sorted[sorted.size() / 2]: (sorted[sorted.size() / 2 - 1] + sorted[sorted.size() / 2]) / 2;
+	mean = 0;
+	for (int i = 0; i < sorted.size(); i++) mean += sorted[i];
+	mean /= sorted.size();
+}
+
+static void writeJSON(ostream &os, const Options &opt, const vector<Case> &cases)
+{
+	char date[32];
+	time_t t = time(NULL);
+	strftime(date, sizeof(date), "%Y-%m-%dT%H:%M:%S", localtime(&t));
+
+	os << "{\n";
+	os << "  \"benchmark\": \"GroupsBenchmark\",\n";
+	os << "  \"version\": 1,\n";
+	os << "  \"label\": \"" << opt.label << "\",\n";
+	os << "  \"date\": \"" << date << "\",\n";
+	os << "  \"repeat\": " << opt.repeat << ",\n";
+	os << "  \"threads\": " << opt.threads << ",\n";
+	os << "  \"seed\": " << opt.seed << ",\n";
+	os << "  \"cases\": [\n";
+	for (int i = 0; i < cases.size(); i++)
+	{
+		const Case &c = cases[i];
+		os << "    {\n";
+		os << "      \"subjects\": " << c.nSubj << ", \"vertices\": " << c.nVertex << ", \"degree\": " << c.degree;
+		os << ", \"properties\": " << opt.properties << ", \"landmarks\": " << opt.landmarks << ", \"samples\": " << c.nSamples << ", \"maxIter\": " << opt.maxIter << ",\n";
+		os << "      \"timings\": {\n";
+		int k = 0;
+		for (map<string, vector<double> >::const_iterator it = c.timing.begin(); it != c.timing.end(); it++, k++)
+		{
+			double minimum, median, mean;
+			summary(it->second, minimum, median, mean);
+			os << "        \"" << it->first << "\": {\"min\": " << minimum << ", \"median\": " << median << ", \"mean\": " << mean << ", \"n\": " << it->second.size() << "}";
+			os << ((k + 1 < c.timing.size()) ? ",\n": "\n");
+		}
+		os << "      }\n";
+		os << "    }" << ((i + 1 < cases.size()) ? ",\n": "\n");
+	}
+	os << "  ]\n";
+	os << "}\n";
+}
+
+int main(int argc, char *argv[])
+{
+	Options opt;
+	opt.subjects.push_back(8);
+	opt.vertices.push_back(2562);
+	opt.degrees.push_back(5);
+	opt.properties = 2;
+	opt.landmarks = 0;
+	opt.repeat = 5;
+	opt.maxIter = 200;
+	opt.threads = 0;
+	opt.seed = 1;
+	opt.run = true;
+	opt.workDir = "GroupsBenchmark-data";
+	opt.label = "";
+
+	for (int i = 1; i < argc; i++)
+	{
+		string arg = argv[i];
+		bool value = i + 1 < argc;
+		if (arg == "--subjects" && value) opt.subjects = intList(argv[++i]);
+		else if (arg == "--vertices" && value) opt.vertices = intList(argv[++i]);
+		else if (arg == "--degrees" && value) opt.degrees = intList(argv[++i]);
+		else if (arg == "--properties" && value) opt.properties = atoi(argv[++i]);
+		else if (arg == "--landmarks" && value) opt.landmarks = atoi(argv[++i]);
+		else if (arg == "--repeat" && value) opt.repeat = max(atoi(argv[++i]), 1);
+		else if (arg == "--maxIter" && value) opt.maxIter = atoi(argv[++i]);
+		else if (arg == "--threads" && value) opt.threads = atoi(argv[++i]);
+		else if (arg == "--seed" && value) opt.seed = atoi(argv[++i]);
+		else if (arg == "--workDir" && value) opt.workDir = argv[++i];
+		else if (arg == "--label" && value) opt.label = argv[++i];
+		else if (arg == "--output" && value) opt.output = argv[++i];
+		else if (arg == "--noRun") opt.run = false;
+		else
+		{
+			cerr << "Usage: " << argv[0] << " [--subjects 8,32] [--vertices 2562] [--degrees 5] [--properties 2] [--landmarks 0] [--repeat 5]\n"
+				 << "       [--maxIter 200] [--threads 0] [--seed 1] [--workDir dir] [--label name] [--output results.json] [--noRun]\n";
+			return EXIT_FAILURE;
+		}
+	}
+	if (opt.properties == 0 && opt.landmarks == 0)
+	{
+		cerr << " Fatal error: neither landmarks nor properties are requested!" << endl;
+		return EXIT_FAILURE;
+	}
+
+	vector<Case> cases;
+	for (int s = 0; s < opt.subjects.size(); s++)
+		for (int v = 0; v < opt.vertices.size(); v++)
+			for (int d = 0; d < opt.degrees.size(); d++)
+			{
+				// smallest icosphere with at least the requested number of vertices (10 * 4^level + 2)
+				Case c;
+				c.nSubj = max(opt.subjects[s], 2);
+				c.level = 0;
+				while (10 * (1 << (2 * c.level)) + 2 < opt.vertices[v] && c.level < 9) c.level++;
+				c.nVertex = 10 * (1 << (2 * c.level)) + 2;
+				c.degree = opt.degrees[d];
+				c.nSamples = 0;
+				cerr << "Case: " << c.nSubj << " subjects, " << c.nVertex << " vertices, degree " << c.degree << endl;
+				runCase(opt, c);
+				cases.push_back(c);
+			}
+
+	if (opt.output.empty()) writeJSON(cout, opt, cases);
+	else
+	{
+		ofstream os(opt.output.c_str());
+		writeJSON(os, opt, cases);
+		cerr << "Results: " << opt.output << endl;
+	}
+	return EXIT_SUCCESS;
+}
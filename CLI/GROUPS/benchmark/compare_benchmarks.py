@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Compare two GroupsBenchmark JSON results (e.g. two commits):
+    python compare_benchmarks.py baseline.json candidate.json [--threshold 1.1]
+Print the median time of each measurement of the cases found in both files and the ratio candidate / baseline.
+The exit code is 1 if a ratio exceeds the threshold (regression), 0 otherwise.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+CASE_KEYS = ("subjects", "vertices", "degree", "properties", "landmarks", "maxIter")
+
+
+def loadCases(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    return results, dict((tuple(case[key] for key in CASE_KEYS), case) for case in results["cases"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two GroupsBenchmark JSON results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=1.1, help="ratio above which a measurement is a regression")
+    args = parser.parse_args(argv)
+
+    baseline, baselineCases = loadCases(args.baseline)
+    candidate, candidateCases = loadCases(args.candidate)
+    print("baseline: %s %s" % (baseline.get("label", ""), baseline.get("date", "")))
+    print("candidate: %s %s" % (candidate.get("label", ""), candidate.get("date", "")))
+
+    regression = False
+    for key in sorted(set(baselineCases) & set(candidateCases)):
+        print("\n" + ", ".join("%s=%s" % (name, value) for name, value in zip(CASE_KEYS, key)))
+        before = baselineCases[key]["timings"]
+        after = candidateCases[key]["timings"]
+        for name in sorted(set(before) & set(after)):
+            t0 = before[name]["median"]
+            t1 = after[name]["median"]
+            ratio = t1 / t0 if t0 > 0 else float("inf")
+            flag = ""
+            if ratio > args.threshold:
+                flag = "  <-- slower"
+                regression = True
+            print("  %-16s %12.6f %12.6f %8.3fx%s" % (name, t0, t1, ratio, flag))
+    return 1 if regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
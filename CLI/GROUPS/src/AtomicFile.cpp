@@ -0,0 +1,42 @@
+/*************************************************
+*	AtomicFile.cpp
+*
+*	Replacement of the output files
+*	Part of the Groups command line module
+*************************************************/
+
+#include "AtomicFile.h"
+
+string AtomicFile::temporary(const char *filename)
+{
+	return string(filename) + ".tmp";
+}
+
+bool AtomicFile::commit(FILE *fp, const string &tmp, const char *filename, bool written)
+{
+	// closes the temporary file, which replaces the destination only if it is complete
+	written = (fclose(fp) == 0) && written;
+	if (!written)
+	{
+		remove(tmp.c_str());
+		return false;
+	}
+	return replace(tmp, filename);
+}
+
+bool AtomicFile::replace(const string &tmp, const char *filename)
+{
+	if (rename(tmp.c_str(), filename) != 0)	// the destination may need to be removed first (Windows)
+	{
+		FILE *fp = fopen(tmp.c_str(), "rb");
+		if (fp == NULL) return false;	// nothing to replace the destination with
+		fclose(fp);
+		remove(filename);
+		if (rename(tmp.c_str(), filename) != 0)
+		{
+			remove(tmp.c_str());
+			return false;
+		}
+	}
+	return true;
+}
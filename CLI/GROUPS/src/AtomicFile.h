@@ -0,0 +1,26 @@
+/*************************************************
+*	AtomicFile.h
+*
+*	Replacement of the output files
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <cstdio>
+#include <string>
+
+using namespace std;
+
+// an output file is written next to its destination first ([filename].tmp), which it then replaces:
+// a reader (or a resumed run) never sees a partial file
+//	string tmp = AtomicFile::temporary(filename);
+//	FILE *fp = fopen(tmp.c_str(), "w");
+//	... (written: false if a write failed)
+//	AtomicFile::commit(fp, tmp, filename, written);
+class AtomicFile
+{
+public:
+	static string temporary(const char *filename);
+	static bool commit(FILE *fp, const string &tmp, const char *filename, bool written = true);
+	static bool replace(const string &tmp, const char *filename);
+};
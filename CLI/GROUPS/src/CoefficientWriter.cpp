@@ -0,0 +1,179 @@
+/*************************************************
+*	CoefficientWriter.cpp
+*
+*	Background writer of the best coefficients
+*	Part of the Groups command line module
+*************************************************/
+
+#include <cstdio>
+#include <cstring>
+#include <iostream>
+#include <string>
+#include "AtomicFile.h"
+#include "CoefficientWriter.h"
+
+CoefficientWriter::CoefficientWriter(int nSubj, int degree, const char **output, const float *pole, float interval, int maxPending, const char *container, bool text)
+{
+	m_nSubj = nSubj;
+	m_degree = degree;
+	m_output = output;
+	for (int subj = 0; subj < nSubj; subj++) m_name.push_back(subjectName(output[subj]));
+	m_container = (container != NULL) ? container: "";
+	m_text = text;
+	m_pole.assign(pole, pole + nSubj * 3);
+	m_best.resize((degree + 1) * (degree + 1) * nSubj * 2);
+	m_snapshot.resize(m_best.size());
+	m_pending = 0;
+	m_maxPending = (maxPending > 0) ? maxPending: 1;
+	m_interval = chrono::duration<float>(interval);
+	m_stop = false;
+	m_thread = thread(&CoefficientWriter::loop, this);
+}
+
+CoefficientWriter::~CoefficientWriter(void)
+{
+	{
+		lock_guard<mutex> lock(m_mutex);
+		m_stop = true;
+	}
+	m_cond.notify_one();
+	m_thread.join();
+	flush();
+}
+
+void CoefficientWriter::update(const float *coeff)
+{
+	// only a copy in the optimization loop: the files are written by the background thread
+	bool notify;
+	{
+		lock_guard<mutex> lock(m_mutex);
+		memcpy(&m_best[0], coeff, sizeof(float) * m_best.size());
+		m_pending++;
+		notify = (m_pending >= m_maxPending);
+	}
+	if (notify) m_cond.notify_one();
+}
+
+void CoefficientWriter::flush(void)
+{
+	lock_guard<mutex> writeLock(m_writeMutex);
+	{
+		lock_guard<mutex> lock(m_mutex);
+		if (m_pending == 0) return;
+		m_snapshot = m_best;
+		m_pending = 0;
+	}
+	write();
+}
+
+void CoefficientWriter::loop(void)
+{
+	unique_lock<mutex> lock(m_mutex);
+	while (!m_stop)
+	{
+		m_cond.wait_for(lock, m_interval, [this] { return m_stop || m_pending >= m_maxPending; });
+		if (m_pending == 0) continue;
+		
+		// write outside the lock so that update() never waits for the disk
+		lock.unlock();
+		flush();
+		lock.lock();
+	}
+}
+
+void CoefficientWriter::write(void)
+{
+	// a file which cannot be replaced keeps its previous solution: it is written again with the next one
+	if (m_text)
+		for (int subj = 0; subj < m_nSubj; subj++)
+			if (!save(m_output[subj], &m_pole[subj * 3], m_degree, &m_snapshot[0], m_nSubj, subj))
+				cout << " Warning: the coefficients cannot be written to " << m_output[subj] << endl;
+	if (!m_container.empty() && !saveContainer(m_container.c_str(), m_name, &m_pole[0], m_degree, &m_snapshot[0]))
+		cout << " Warning: the coefficients cannot be written to " << m_container << endl;
+}
+
+string CoefficientWriter::subjectName(const char *output)
+{
+	// [dir]/[name].coeff -> [name]
+	string name = output;
+	size_t pivot = name.find_last_of("/\\");
+	if (pivot != string::npos) name = name.substr(pivot + 1);
+	pivot = name.rfind('.');
+	if (pivot != string::npos) name = name.substr(0, pivot);
+	return name;
+}
+
+bool CoefficientWriter::saveContainer(const char *filename, const vector<string> &name, const float *pole, int degree, const float *coeff)
+{
+	int nSubj = name.size();
+	string names;
+	for (int subj = 0; subj < nSubj; subj++) names += name[subj] + "\n";
+	int length = names.size();
+	int offset = 8 + sizeof(int) * 4 + sizeof(float) * nSubj * 3 + length;
+	offset = (offset + 15) / 16 * 16;	// aligned coefficients for memory mapping
+	int nCoeff = (degree + 1) * (degree + 1) * nSubj * 2;
+
+	string tmp = AtomicFile::temporary(filename);
+	FILE *fp = fopen(tmp.c_str(), "wb");
+	if (fp == NULL) return false;
+	bool written = fwrite("GRPCOEF1", 1, 8, fp) == 8 && fwrite(&nSubj, sizeof(int), 1, fp) == 1 &&
+				fwrite(&degree, sizeof(int), 1, fp) == 1 && fwrite(&offset, sizeof(int), 1, fp) == 1 &&
+				fwrite(&length, sizeof(int), 1, fp) == 1 && fwrite(pole, sizeof(float), nSubj * 3, fp) == nSubj * 3 &&
+				fwrite(names.c_str(), 1, length, fp) == length;
+	for (long pos = ftell(fp); pos < offset && written; pos++) written = fputc(0, fp) != EOF;
+	written = written && fwrite(coeff, sizeof(float), nCoeff, fp) == nCoeff;
+	return AtomicFile::commit(fp, tmp, filename, written);
+}
+
+bool CoefficientWriter::loadContainer(const char *filename, vector<string> &name, vector<float> &pole, int &degree, vector<float> &coeff)
+{
+	FILE *fp = fopen(filename, "rb");
+	if (fp == NULL) return false;
+
+	char magic[8];
+	int nSubj, offset, length;
+	bool valid = fread(magic, 1, 8, fp) == 8 && memcmp(magic, "GRPCOEF1", 8) == 0 &&
+				fread(&nSubj, sizeof(int), 1, fp) == 1 && fread(&degree, sizeof(int), 1, fp) == 1 &&
+				fread(&offset, sizeof(int), 1, fp) == 1 && fread(&length, sizeof(int), 1, fp) == 1 &&
+				nSubj > 0 && degree >= 0 && length >= 0;
+	if (valid)
+	{
+		pole.resize(nSubj * 3);
+		vector<char> names(length + 1, 0);
+		valid = fread(&pole[0], sizeof(float), nSubj * 3, fp) == nSubj * 3 && fread(&names[0], 1, length, fp) == length;
+
+		name.clear();
+		string subject;
+		for (int i = 0; i < length && valid; i++)
+		{
+			if (names[i] == '\n') { name.push_back(subject); subject.clear(); }
+			else subject += names[i];
+		}
+		valid = valid && name.size() == nSubj;
+	}
+	if (valid)
+	{
+		int nCoeff = (degree + 1) * (degree + 1) * nSubj * 2;
+		coeff.resize(nCoeff);
+		valid = fseek(fp, offset, SEEK_SET) == 0 && fread(&coeff[0], sizeof(float), nCoeff, fp) == nCoeff;
+	}
+	fclose(fp);
+
+	return valid;
+}
+
+bool CoefficientWriter::save(const char *filename, const float *pole, int degree, const float *coeff, int nSubj, int subj)
+{
+	// write to a temporary file then rename it: a reader (or a resumed run) never sees a partial file
+	string tmp = AtomicFile::temporary(filename);
+	FILE *fp = fopen(tmp.c_str(), "w");
+	if (fp == NULL) return false;
+	bool written = fprintf(fp, "%f %f %f\n", pole[0], pole[1], pole[2]) > 0;
+	written = fprintf(fp, "%d\n", degree) > 0 && written;
+	int n = (degree + 1) * (degree + 1);
+	for (int i = 0; i < n; i++)
+	{
+		written = fprintf(fp, "%f %f\n", coeff[nSubj * 2 * i + subj * 2], coeff[nSubj * 2 * i + subj * 2 + 1]) > 0 && written;
+	}
+	return AtomicFile::commit(fp, tmp, filename, written);
+}
@@ -0,0 +1,63 @@
+/*************************************************
+*	CoefficientWriter.h
+*
+*	Background writer of the best coefficients
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <chrono>
+#include <condition_variable>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+using namespace std;
+
+// keeps the best solution in memory and writes it from a background thread:
+// every m_interval seconds or every m_maxPending improvements, whichever comes first
+//
+// the solutions are written as one text .coeff file per subject and/or as a single binary container:
+//	char magic[8] = "GRPCOEF1"
+//	int32 nSubj, int32 degree, int32 offset (of the coefficients), int32 length (of the names)
+//	float32 pole[nSubj][3]
+//	char names[length]: subject names, each one followed by '\n'
+//	zero padding up to offset (multiple of 16)
+//	float32 coeff[(degree + 1)^2][nSubj][2]: m_coeff layout (latitude, longitude)
+class CoefficientWriter
+{
+public:
+	CoefficientWriter(int nSubj, int degree, const char **output, const float *pole, float interval = 5, int maxPending = 100, const char *container = NULL, bool text = true);
+	~CoefficientWriter(void);
+	void update(const float *coeff);	// new best solution (m_coeff layout)
+	void flush(void);	// write the latest solution now
+	static bool save(const char *filename, const float *pole, int degree, const float *coeff, int nSubj, int subj);
+	static bool saveContainer(const char *filename, const vector<string> &name, const float *pole, int degree, const float *coeff);
+	static bool loadContainer(const char *filename, vector<string> &name, vector<float> &pole, int &degree, vector<float> &coeff);
+	static string subjectName(const char *output);
+
+private:
+	void loop(void);
+	void write(void);
+
+private:
+	int m_nSubj;
+	int m_degree;
+	const char **m_output;
+	vector<string> m_name;	// subject names (from the outputs)
+	string m_container;	// binary container (empty: no container)
+	bool m_text;	// one text file per subject
+	vector<float> m_pole;	// 3 x nSubj
+	vector<float> m_best;	// latest best solution
+	vector<float> m_snapshot;	// solution being written
+	int m_pending;	// # of improvements not written yet
+	int m_maxPending;
+	chrono::duration<float> m_interval;
+	bool m_stop;
+
+	mutex m_mutex;	// m_best, m_pending, m_stop
+	mutex m_writeMutex;	// m_snapshot and the files
+	condition_variable m_cond;
+	thread m_thread;
+};
@@ -0,0 +1,105 @@
+/*************************************************
+*	FaceLocator.cpp
+*
+*	Face walks on a deforming sphere
+*	Part of the Groups command line module
+*************************************************/
+
+#include <unordered_map>
+#include "FaceLocator.h"
+
+FaceLocator::Counters &FaceLocator::Counters::operator +=(const Counters &c)
+{
+	hit += c.hit;
+	walk += c.walk;
+	fallback += c.fallback;
+	steps += c.steps;
+	rebuild += c.rebuild;
+	return *this;
+}
+
+FaceLocator::FaceLocator(const Mesh *mesh, AABB *tree, int maxSteps)
+{
+	m_mesh = mesh;
+	m_tree = tree;
+	m_stale = false;	// the tree is built from the current mesh
+	m_maxSteps = maxSteps;
+
+	// adjacency of the faces: the two faces sharing an edge (a, b) are paired by the key min(a, b) * nVertex + max(a, b)
+	int nFace = mesh->nFace();
+	long long nVertex = mesh->nVertex();
+	m_neighbor.assign(nFace * 3, -1);
+	unordered_map<long long, int> edge;	// edge -> first face * 3 + opposite vertex
+	edge.reserve(nFace * 3 / 2);
+	for (int i = 0; i < nFace; i++)
+	{
+		const Face *f = mesh->face(i);
+		for (int j = 0; j < 3; j++)
+		{
+			long long a = f->list((j + 1) % 3), b = f->list((j + 2) % 3);
+			long long key = (a < b) ? a * nVertex + b: b * nVertex + a;
+			unordered_map<long long, int>::iterator e = edge.find(key);
+			if (e == edge.end()) edge[key] = i * 3 + j;
+			else
+			{
+				m_neighbor[i * 3 + j] = e->second / 3;
+				m_neighbor[e->second] = i;
+			}
+		}
+	}
+}
+
+void FaceLocator::invalidate(void)
+{
+	m_stale = true;
+}
+
+int FaceLocator::locate(const float *p, int start, float *coeff, Counters &counters)
+{
+	int fid = (start != -1) ? walk(p, start, coeff, counters): -1;
+	if (fid != -1) return fid;
+
+	// the walk failed: the tree gives the closest face
+	if (m_stale)
+	{
+		m_tree->update();
+		m_stale = false;
+		counters.rebuild++;
+	}
+	counters.fallback++;
+	return m_tree->closestFace((float *)p, coeff);
+}
+
+int FaceLocator::walk(const float *p, int start, float *coeff, Counters &counters)
+{
+	int fid = start, prev = -1;
+	for (int step = 0; step <= m_maxSteps; step++)
+	{
+		const Face *f = m_mesh->face(fid);
+		const float *a = f->vertex(0)->fv();
+		const float *b = f->vertex(1)->fv();
+		const float *c = f->vertex(2)->fv();
+
+		// a face of the other hemisphere may contain the projection of the point
+		if (a[0] * p[0] + a[1] * p[1] + a[2] * p[2] <= 0) return -1;
+
+		Coordinate::cart2bary((float *)a, (float *)b, (float *)c, (float *)p, coeff);
+		int j = 0;	// most negative barycentric coordinate: the point is beyond the opposite edge
+		if (coeff[1] < coeff[j]) j = 1;
+		if (coeff[2] < coeff[j]) j = 2;
+		if (coeff[j] >= 0)
+		{
+			if (step == 0) counters.hit++;
+			else counters.walk++;
+			return fid;
+		}
+
+		// back to the previous face: the point falls between the two faces (the sphere is not flat)
+		int next = m_neighbor[fid * 3 + j];
+		if (next == -1 || next == prev) return -1;
+		prev = fid;
+		fid = next;
+		counters.steps++;
+	}
+	return -1;
+}
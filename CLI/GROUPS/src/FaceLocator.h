@@ -0,0 +1,48 @@
+/*************************************************
+*	FaceLocator.h
+*
+*	Face walks on a deforming sphere
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <vector>
+#include "Mesh.h"
+#include "AABB.h"
+
+using namespace std;
+
+// face of a deforming sphere containing a point: between two evaluations the sphere moves only slightly,
+// so the face is searched by walking across the adjacent faces from the face found last time (barycentric tests),
+// and the AABB tree is only used if the walk fails. The tree cannot be refit: it is fully rebuilt (AABB::update),
+// but only before its first query following a deformation (invalidate) instead of after every deformation.
+class FaceLocator
+{
+public:
+	// statistics of the queries
+	struct Counters
+	{
+		long long hit;	// the start face contains the point
+		long long walk;	// found by walking across the adjacent faces
+		long long fallback;	// AABB tree query
+		long long steps;	// faces crossed by the walks
+		long long rebuild;	// full rebuilds of the AABB tree
+		Counters(void): hit(0), walk(0), fallback(0), steps(0), rebuild(0) {}
+		Counters &operator +=(const Counters &c);
+	};
+
+public:
+	FaceLocator(const Mesh *mesh, AABB *tree, int maxSteps = 16);
+	void invalidate(void);
+	int locate(const float *p, int start, float *coeff, Counters &counters);
+
+private:
+	int walk(const float *p, int start, float *coeff, Counters &counters);
+
+private:
+	const Mesh *m_mesh;
+	AABB *m_tree;
+	bool m_stale;	// the mesh was deformed since the last rebuild of the tree
+	int m_maxSteps;	// longest walk before the tree is queried
+	vector<int> m_neighbor;	// face across the edge opposite to each vertex of each face (-1: border)
+};
@@ -2,7 +2,7 @@
 *	GroupwiseRegistration.cpp
 *
 *	Release: Sep 2016
-*	Update: Sep 2016
+*	Update: Sep 2016
 *
 *	University of North Carolina at Chapel Hill
 *	Department of Computer Science
@@ -10,12 +10,74 @@
 *	Ilwoo Lyu, ilwoolyu@cs.unc.edu
 *************************************************/
 
+#include <cstdio>
+#include <cmath>
 #include <cstring>
+#include <mutex>
+#include <sstream>
+#include <string>
 #include <float.h>
 #include "GroupwiseRegistration.h"
+#include "AtomicFile.h"
 #include "SphericalHarmonics.h"
 #include <lapacke.h>
 #include "newuoa.h"
+#include "lbfgs.h"
+
+// BLAS (linked with LAPACK)
+extern "C" void sgemm_(char *transa, char *transb, int *m, int *n, int *k, float *alpha, const float *a, int *lda, const float *b, int *ldb, float *beta, float *c, int *ldc);
+
+// stop reason of an L-BFGS stage whose gradient is not available
+static const char noGradient[] = "no gradient without the incremental covariance";
+
+// IEEE half precision (binary16) conversion for the compact basis storage
+static unsigned short floatToHalf(float value)
+{
+	unsigned int x;
+	memcpy(&x, &value, sizeof(float));
+	unsigned int sign = (x >> 16) & 0x8000;
+	int exponent = (int)((x >> 23) & 0xff) - 127 + 15;
+	unsigned int mantissa = x & 0x7fffff;
+	if (((x >> 23) & 0xff) == 0xff) return sign | 0x7c00 | ((mantissa != 0) ? 0x200: 0);	// inf, nan
+	if (exponent >= 31) return sign | 0x7c00;	// overflow
+	if (exponent <= 0)	// subnormal
+	{
+		if (exponent < -10) return sign;
+		mantissa |= 0x800000;
+		int shift = 14 - exponent;
+		unsigned int half = mantissa >> shift;
+		unsigned int rest = mantissa & ((1u << shift) - 1);
+		unsigned int mid = 1u << (shift - 1);
+		if (rest > mid || (rest == mid && (half & 1))) half++;	// round to nearest even
+		return sign | half;
+	}
+	unsigned int half = ((unsigned int)exponent << 10) | (mantissa >> 13);
+	unsigned int rest = mantissa & 0x1fff;
+	if (rest > 0x1000 || (rest == 0x1000 && (half & 1))) half++;	// round to nearest even (a carry moves to the exponent)
+	return sign | half;
+}
+
+static const float *halfTable(void)
+{
+	// all the 65536 half values
+	static vector<float> table;
+	static once_flag flag;
+	call_once(flag, []
+	{
+		table.resize(65536);
+		for (unsigned int h = 0; h < 65536; h++)
+		{
+			int exponent = (h >> 10) & 0x1f;
+			unsigned int mantissa = h & 0x3ff;
+			float value;
+			if (exponent == 0) value = ldexp((float)mantissa, -24);
+			else if (exponent == 31) value = (mantissa != 0) ? NAN: INFINITY;
+			else value = ldexp((float)(mantissa | 0x400), exponent - 25);
+			table[h] = (h & 0x8000) ? -value: value;
+		}
+	});
+	return &table[0];
+}
 
 GroupwiseRegistration::GroupwiseRegistration(void)
 {
@@ -27,10 +89,62 @@ GroupwiseRegistration::GroupwiseRegistration(void)
 	m_output = NULL;
 	m_degree = 0;
 	m_degree_inc = 1;	// starting degree for the incremental optimization
+	m_degree_start = 1;
+	m_checkpoint = NULL;
+	m_propertyCache = NULL;
+	m_pool = NULL;
+	m_basisMode = FullBasis;
+	m_basisBlock = 256;
+	m_incrementalCov = false;
+	m_covCalibrated = false;
+	m_covScale = 1;
+	m_optimizer = NewuoaOptimizer;
+	m_blockPasses = 0;
+	m_nFolds = 0;
+	m_lastCost = 0;
+	m_samplingDegree = -1;
+	m_weightLoc = 0;
+	m_timeBudget = 0;
+	m_convergenceWindow = 0;
+	m_convergenceTol = 0;
+	m_stageIter = 0;
+	m_stageEvaluations = 0;
+	m_stageDeadline = 0;
+	m_stopReason = NULL;
+	m_feature = NULL;
+	m_feature_weight = NULL;
+	m_gram = NULL;
+	m_featureChanged = NULL;
+	m_writer = NULL;
+	m_warmDegree = -1;
+	m_telemetryInterval = 0;
+	nIter = 0;
+	m_nRecomputed = 0;
+	m_reportFile = NULL;
+	m_nCost = 0;
+	m_nClosestFace = 0;
+	m_nFaceHit = 0;
+	m_nFaceWalk = 0;
+	m_nFaceSteps = 0;
+	m_nTreeRebuild = 0;
+	m_nEigen = 0;
+	m_startTime = std::chrono::steady_clock::now();
 }
 
-GroupwiseRegistration::GroupwiseRegistration(const char **sphere, int nSubj, const char **property, int nProperties, const char **output, const float *weight, int deg, const char **landmark, float weightLoc, const char **coeff, const char **surf, int maxIter)
+GroupwiseRegistration::GroupwiseRegistration(const char **sphere, int nSubj, const char **property, int nProperties, const char **output, const float *weight, int deg, const char **landmark, float weightLoc, const char **coeff, const char **surf, int maxIter, int telemetryInterval, int resumeDegree, const char *checkpoint, float writeInterval, int writeImprovements, const char *container, bool textOutput, const char *coeffContainer, const char *propertyCache, int nThreads, int basisMode, bool incrementalCovariance, int optimizer, int blockPasses, const int *samplingLevels, int nSamplingLevels, float timeBudget, const int *stageMaxIter, int nStageMaxIter, const float *stageTime, int nStageTime, int convergenceWindow, float convergenceTol, const char *report)
 {
+	m_startTime = std::chrono::steady_clock::now();
+	m_telemetryInterval = telemetryInterval;
+	nIter = 0;
+	m_nRecomputed = 0;
+	m_reportFile = report;
+	m_nCost = 0;
+	m_nClosestFace = 0;
+	m_nFaceHit = 0;
+	m_nFaceWalk = 0;
+	m_nFaceSteps = 0;
+	m_nTreeRebuild = 0;
+	m_nEigen = 0;
 	m_maxIter = maxIter;
 	m_nSubj = nSubj;
 	m_mincost = FLT_MAX;
@@ -38,28 +152,78 @@ GroupwiseRegistration::GroupwiseRegistration(const char **sphere, int nSubj, con
 	m_nSurfaceProperties = (weightLoc > 0)? 3: 0;
 	m_output = output;
 	m_degree = deg;
-	m_degree_inc = 3;	// starting degree for the incremental optimization
-	init(sphere, property, weight, landmark, weightLoc, coeff, surf, 4);
+	m_degree_start = 3;	// starting degree for the incremental optimization
+	m_degree_inc = min((resumeDegree > 0) ? resumeDegree: m_degree_start, m_degree);	// a resumed optimization restarts at its last stage
+	m_checkpoint = checkpoint;
+	m_propertyCache = propertyCache;
+	m_warmDegree = -1;
+	m_pool = new ThreadPool(nThreads);
+	cout << "Threads: " << m_pool->size() << endl;
+	m_basisMode = basisMode;
+	m_basisBlock = 256;
+	m_incrementalCov = incrementalCovariance;
+	m_covCalibrated = false;
+	m_covScale = 1;
+	m_optimizer = optimizer;
+	m_blockPasses = blockPasses;
+	m_nFolds = 0;
+	m_lastCost = 0;
+	if (samplingLevels != NULL)
+		for (int i = 0; i < nSamplingLevels; i++) m_samplingLevel.push_back(max(samplingLevels[i], 0));
+	m_samplingDegree = -1;
+	m_feature = NULL;
+	m_feature_weight = NULL;
+	m_timeBudget = timeBudget;
+	if (stageMaxIter != NULL) m_stageMaxIter.assign(stageMaxIter, stageMaxIter + nStageMaxIter);
+	if (stageTime != NULL) m_stageTime.assign(stageTime, stageTime + nStageTime);
+	m_convergenceWindow = convergenceWindow;
+	m_convergenceTol = convergenceTol;
+	m_stageIter = m_maxIter;
+	m_stageEvaluations = 0;
+	m_stageDeadline = 0;
+	m_stopReason = NULL;
+	if (m_timeBudget > 0) cout << "Time budget: " << m_timeBudget << "s" << endl;
+	if (m_convergenceWindow > 0) cout << "Convergence: " << m_convergenceTol << " over " << m_convergenceWindow << " evaluations" << endl;
+	cout << "Optimizer: " << ((m_optimizer == LbfgsOptimizer) ? "L-BFGS": (m_optimizer == BlockOptimizer) ? "NEWUOA per subject": "NEWUOA") << endl;
+	cout << "Basis storage: " << ((m_basisMode == FullBasis) ? "full": (m_basisMode == HalfBasis) ? "half precision": "on the fly") << endl;
+	RunReport::Mark t = RunReport::mark();
+	init(sphere, property, weight, landmark, weightLoc, coeff, surf, samplingLevel(m_degree_inc), coeffContainer);
+	m_report.add("init", t);
+
+	// the best solution is written every writeInterval seconds or writeImprovements improvements
+	float *pole = new float[m_nSubj * 3];
+	for (int subj = 0; subj < m_nSubj; subj++) memcpy(&pole[subj * 3], m_spharm[subj].pole, sizeof(float) * 3);
+	m_writer = new CoefficientWriter(m_nSubj, m_degree, m_output, pole, writeInterval, writeImprovements, container, textOutput);
+	delete [] pole;
 }
 
 GroupwiseRegistration::~GroupwiseRegistration(void)
 {
+	delete m_writer;
 	delete [] m_cov;
 	delete [] m_feature_weight;
 	delete [] m_eig;
 	delete [] m_feature;
 	delete [] m_updated;
+	delete [] m_gram;
+	delete [] m_featureChanged;
 	delete [] m_work;
 	delete [] m_coeff;
 	delete [] m_coeff_prev_step;
 	for (int subj = 0; subj < m_nSubj; subj++)
 	{
+		delete m_spharm[subj].locator;
 		delete m_spharm[subj].tree;
 		delete m_spharm[subj].surf;
 		delete m_spharm[subj].sphere;
 		delete [] m_spharm[subj].coeff;
 		delete [] m_spharm[subj].coeff_prev_step;
+		delete [] m_spharm[subj].basis;
+		delete [] m_spharm[subj].basisHalf;
+		delete [] m_spharm[subj].delta;
 		delete [] m_spharm[subj].tree_cache;
+		delete [] m_spharm[subj].interpIndex;
+		delete [] m_spharm[subj].interpWeight;
 		delete [] m_spharm[subj].meanProperty;
 		delete [] m_spharm[subj].maxProperty;
 		delete [] m_spharm[subj].minProperty;
@@ -69,7 +233,8 @@ GroupwiseRegistration::~GroupwiseRegistration(void)
 	}
 	delete [] m_spharm;
 	for (int i = 0; i < m_propertySamples.size(); i++)
-		delete m_propertySamples[i];
+		delete [] m_propertySamples[i];
+	delete m_pool;
 }
 
 void GroupwiseRegistration::run(void)
@@ -78,17 +243,41 @@ void GroupwiseRegistration::run(void)
 	optimization();
 
 	// write the solutions
-	for (int subj = 0; subj < m_nSubj; subj++)
-	{
-		saveCoeff(m_output[subj], subj);
-	}
+	RunReport::Mark t = RunReport::mark();
+	m_writer->update(m_coeff);
+	m_writer->flush();
+	saveCheckpoint(true);
+	m_report.add("save", t);
+	saveReport(true);
 	cout << "All done!\n";
 }
 
-void GroupwiseRegistration::init(const char **sphere, const char **property, const float *weight, const char **landmark, float weightLoc, const char **coeff, const char **surf, int samplingDegree)
+void GroupwiseRegistration::saveReport(bool completed)
+{
+	if (m_reportFile == NULL) return;
+
+	m_report.info("subjects", m_nSubj);
+	m_report.info("degree", m_degree);
+	m_report.info("threads", m_pool->size());
+	m_report.info("optimizer", (m_optimizer == LbfgsOptimizer) ? "lbfgs": (m_optimizer == BlockOptimizer) ? "block": "newuoa");
+	m_report.info("mincost", m_mincost);
+	m_report.count("cost", m_nCost);
+	m_report.count("closest_face", m_nClosestFace);
+	m_report.count("face_hit", m_nFaceHit);
+	m_report.count("face_walk", m_nFaceWalk);
+	m_report.count("face_walk_steps", m_nFaceSteps);
+	m_report.count("aabb_rebuild", m_nTreeRebuild);
+	m_report.count("ssyev", m_nEigen);
+	if (m_report.save(m_reportFile, completed)) cout << "Report: " << m_reportFile << endl;
+	else cout << " Warning: the report " << m_reportFile << " cannot be written\n";
+}
+
+void GroupwiseRegistration::init(const char **sphere, const char **property, const float *weight, const char **landmark, float weightLoc, const char **coeff, const char **surf, int samplingDegree, const char *coeffContainer)
 {
 	m_spharm = new spharm[m_nSubj];	// spharm info
 	m_updated = new bool[m_nSubj];	// AABB tree cache
+	m_featureChanged = new bool[m_nSubj];	// feature vectors changed since the last covariance computation
+	m_gram = new double[m_nSubj * m_nSubj];	// weighted Gram matrix for the incremental covariance
 	m_eig = new float[m_nSubj];		// eigenvalues
 	m_work = new float[m_nSubj * 3 - 1];	// workspace for eigenvalue computation
 	m_csize = (m_degree + 1) * (m_degree + 1) * m_nSubj; // total # of coefficients
@@ -99,71 +288,38 @@ void GroupwiseRegistration::init(const char **sphere, const char **property, con
 	memset(m_coeff, 0, sizeof(float) * m_csize * 2);
 	memset(m_coeff_prev_step, 0, sizeof(float) * m_csize * 2);
 	memset(m_updated, 0, sizeof(bool) * m_nSubj);
+	for (int subj = 0; subj < m_nSubj; subj++) m_featureChanged[subj] = true;
 	
-	cout << "Initialzation of subject information\n";
-
-	for (int subj = 0; subj < m_nSubj; subj++)
+	// previous solutions of all the subjects in a single binary container
+	if (coeffContainer != NULL)
 	{
-		cout << "Subject " << subj << " - " << sphere[subj] << endl;
-		
-		// spehre and surface information
-		cout << "-Sphere information\n";
-		m_spharm[subj].sphere = new Mesh();
-		if (sphere != NULL)
+		cout << "Coefficient container: " << coeffContainer << endl;
+		if (!CoefficientWriter::loadContainer(coeffContainer, m_warmName, m_warmPole, m_warmDegree, m_warmCoeff))
 		{
-			m_spharm[subj].sphere->openFile(sphere[subj]);
-			// make sure a unit sphere
-			m_spharm[subj].sphere->centering();
-			for (int i = 0; i < m_spharm[subj].sphere->nVertex(); i++)
-			{
-				Vertex *v = (Vertex *)m_spharm[subj].sphere->vertex(i);	// vertex information on the sphere
-				const float *v0 = v->fv();
-				Vector V(v0); V.unit();
-				v->setVertex(V.fv());
-			}
+			cout << " Fatal error: invalid coefficient container!\n";
+			m_warmName.clear();
 		}
-		else cout << " Fatal error: No sphere mapping is provided!\n";
-		
-		// previous spherical harmonic deformation fields
-		cout << "-Spherical harmonics information\n";
-		initSphericalHarmonics(subj, coeff);
-		updateDeformation(subj);	// deform the sphere for efficient AABB tree creation
-		
-		if (m_nSurfaceProperties > 0)
-		{
-			cout << "-Location information\n";
-			m_spharm[subj].surf = new Mesh();
-			m_spharm[subj].surf->openFile(surf[subj]);
-		}
-		else m_spharm[subj].surf = NULL;
-		
-		if (m_nProperties + m_nSurfaceProperties > 0)
-		{
-			// AABB tree construction for speedup computation
-			cout << "-AABB tree construction\n";
-			m_spharm[subj].tree = new AABB(m_spharm[subj].sphere);
-		}
-		else m_spharm[subj].tree = NULL;
-		
-		// triangle flipping
-		cout << "-Triangle flipping\n";
-		initTriangleFlipping(subj);
-		
-		// property information
-		cout << "-Property information\n";
-		initProperties(subj, property, 3);
-		
-		// landmarks
-		if (landmark != NULL)
-		{
-			cout << "-Landmark information\n";
-			initLandmarks(subj, landmark);
-		}
-		cout << "----------" << endl;
 	}
 
-	// icosahedron subdivision for evaluation on properties: this generates uniform sampling points over the sphere - m_propertySamples
-	if (m_nProperties + m_nSurfaceProperties > 0) icosahedron(samplingDegree);
+	cout << "Initialzation of subject information\n";
+
+	// subjects are independent: they are initialized in parallel, but their logs are printed in order
+	ostringstream *log = new ostringstream[m_nSubj];
+	bool *done = new bool[m_nSubj];
+	memset(done, 0, sizeof(bool) * m_nSubj);
+	int nPrinted = 0;
+	mutex logMutex;
+	m_pool->run(m_nSubj, [&](int subj)
+	{
+		initSubject(subj, sphere, property, landmark, coeff, surf, log[subj]);
+
+		lock_guard<mutex> lock(logMutex);
+		done[subj] = true;
+		for (; nPrinted < m_nSubj && done[nPrinted]; nPrinted++) cout << log[nPrinted].str() << flush;
+	});
+	delete [] log;
+	delete [] done;
+
 	// landmark information - the number of landamrks should be the same across subjects
 	if (landmark != NULL)
 	{
@@ -173,6 +329,52 @@ void GroupwiseRegistration::init(const char **sphere, const char **property, con
 				cout << " Fatal error: # of landamrks should be agreed!\n";
 	}
 
+	// weighting factors are kept for the sampling levels of the later stages
+	m_propertyWeight.assign(weight, weight + m_nProperties);
+	m_weightLoc = weightLoc;
+	
+	cout << "Initialization of work space\n";
+	m_cov = new float[m_nSubj * m_nSubj];	// convariance matrix defined in the duel space with dimensions: nSubj x nSubj
+	for (int subj = 0; subj < m_nSubj; subj++)
+	{
+		m_spharm[subj].tree_cache = NULL;
+		m_spharm[subj].interpIndex = NULL;
+		m_spharm[subj].interpWeight = NULL;
+	}
+	initFeatures(samplingDegree);
+
+	// inital coefficients for the previous step
+	memcpy(m_coeff_prev_step, m_coeff, sizeof(float) * m_csize * 2);
+
+	cout << "Feature vector creation\n";
+	// set all the tree needs to be updated
+	memset(m_updated, 0, sizeof(bool) * m_nSubj);
+
+	// feature update
+	if (m_spharm[0].landmark.size() > 0) updateLandmark(); // update landmark
+	if (m_propertySamples.size() > 0) updateProperties(); // update properties
+
+	cout << "Initialization done!" << endl;
+}
+
+void GroupwiseRegistration::initFeatures(int samplingDegree)
+{
+	// sampling points, weights and tree caches of the previous level
+	for (int i = 0; i < m_propertySamples.size(); i++) delete [] m_propertySamples[i];
+	m_propertySamples.clear();
+	delete [] m_feature_weight;
+	delete [] m_feature;
+	for (int subj = 0; subj < m_nSubj; subj++)
+	{
+		delete [] m_spharm[subj].tree_cache;
+		delete [] m_spharm[subj].interpIndex;
+		delete [] m_spharm[subj].interpWeight;
+	}
+	m_samplingDegree = samplingDegree;
+
+	// icosahedron subdivision for evaluation on properties: this generates uniform sampling points over the sphere - m_propertySamples
+	if (m_nProperties + m_nSurfaceProperties > 0) icosahedron(samplingDegree);
+
 	cout << "Computing weight terms\n";
 	int nLandmark = m_spharm[0].landmark.size() * 3;	// # of landmarks: we assume all the subject has the same number, which already is checked above.
 	int nSamples = m_propertySamples.size();	// # of sampling points for property map agreement
@@ -181,8 +383,8 @@ void GroupwiseRegistration::init(const char **sphere, const char **property, con
 	int nTotalProperties = m_nProperties + m_nSurfaceProperties;	// if location information is provided, total number = # of property + 3 -> (x, y, z location)
 	m_feature_weight = new float[nLandmark + nSamples * nTotalProperties];
 	float landmarkWeight = (nLandmark > 0) ? (float)nSamples / (float)nLandmark: 0;	// based on the number ratio (balance between landmark and property)
-	float totalWeight = weightLoc;
-	for (int n = 0; n < m_nProperties; n++) totalWeight += weight[n];
+	float totalWeight = m_weightLoc;
+	for (int n = 0; n < m_nProperties; n++) totalWeight += m_propertyWeight[n];
 	landmarkWeight *= totalWeight;
 	if (landmarkWeight == 0) landmarkWeight = 1;
 	cout << "Total properties: " << nTotalProperties << endl;
@@ -192,23 +394,21 @@ void GroupwiseRegistration::init(const char **sphere, const char **property, con
 	for (int i = 0; i < nLandmark; i++) m_feature_weight[i] = landmarkWeight;
 	for (int n = 0; n < m_nProperties; n++)
 		for (int i = 0; i < nSamples; i++)
-			m_feature_weight[nLandmark + nSamples * n + i] = weight[n];
+			m_feature_weight[nLandmark + nSamples * n + i] = m_propertyWeight[n];
 	// weight for location information
 	for (int n = 0; n < m_nSurfaceProperties; n++)
 		for (int i = 0; i < nSamples; i++)
-			m_feature_weight[nLandmark + nSamples * (m_nProperties + n) + i] = weightLoc;
+			m_feature_weight[nLandmark + nSamples * (m_nProperties + n) + i] = m_weightLoc;
 	
 	if (nLandmark > 0) cout << "Landmark weight: " << landmarkWeight << endl;
 	if (m_nProperties > 0)
 	{
 		cout << "Property weight: ";
-		for (int i = 0; i < m_nProperties; i++) cout << weight[i] << " ";
+		for (int i = 0; i < m_nProperties; i++) cout << m_propertyWeight[i] << " ";
 		cout << endl;
 	}
-	if (weightLoc > 0) cout << "Location weight: " << weightLoc << endl;
+	if (m_weightLoc > 0) cout << "Location weight: " << m_weightLoc << endl;
 	
-	cout << "Initialization of work space\n";
-	m_cov = new float[m_nSubj * m_nSubj];	// convariance matrix defined in the duel space with dimensions: nSubj x nSubj
 	m_feature = new float[m_nSubj * (nLandmark + nSamples * nTotalProperties)];	// the entire feature vector map for optimization
 
 	// AABB tree cache for each subject: this stores the closest face of the sampling point to the corresponding face on the input sphere model
@@ -219,25 +419,130 @@ void GroupwiseRegistration::init(const char **sphere, const char **property, con
 			m_spharm[subj].tree_cache = new int[nSamples];
 			for (int i = 0; i < nSamples; i++)
 				m_spharm[subj].tree_cache[i] = -1;	// initially, set to -1 (invalid index)
+			m_spharm[subj].interpIndex = new int[nSamples * 3];
+			m_spharm[subj].interpWeight = new float[nSamples * 3];
+		}
+		else
+		{
+			m_spharm[subj].tree_cache = NULL;
+			m_spharm[subj].interpIndex = NULL;
+			m_spharm[subj].interpWeight = NULL;
 		}
-		else m_spharm[subj].tree_cache = NULL;
 	}
+}
 
-	// inital coefficients for the previous step
-	memcpy(m_coeff_prev_step, m_coeff, sizeof(float) * m_csize * 2);
+int GroupwiseRegistration::samplingLevel(int degree)
+{
+	// one icosahedron level per stage from m_degree_start (the final joint optimization included), the last one being repeated
+	if (m_samplingLevel.empty()) return 4;
+	int stage = max(degree - m_degree_start, 0);
+	return m_samplingLevel[min(stage, (int)m_samplingLevel.size() - 1)];
+}
 
-	cout << "Feature vector creation\n";
-	// set all the tree needs to be updated
-	memset(m_updated, 0, sizeof(bool) * m_nSubj);
+void GroupwiseRegistration::updateSamplingLevel(void)
+{
+	int level = samplingLevel(m_degree_inc);
+	if (level == m_samplingDegree || m_nProperties + m_nSurfaceProperties == 0) return;
 
-	// feature update
-	if (nLandmark > 0) updateLandmark(); // update landmark
-	if (nSamples > 0) updateProperties(); // update properties
+	cout << "Sampling level: " << level << endl;
+	initFeatures(level);
 
-	cout << "Initialization done!" << endl;
+	// the features of all the subjects are sampled again, and the covariance is rebuilt on the new feature vectors
+	memset(m_updated, 0, sizeof(bool) * m_nSubj);
+	for (int subj = 0; subj < m_nSubj; subj++) m_featureChanged[subj] = true;
+	m_covCalibrated = false;
+
+	// costs of different sampling levels are not comparable: the reference of the new level is the entropy of the
+	// current coefficients (not an evaluation of the optimizer: neither counted nor written)
+	int nRecomputed;
+	updateFolds(nRecomputed);
+	m_mincost = entropy();
+	m_lastCost = m_mincost;
+	cout << "Cost at the new sampling level: " << m_mincost << endl;
+}
+
+void GroupwiseRegistration::initSubject(int subj, const char **sphere, const char **property, const char **landmark, const char **coeff, const char **surf, ostream &log)
+{
+	log << "Subject " << subj << " - " << sphere[subj] << endl;
+	
+	// spehre and surface information
+	log << "-Sphere information\n";
+	RunReport::Mark t = RunReport::mark();
+	m_spharm[subj].sphere = new Mesh();
+	if (sphere != NULL)
+	{
+		m_spharm[subj].sphere->openFile(sphere[subj]);
+		// make sure a unit sphere
+		m_spharm[subj].sphere->centering();
+		for (int i = 0; i < m_spharm[subj].sphere->nVertex(); i++)
+		{
+			Vertex *v = (Vertex *)m_spharm[subj].sphere->vertex(i);	// vertex information on the sphere
+			const float *v0 = v->fv();
+			Vector V(v0); V.unit();
+			v->setVertex(V.fv());
+		}
+	}
+	else log << " Fatal error: No sphere mapping is provided!\n";
+	m_report.add("mesh_load", t);
+	
+	// previous spherical harmonic deformation fields
+	log << "-Spherical harmonics information\n";
+	t = RunReport::mark();
+	m_spharm[subj].version = 1;
+	m_spharm[subj].deformDegree = -1;
+	m_spharm[subj].foldVersion = 0;
+	m_spharm[subj].folds = 0;
+	initSphericalHarmonics(subj, coeff, log);
+	updateDeformation(subj);	// deform the sphere for efficient AABB tree creation
+	m_report.add("basis", t);
+	
+	if (m_nSurfaceProperties > 0)
+	{
+		log << "-Location information\n";
+		t = RunReport::mark();
+		m_spharm[subj].surf = new Mesh();
+		m_spharm[subj].surf->openFile(surf[subj]);
+		m_report.add("mesh_load", t);
+	}
+	else m_spharm[subj].surf = NULL;
+	
+	if (m_nProperties + m_nSurfaceProperties > 0)
+	{
+		// AABB tree construction for speedup computation
+		log << "-AABB tree construction\n";
+		t = RunReport::mark();
+		m_spharm[subj].tree = new AABB(m_spharm[subj].sphere);
+		m_spharm[subj].locator = new FaceLocator(m_spharm[subj].sphere, m_spharm[subj].tree);
+		m_report.add("aabb_build", t);
+	}
+	else
+	{
+		m_spharm[subj].tree = NULL;
+		m_spharm[subj].locator = NULL;
+	}
+	
+	// triangle flipping
+	log << "-Triangle flipping\n";
+	initTriangleFlipping(subj);
+	
+	// property information
+	log << "-Property information\n";
+	t = RunReport::mark();
+	initProperties(subj, property, 3, log);
+	m_report.add("property_load", t);
+	
+	// landmarks
+	if (landmark != NULL)
+	{
+		log << "-Landmark information\n";
+		t = RunReport::mark();
+		initLandmarks(subj, landmark);
+		m_report.add("landmark_load", t);
+	}
+	log << "----------" << endl;
 }
 
-void GroupwiseRegistration::initSphericalHarmonics(int subj, const char **coeff)
+void GroupwiseRegistration::initSphericalHarmonics(int subj, const char **coeff, ostream &log)
 {
 	// spherical harmonics information
 	int n = (m_degree + 1) * (m_degree + 1);	// total number of coefficients (this must be the same across all the subjects at the end of this program)
@@ -267,6 +572,26 @@ void GroupwiseRegistration::initSphericalHarmonics(int subj, const char **coeff)
 			fscanf(fp, "%f %f", m_spharm[subj].coeff[i], m_spharm[subj].coeff[n + i]);
 		fclose(fp);
 	}
+	else if (!m_warmName.empty())	// previous spherical harmonics information from the binary container
+	{
+		string name = CoefficientWriter::subjectName(m_output[subj]);
+		int id = find(m_warmName.begin(), m_warmName.end(), name) - m_warmName.begin();
+		int nWarm = m_warmName.size();
+		m_spharm[subj].pole[0] = 0;
+		m_spharm[subj].pole[1] = 0;
+		m_spharm[subj].pole[2] = 1;
+		if (id < nWarm)
+		{
+			memcpy(m_spharm[subj].pole, &m_warmPole[id * 3], sizeof(float) * 3);
+			m_spharm[subj].degree = min(m_warmDegree, m_degree);	// if the previous degree is larger than desired one, just crop it.
+			for (int i = 0; i < (m_spharm[subj].degree + 1) * (m_spharm[subj].degree + 1); i++)
+			{
+				*m_spharm[subj].coeff[i] = m_warmCoeff[nWarm * 2 * i + id * 2];
+				*m_spharm[subj].coeff[n + i] = m_warmCoeff[nWarm * 2 * i + id * 2 + 1];
+			}
+		}
+		else log << " No previous coefficients for " << name << endl;
+	}
 	else	// no spherical harmonic information is provided
 	{
 		// just set the pole to [0, 0, 1]
@@ -276,24 +601,41 @@ void GroupwiseRegistration::initSphericalHarmonics(int subj, const char **coeff)
 	}
 	m_spharm[subj].degree = m_degree;
 	
-	// build spherical harmonic basis functions for each vertex
+	// build spherical harmonic basis functions for each vertex: a single matrix for the displacements of all the vertices
 	int nVertex = m_spharm[subj].sphere->nVertex();
+	m_spharm[subj].basis = (m_basisMode == FullBasis) ? new float[nVertex * n]: NULL;
+	m_spharm[subj].basisHalf = (m_basisMode == HalfBasis) ? new unsigned short[nVertex * n]: NULL;
+	m_spharm[subj].delta = new float[nVertex * 2];
+	float *Y = (m_basisMode == HalfBasis) ? new float[n]: NULL;
 	for (int i = 0; i < nVertex; i++)
 	{
 		// vertex information
 		point *p = new point();	// new spherical information allocation
 		Vertex *v = (Vertex *)m_spharm[subj].sphere->vertex(i);	// vertex information on the sphere
 		const float *v0 = v->fv();
-		p->Y = new float[(m_degree + 1) * (m_degree + 1)];
 		p->p[0] = v0[0]; p->p[1] = v0[1]; p->p[2] = v0[2];
 		p->id = i;
 		p->subject = subj;
-		SphericalHarmonics::basis(m_degree, p->p, p->Y);
+		if (m_basisMode == FullBasis)
+		{
+			p->Y = &m_spharm[subj].basis[i * n];
+			SphericalHarmonics::basis(m_degree, p->p, p->Y);
+		}
+		else
+		{
+			p->Y = NULL;	// no basis row per vertex in the compact modes
+			if (m_basisMode == HalfBasis)
+			{
+				SphericalHarmonics::basis(m_degree, p->p, Y);
+				for (int k = 0; k < n; k++) m_spharm[subj].basisHalf[i * n + k] = floatToHalf(Y[k]);
+			}
+		}
 		m_spharm[subj].vertex.push_back(p);
 	}
+	delete [] Y;
 }
 
-void GroupwiseRegistration::initProperties(int subj, const char **property, int nHeaderLines)
+void GroupwiseRegistration::initProperties(int subj, const char **property, int nHeaderLines, ostream &log)
 {
 	int nVertex = m_spharm[subj].sphere->nVertex();	// this is the same as the number of properties
 	int nFace = m_spharm[subj].sphere->nFace();
@@ -303,7 +645,6 @@ void GroupwiseRegistration::initProperties(int subj, const char **property, int
 		m_spharm[subj].maxProperty = new float[m_nProperties + m_nSurfaceProperties];
 		m_spharm[subj].minProperty = new float[m_nProperties + m_nSurfaceProperties];
 		m_spharm[subj].sdevProperty = new float[m_nProperties + m_nSurfaceProperties];
-		m_spharm[subj].property = new float[(m_nProperties + m_nSurfaceProperties) * nVertex];
 	}
 	else
 	{
@@ -311,12 +652,32 @@ void GroupwiseRegistration::initProperties(int subj, const char **property, int
 		m_spharm[subj].maxProperty = NULL;
 		m_spharm[subj].minProperty = NULL;
 		m_spharm[subj].sdevProperty = NULL;
-		m_spharm[subj].property = NULL;
 	}
+	float *values = new float[(m_nProperties + m_nSurfaceProperties) * nVertex];	// nProperties x nVertex
+	bool *cached = new bool[m_nProperties + m_nSurfaceProperties];
+	for (int i = 0; i < m_nProperties + m_nSurfaceProperties; i++) cached[i] = false;
 	for (int i = 0; i < m_nProperties; i++)	// property information
 	{
 		int index = subj * m_nProperties + i;
-		cout << "\t" << property[index] << endl;
+		log << "\t" << property[index] << endl;
+		
+		// binary cache of the property and its statistics
+		string cache;
+		if (m_propertyCache != NULL)
+		{
+			float stat[4];
+			cache = PropertyCache::cacheName(property[index], m_propertyCache);
+			if (PropertyCache::load(property[index], cache.c_str(), nVertex, &values[nVertex * i], stat))
+			{
+				m_spharm[subj].meanProperty[i] = stat[0];
+				m_spharm[subj].minProperty[i] = stat[1];
+				m_spharm[subj].maxProperty[i] = stat[2];
+				m_spharm[subj].sdevProperty[i] = stat[3];
+				cached[i] = true;
+				continue;
+			}
+		}
+		
 		FILE *fp = fopen(property[index], "r");
 		
 		// remove header lines
@@ -324,8 +685,16 @@ void GroupwiseRegistration::initProperties(int subj, const char **property, int
 		for (int j = 0; j < nHeaderLines; j++) fgets(line, sizeof(line), fp);
 		
 		// load property information
-		for (int j = 0; j < nVertex; j++) fscanf(fp, "%f", &m_spharm[subj].property[nVertex * i + j]);
+		for (int j = 0; j < nVertex; j++) fscanf(fp, "%f", &values[nVertex * i + j]);
 		fclose(fp);
+		
+		if (m_propertyCache != NULL)
+		{
+			float stat[4];
+			PropertyCache::statistics(&values[nVertex * i], nVertex, stat);
+			if (!PropertyCache::save(property[index], cache.c_str(), nVertex, &values[nVertex * i], stat))
+				log << " Warning: the property cache " << cache << " cannot be written\n";
+		}
 	}
 	for (int i = 0; i < m_nSurfaceProperties; i++)	// x, y, z dimensions
 	{
@@ -333,21 +702,37 @@ void GroupwiseRegistration::initProperties(int subj, const char **property, int
 		{
 			Vertex *v = (Vertex *)m_spharm[subj].surf->vertex(j);
 			const float *v0 = v->fv();
-			m_spharm[subj].property[nVertex * (m_nProperties + i) + j] = v0[i];
+			values[nVertex * (m_nProperties + i) + j] = v0[i];
 		}
 	}
 	
 	// find the best statistics across subjects
 	for (int i = 0; i < m_nProperties + m_nSurfaceProperties; i++)
 	{
-		cout << "--Property " << i << endl;
-		m_spharm[subj].meanProperty[i] = Statistics::mean(&m_spharm[subj].property[nVertex * i], nVertex);
-		m_spharm[subj].maxProperty[i] = Statistics::max(&m_spharm[subj].property[nVertex * i], nVertex);
-		m_spharm[subj].minProperty[i] = Statistics::min(&m_spharm[subj].property[nVertex * i], nVertex);
-		m_spharm[subj].sdevProperty[i] = sqrt(Statistics::var(&m_spharm[subj].property[nVertex * i], nVertex));
-		cout << "---Min/Max: " << m_spharm[subj].minProperty[i] << ", " << m_spharm[subj].maxProperty[i] << endl;
-		cout << "---Mean/Stdev: " << m_spharm[subj].meanProperty[i] << ", " << m_spharm[subj].sdevProperty[i] << endl;
+		log << "--Property " << i << endl;
+		if (!cached[i])
+		{
+			m_spharm[subj].meanProperty[i] = Statistics::mean(&values[nVertex * i], nVertex);
+			m_spharm[subj].maxProperty[i] = Statistics::max(&values[nVertex * i], nVertex);
+			m_spharm[subj].minProperty[i] = Statistics::min(&values[nVertex * i], nVertex);
+			m_spharm[subj].sdevProperty[i] = sqrt(Statistics::var(&values[nVertex * i], nVertex));
+		}
+		log << "---Min/Max: " << m_spharm[subj].minProperty[i] << ", " << m_spharm[subj].maxProperty[i] << endl;
+		log << "---Mean/Stdev: " << m_spharm[subj].meanProperty[i] << ", " << m_spharm[subj].sdevProperty[i] << endl;
 	}
+	delete [] cached;
+
+	// normalized properties, transposed: the properties of a vertex are contiguous for the interpolation
+	int nTotalProperties = m_nProperties + m_nSurfaceProperties;
+	if (nTotalProperties > 0)
+	{
+		m_spharm[subj].property = new float[nVertex * nTotalProperties];
+		for (int i = 0; i < nTotalProperties; i++)
+			for (int j = 0; j < nVertex; j++)
+				m_spharm[subj].property[j * nTotalProperties + i] = values[nVertex * i + j] / m_spharm[subj].sdevProperty[i];
+	}
+	else m_spharm[subj].property = NULL;
+	delete [] values;
 }
 
 void GroupwiseRegistration::initTriangleFlipping(int subj)
@@ -406,6 +791,18 @@ bool GroupwiseRegistration::updateCoordinate(const float *v0, float *v1, const f
 	// spharm basis
 	int n = (degree + 1) * (degree + 1);
 
+	float delta[2] = {0, 0};
+	for (int i = 0; i < n; i++)
+	{
+		delta[0] += Y[i] * *coeff[i];
+		delta[1] += Y[i] * *coeff[(m_degree + 1) * (m_degree + 1) + i];
+	}
+
+	return deformCoordinate(v0, v1, delta, pole);
+}
+
+bool GroupwiseRegistration::deformCoordinate(const float *v0, float *v1, const float *delta, const float *pole)
+{
 	Vector p0(pole), axis;
 	float dot;
 
@@ -419,13 +816,6 @@ bool GroupwiseRegistration::updateCoordinate(const float *v0, float *v1, const f
 		return false;
 	}
 
-	float delta[2] = {0, 0};
-	for (int i = 0; i < n; i++)
-	{
-		delta[0] += Y[i] * *coeff[i];
-		delta[1] += Y[i] * *coeff[(m_degree + 1) * (m_degree + 1) + i];
-	}
-
 	if (delta[0] == 0 && delta[1] == 0)
 	{
 		memcpy(v1, v0, sizeof(float) * 3);
@@ -466,10 +856,11 @@ bool GroupwiseRegistration::updateCoordinate(const float *v0, float *v1, const f
 	return true;
 }
 
-void GroupwiseRegistration::updateDeformation(int subject)
+bool GroupwiseRegistration::updateDeformation(int subject)
 {
-	// note: the deformation happens only if the coefficients change; otherwise, nothing to do
-	bool updated = m_updated[subject];
+	// note: the deformation happens only if the coefficients (or the incremental degree) change; otherwise, nothing to do.
+	// The sphere always holds the deformation of the last evaluation, whose coefficients are kept in m_coeff_prev_step.
+	bool updated = (m_spharm[subject].deformDegree == m_degree_inc);
 	
 	// check if the coefficients change
 	int n = (m_degree_inc + 1) * (m_degree_inc + 1);
@@ -478,19 +869,55 @@ void GroupwiseRegistration::updateDeformation(int subject)
 			*m_spharm[subject].coeff[(m_degree + 1) * (m_degree + 1) + i] != *m_spharm[subject].coeff_prev_step[(m_degree + 1) * (m_degree + 1) + i])
 			updated = false;
 	
-	// deform a sphere based on the current coefficients if necessary
-	for (int i = 0; i < m_spharm[subject].vertex.size() && !updated; i++)
+	if (updated) return false;
+	
+	// displacements of all the vertices using the current incremental degree: delta (2 x nVertex) = coeff^T (2 x n) * basis^T (n x nVertex)
+	// in column-major order, coeff^T is read in place from m_coeff (latitudes and longitudes interleaved, stride of 2 * m_nSubj)
+	int nVertex = m_spharm[subject].vertex.size();
+	int nBasis = (m_degree + 1) * (m_degree + 1);
+	int nDelta = 2;
+	int ldCoeff = m_nSubj * 2;
+	float alpha = 1, beta = 0;
+	char trans[] = "N";
+	if (m_basisMode == FullBasis)
+		sgemm_(trans, trans, &nDelta, &nVertex, &n, &alpha, &m_coeff[subject * 2], &ldCoeff, m_spharm[subject].basis, &nBasis, &beta, m_spharm[subject].delta, &nDelta);
+	else
+	{
+		// compact modes: the basis rows (up to the incremental degree) are decoded or recomputed block by block
+		static thread_local vector<float> block;
+		block.resize(m_basisBlock * n);
+		const float *table = halfTable();
+		for (int start = 0; start < nVertex; start += m_basisBlock)
+		{
+			int nBlock = min(m_basisBlock, nVertex - start);
+			for (int i = 0; i < nBlock; i++)
+			{
+				if (m_basisMode == HalfBasis)
+				{
+					const unsigned short *row = &m_spharm[subject].basisHalf[(start + i) * nBasis];
+					for (int k = 0; k < n; k++) block[i * n + k] = table[row[k]];
+				}
+				else SphericalHarmonics::basis(m_degree_inc, m_spharm[subject].vertex[start + i]->p, &block[i * n]);
+			}
+			sgemm_(trans, trans, &nDelta, &nBlock, &n, &alpha, &m_coeff[subject * 2], &ldCoeff, &block[0], &n, &beta, &m_spharm[subject].delta[start * 2], &nDelta);
+		}
+	}
+	
+	// deform a sphere based on the displacements
+	const float *delta = m_spharm[subject].delta;
+	for (int i = 0; i < nVertex; i++)
 	{
 		Vertex *v = (Vertex *)m_spharm[subject].sphere->vertex(i);
 		float v1[3];
-		const float *v0 = v->fv();
-		updateCoordinate(m_spharm[subject].vertex[i]->p, v1, m_spharm[subject].vertex[i]->Y, (const float **)m_spharm[subject].coeff, m_degree_inc, m_spharm[subject].pole); // update using the current incremental degree
-		{
-			Vector V(v1); V.unit();
-			v->setVertex(V.fv());
-		}
+		deformCoordinate(m_spharm[subject].vertex[i]->p, v1, &delta[i * 2], m_spharm[subject].pole);
+		Vector V(v1); V.unit();
+		v->setVertex(V.fv());
 	}
-	m_updated[subject] = updated;
+	m_updated[subject] = false;	// the tree and the features need to be updated
+	m_spharm[subject].deformDegree = m_degree_inc;
+	m_spharm[subject].version++;
+
+	return true;
 }
 
 void GroupwiseRegistration::updateLandmark(void)
@@ -498,14 +925,18 @@ void GroupwiseRegistration::updateLandmark(void)
 	int nLandmark = m_spharm[0].landmark.size();
 	int nSamples = m_propertySamples.size();	// # of sampling points for property map agreemen
 
+	// deformed landmarks of each subject
+	m_pool->run(m_nSubj, [&](int subj)
+	{
+		for (int i = 0; i < nLandmark; i++)
+			updateCoordinate(m_spharm[subj].landmark[i]->p, &m_feature[subj * (nLandmark * 3 + nSamples * (m_nProperties + m_nSurfaceProperties)) + i * 3], m_spharm[subj].landmark[i]->Y, (const float **)m_spharm[subj].coeff, m_degree_inc, m_spharm[subj].pole);
+	});
+
 	for (int i = 0; i < nLandmark; i++)
 	{
 		float m[3] = {0, 0, 0};	// mean
 		for (int subj = 0; subj < m_nSubj; subj++)
 		{
-			int id = m_spharm[subj].landmark[i]->id;
-			updateCoordinate(m_spharm[subj].landmark[i]->p, &m_feature[subj * (nLandmark * 3 + nSamples * (m_nProperties + m_nSurfaceProperties)) + i * 3], m_spharm[subj].landmark[i]->Y, (const float **)m_spharm[subj].coeff, m_degree_inc, m_spharm[subj].pole);
-
 			// mean locations
 			for (int k = 0; k < 3; k++) m[k] += m_feature[subj * (nLandmark * 3 + nSamples * (m_nProperties + m_nSurfaceProperties)) + i * 3 + k];
 		}
@@ -593,46 +1024,58 @@ void GroupwiseRegistration::updateProperties(void)
 	int nLandmark = m_spharm[0].landmark.size();
 	int nSamples = m_propertySamples.size();	// # of sampling points for property map agreement
 	
-	float err = 0;
-	for (int subj = 0; subj < m_nSubj; subj++)
+	// each subject has its own tree, cache and feature vector: the subjects are filled in parallel
+	m_pool->run(m_nSubj, [&](int subj)
 	{
 		if (!m_updated[subj])
 		{
 			m_updated[subj] = true;
-			m_spharm[subj].tree->update();
+			m_featureChanged[subj] = true;
+			m_spharm[subj].locator->invalidate();	// the tree is rebuilt only if a face walk fails
 		}
-		else continue;	// don't compute again since tree is the same as the previous. The feature vector won't be changed
-		for (int i = 0; i < nSamples; i++)
-		{
-			int fid = -1;
-			float coeff[3];
-			if (m_spharm[subj].tree_cache[i] != -1)	// if previous cache is available
-			{
-				Face *f = (Face *)m_spharm[subj].sphere->face(m_spharm[subj].tree_cache[i]);
-				Vertex *a = (Vertex *)f->vertex(0);
-				Vertex *b = (Vertex *)f->vertex(1);
-				Vertex *c = (Vertex *)f->vertex(2);
-
-				// bary centric
-				Coordinate::cart2bary((float *)a->fv(), (float *)b->fv(), (float *)c->fv(), m_propertySamples[i], coeff);
-
-				fid = (coeff[0] >= err && coeff[1] >= err && coeff[2] >= err) ? m_spharm[subj].tree_cache[i]: -1;
-			}
-			if (fid == -1)	// if no closest face is found
-			{
-				fid = m_spharm[subj].tree->closestFace(m_propertySamples[i], coeff);
-				if (fid == -1)	// something goes wrong
-					cout << "Fatal error: no closest point found!\n";
-			}
+		else return;	// don't compute again since tree is the same as the previous. The feature vector won't be changed
+		updateSubjectProperties(subj, &m_feature[subj * (nLandmark * 3 + nSamples * (m_nProperties + m_nSurfaceProperties))]);
+	});
+}
 
-			int nVertex = m_spharm[subj].sphere->nVertex();
-			for (int k = 0; k < m_nProperties + m_nSurfaceProperties; k++)
+void GroupwiseRegistration::updateSubjectProperties(int subj, float *feature)
+{
+	// property part of the feature vector of a subject, from its deformed sphere
+	int nLandmark = m_spharm[0].landmark.size();
+	int nSamples = m_propertySamples.size();	// # of sampling points for property map agreement
+	
+	// interpolation operator: 3 non-zeros (vertices of the face and barycentric weights) per sampling point
+	int *index = m_spharm[subj].interpIndex;
+	float *weight = m_spharm[subj].interpWeight;
+	FaceLocator::Counters counters;
+	for (int i = 0; i < nSamples; i++)
+	{
+		// the face of the previous evaluation (cache), or one of its neighbors, almost always contains the sampling point
+		float coeff[3];
+		int fid = m_spharm[subj].locator->locate(m_propertySamples[i], m_spharm[subj].tree_cache[i], coeff, counters);
+		if (fid == -1)	// something goes wrong
+		{
+			cout << "Fatal error: no closest point found!\n";
+			memset(&index[i * 3], 0, sizeof(int) * 3);
+			memset(&weight[i * 3], 0, sizeof(float) * 3);
+		}
+		else
+		{
+			const Face *f = m_spharm[subj].sphere->face(fid);
+			for (int j = 0; j < 3; j++)
 			{
-				m_feature[subj * (nLandmark * 3 + nSamples * (m_nProperties + m_nSurfaceProperties)) + nLandmark * 3 + nSamples * k + i] = propertyInterpolation(&m_spharm[subj].property[nVertex * k], fid, coeff, m_spharm[subj].sphere) / m_spharm[subj].sdevProperty[k];
+				index[i * 3 + j] = f->list(j);
+				weight[i * 3 + j] = coeff[j];
 			}
-			m_spharm[subj].tree_cache[i] = fid;
 		}
+		m_spharm[subj].tree_cache[i] = fid;
 	}
+	interpolateProperties(index, weight, nSamples, m_spharm[subj].property, &feature[nLandmark * 3]);
+	m_nClosestFace += counters.fallback;
+	m_nFaceHit += counters.hit;
+	m_nFaceWalk += counters.walk;
+	m_nFaceSteps += counters.steps;
+	m_nTreeRebuild += counters.rebuild;
 }
 
 float GroupwiseRegistration::entropy(void)
@@ -651,10 +1094,16 @@ float GroupwiseRegistration::entropy(void)
 	if (nSamples > 0) updateProperties();
 	
 	// dual covariance matrix (m_nSubj x m_nSubj) of feature vector (nLandmark + nSamples * (m_nProperties + m_nSurfaceProperties) x m_nSubj)
-	Statistics::wcov_trans(m_feature, m_nSubj, nLandmark + nSamples * (m_nProperties + m_nSurfaceProperties), m_cov, m_feature_weight);
+	if (m_incrementalCov)
+	{
+		// landmarks are projected onto their mean: they change as soon as any subject changes
+		if (nLandmark > 0) for (int subj = 0; subj < m_nSubj; subj++) m_featureChanged[subj] = true;
+		updateCovariance(nLandmark + nSamples * (m_nProperties + m_nSurfaceProperties));
+	}
+	else Statistics::wcov_trans(m_feature, m_nSubj, nLandmark + nSamples * (m_nProperties + m_nSurfaceProperties), m_cov, m_feature_weight);
 	
 	// entropy
-	eigenvalues(m_cov, m_nSubj, m_eig);
+	eigenvalues(m_cov, m_nSubj, m_eig, m_work);
 
 	float alpha = 1e-5;	// avoid a degenerative case
 	for (int i = 1; i < m_nSubj; i++)	// just ignore the first eigenvalue (trivial = 0)
@@ -663,7 +1112,80 @@ float GroupwiseRegistration::entropy(void)
 	return E;
 }
 
-void GroupwiseRegistration::eigenvalues(float *M, int dim, float *eig)
+void GroupwiseRegistration::updateCovariance(int dim)
+{
+	// weighted Gram matrix G(i, j) = sum_k w_k x_ik x_jk: only the rows of the changed subjects are recomputed
+	vector<int> changed;
+	for (int subj = 0; subj < m_nSubj; subj++)
+	{
+		if (m_featureChanged[subj]) changed.push_back(subj);
+		m_featureChanged[subj] = false;
+	}
+	m_pool->run(changed.size(), [&](int c)
+	{
+		int i = changed[c];
+		const float *xi = &m_feature[i * dim];
+		for (int j = 0; j < m_nSubj; j++)
+		{
+			const float *xj = &m_feature[j * dim];
+			double g = 0;
+			for (int k = 0; k < dim; k++) g += (double)m_feature_weight[k] * xi[k] * xj[k];
+			m_gram[i * m_nSubj + j] = g;
+		}
+	});
+	for (int c = 0; c < changed.size(); c++)
+		for (int j = 0; j < m_nSubj; j++)
+			m_gram[j * m_nSubj + changed[c]] = m_gram[changed[c] * m_nSubj + j];
+
+	if (!m_covCalibrated)
+	{
+		// same matrix as Statistics::wcov_trans up to its normalization, which is measured once on the full computation
+		m_covCalibrated = true;
+		vector<float> ref(m_nSubj * m_nSubj, 0);
+		Statistics::wcov_trans(m_feature, m_nSubj, dim, &ref[0], m_feature_weight);
+		m_covScale = 1;
+		centeredCovariance(m_gram, m_cov);
+		int pivot = 0;
+		for (int i = 1; i < m_nSubj; i++)
+			if (fabs(m_cov[i * m_nSubj + i]) > fabs(m_cov[pivot * m_nSubj + pivot])) pivot = i;
+		if (m_cov[pivot * m_nSubj + pivot] != 0) m_covScale = (double)ref[pivot * m_nSubj + pivot] / m_cov[pivot * m_nSubj + pivot];
+
+		// wcov_trans may fill a single triangle
+		double err = 0, norm = 0;
+		for (int i = 0; i < m_nSubj; i++)
+			for (int j = 0; j <= i; j++)
+			{
+				double r = (ref[i * m_nSubj + j] != 0) ? ref[i * m_nSubj + j]: ref[j * m_nSubj + i];
+				err = max(err, fabs(m_covScale * m_cov[i * m_nSubj + j] - r));
+				norm = max(norm, fabs(r));
+			}
+		if (err > 1e-3 * norm)
+		{
+			cout << " Warning: the incremental covariance does not match Statistics::wcov_trans, full computation is used\n";
+			m_incrementalCov = false;
+			memcpy(m_cov, &ref[0], sizeof(float) * m_nSubj * m_nSubj);
+			return;
+		}
+	}
+	centeredCovariance(m_gram, m_cov);
+}
+
+void GroupwiseRegistration::centeredCovariance(const double *gram, float *cov)
+{
+	// centering: sum_k w_k (x_ik - m_k) (x_jk - m_k) = G(i, j) - r_i / n - r_j / n + s / n^2 (r: row sums of G, s: sum of G)
+	vector<double> r(m_nSubj, 0);
+	double total = 0;
+	for (int i = 0; i < m_nSubj; i++)
+	{
+		for (int j = 0; j < m_nSubj; j++) r[i] += gram[i * m_nSubj + j];
+		total += r[i];
+	}
+	for (int i = 0; i < m_nSubj; i++)
+		for (int j = 0; j < m_nSubj; j++)
+			cov[i * m_nSubj + j] = (float)(m_covScale * (gram[i * m_nSubj + j] - r[i] / m_nSubj - r[j] / m_nSubj + total / m_nSubj / m_nSubj));
+}
+
+void GroupwiseRegistration::eigenvalues(float *M, int dim, float *eig, float *work)
 {
 	int n = dim;
 	int lwork = dim * 3 - 1;	// dimension of the work array
@@ -672,54 +1194,85 @@ void GroupwiseRegistration::eigenvalues(float *M, int dim, float *eig)
 	
 	char jobz[] = "N";	// eigenvalue only
 	char uplo[] = "L"; // Lower triangle
-	ssyev_(jobz, uplo, &n, M, &lda, eig, m_work, &lwork, &info);
+	ssyev_(jobz, uplo, &n, M, &lda, eig, work, &lwork, &info);
+	m_nEigen++;
 }
 
-float GroupwiseRegistration::propertyInterpolation(float *refMap, int index, float *coeff, Mesh *mesh)
+void GroupwiseRegistration::interpolateProperties(const int *index, const float *weight, int nSamples, const float *property, float *feature)
 {
-	float property = 0;
-
-	if (index != -1)
+	// feature (nProperties x nSamples) = operator (nSamples x nVertex, 3 non-zeros per row) * property (nVertex x nProperties)
+	int nTotalProperties = m_nProperties + m_nSurfaceProperties;
+	for (int i = 0; i < nSamples; i++)
 	{
-		Face *f = (Face *)mesh->face(index);
-		Vertex *a = (Vertex *)f->vertex(0);
-		Vertex *b = (Vertex *)f->vertex(1);
-		Vertex *c = (Vertex *)f->vertex(2);
-		property = refMap[a->id()] * coeff[0] + refMap[b->id()] * coeff[1] + refMap[c->id()] * coeff[2];
+		const float *a = &property[index[i * 3] * nTotalProperties];
+		const float *b = &property[index[i * 3 + 1] * nTotalProperties];
+		const float *c = &property[index[i * 3 + 2] * nTotalProperties];
+		float wa = weight[i * 3], wb = weight[i * 3 + 1], wc = weight[i * 3 + 2];
+		for (int k = 0; k < nTotalProperties; k++)
+			feature[nSamples * k + i] = a[k] * wa + b[k] * wb + c[k] * wc;
 	}
-
-	return property;
 }
 
-float GroupwiseRegistration::cost(float *coeff, int statusStep)
+int GroupwiseRegistration::updateFolds(int &nRecomputed)
 {
-	// update defomation fields
-	for (int i = 0; i < m_nSubj; i++) updateDeformation(i);
+	// update defomation fields and detect flips: subjects are independent, each of them is computed by a single thread
+	// with the same operations as serially, and the counts are summed in subject order (results do not depend on the threads)
+	// unchanged subjects (same version) reuse their deformation and fold count
+	bool *recomputed = new bool[m_nSubj];
+	m_pool->run(m_nSubj, [&](int i)
+	{
+		recomputed[i] = updateDeformation(i);
+		if (m_spharm[i].foldVersion != m_spharm[i].version)
+		{
+			m_spharm[i].folds = testTriangleFlip(m_spharm[i].sphere, m_spharm[i].flip);
+			m_spharm[i].foldVersion = m_spharm[i].version;
+		}
+	});
 	
 	// how many flips are detected
 	int nFolds = 0;
+	nRecomputed = 0;
 	for (int i = 0; i < m_nSubj; i++)
-		nFolds += testTriangleFlip(m_spharm[i].sphere, m_spharm[i].flip);
+	{
+		nFolds += m_spharm[i].folds;
+		if (recomputed[i]) nRecomputed++;
+	}
+	m_nRecomputed += nRecomputed;
+	m_nFolds = nFolds;
+	delete [] recomputed;
+
+	return nFolds;
+}
+
+float GroupwiseRegistration::cost(float *coeff, int statusStep)
+{
+	int nRecomputed;
+	int nFolds = updateFolds(nRecomputed);
 
 	float fcost = (nFolds == 0) ? 0: (nFolds + 1) * fabs(m_mincost);
 	float ecost = (nFolds == 0) ? entropy(): m_mincost;
 
 	float cost = ecost + fcost;
+	m_lastCost = cost;
+	m_nCost++;
 	if (m_mincost > cost)
 	{
 		m_mincost = cost;
-		// write the current optimal solutions
-		for (int subj = 0; subj < m_nSubj; subj++)
-		{
-			saveCoeff(m_output[subj], subj);
-		}
+		// keep the current optimal solutions: written later by the background writer
+		m_writer->update(m_coeff);
 	}
 	
 	if (nIter % statusStep == 0)
 	{
 		cout << "[" << nIter << "] " << cost << " (" << ecost << " + " << fcost << ")" << " " << m_mincost << endl;
 	}
+	if (m_telemetryInterval > 0 && nIter % m_telemetryInterval == 0)
+	{
+		// [telemetry] iteration degree entropy fold mincost elapsed(s) recomputed(subjects)
+		cout << "[telemetry] " << nIter << " " << m_degree_inc << " " << ecost << " " << fcost << " " << m_mincost << " " << elapsed() << " " << nRecomputed << endl;
+	}
 	nIter++;
+	updateStop();
 
 	// copy previous coefficients
 	memcpy(m_coeff_prev_step, m_coeff, sizeof(float) * m_csize * 2);
@@ -750,25 +1303,265 @@ int GroupwiseRegistration::testTriangleFlip(Mesh *mesh, const bool *flip)
 
 void GroupwiseRegistration::optimization(void)
 {
-	cost_function costFunc(this);
-	int prev = 0;
 	int step = 1;
-	
-	int n1 = (m_degree_inc + 1) * (m_degree_inc + 1) * m_nSubj * 2;
-	int n2 = m_csize * 2 - n1;
+	// coefficients of the stages already done are not optimized again (resumed optimization)
+	int prev = (m_degree_inc > m_degree_start) ? (m_degree_inc - step + 1) * (m_degree_inc - step + 1) * m_nSubj * 2: 0;
 
 	while (m_degree_inc < m_degree)
 	{
-		nIter = 0;
+		RunReport::Mark t = RunReport::mark();
+		m_writer->flush();	// the solutions on disk must be up to date with the checkpoint
+		saveCheckpoint(false);
+		m_report.add("checkpoint", t);
+
+		t = RunReport::mark();
+		updateSamplingLevel();
 		int n = (m_degree_inc + 1) * (m_degree_inc + 1) * m_nSubj * 2 - prev;
-		min_newuoa(n, &m_coeff[prev], costFunc, 1.0f, 1e-5f, m_maxIter);
+		beginStage(n);
+		minimize(prev, n, 1e-5f);
+		reportRecomputed();
+		ostringstream stage;
+		stage << "stage_" << m_degree_inc;
+		m_report.add(stage.str(), t);
 		prev = (m_degree_inc + 1) * (m_degree_inc + 1) * m_nSubj * 2;
 		m_degree_inc = min(m_degree_inc + step, m_degree);
 	}
 	
 	// the entire optimization together
+	RunReport::Mark t = RunReport::mark();
+	m_writer->flush();
+	saveCheckpoint(false);
+	m_report.add("checkpoint", t);
+
+	t = RunReport::mark();
+	updateSamplingLevel();
+	beginStage(m_csize * 2);
+	minimize(0, m_csize * 2, 1e-6f);
+	reportRecomputed();
+	m_report.add("stage_final", t);
+}
+
+void GroupwiseRegistration::minimize(int offset, int n, float tol)
+{
+	// coefficients m_coeff[offset], ..., m_coeff[offset + n - 1] are optimized in place
+	cost_function costFunc(this);
+	if (m_optimizer == LbfgsOptimizer)
+	{
+		if (m_incrementalCov)
+		{
+			gradient_function gradFunc(this, offset, n);
+			min_lbfgs(n, &m_coeff[offset], costFunc, gradFunc, 0.1f, (double)tol, m_stageIter);
+		}
+		if (!m_incrementalCov)
+		{
+			// no gradient without the incremental covariance: the stage goes on from the current solution with NEWUOA
+			cout << " Warning: L-BFGS needs the incremental covariance, NEWUOA is used (degree " << m_degree_inc << ")\n";
+			if (m_stopReason == noGradient) m_stopReason = NULL;
+			if (!stopped()) min_newuoa(n, &m_coeff[offset], costFunc, 1.0f, tol, m_stageIter);
+		}
+	}
+	else if (m_optimizer == BlockOptimizer)
+	{
+		// coefficients of each subject (interleaved in m_coeff with a stride of 2 * m_nSubj)
+		vector<vector<int> > index(m_nSubj);
+		for (int v = offset; v < offset + n; v++) index[(v % (m_nSubj * 2)) / 2].push_back(v);
+
+		// block-coordinate descent: all the subjects interact through the covariance, so they are optimized one after another
+		// against the latest solutions of the others; each evaluation only recomputes the subject being optimized
+		float prevCost = cost(m_coeff);
+		for (int pass = 0; pass < m_blockPasses; pass++)
+		{
+			for (int subj = 0; subj < m_nSubj && !stopped(); subj++)
+			{
+				if (index[subj].size() < 2) continue;
+				vector<float> x(index[subj].size());
+				for (int i = 0; i < x.size(); i++) x[i] = m_coeff[index[subj][i]];
+				block_cost_function blockFunc(this, index[subj]);
+				min_newuoa((int)x.size(), &x[0], blockFunc, (pass == 0) ? 1.0f: 0.1f, tol, m_stageIter);
+				blockCost(&x[0], index[subj]);	// keep the solution of the subject
+			}
+			float passCost = cost(m_coeff);
+			cout << "Pass " << pass << ": " << passCost << endl;
+			if (stopped() || prevCost - passCost <= tol * fabs(prevCost)) break;
+			prevCost = passCost;
+		}
+	}
+	else min_newuoa(n, &m_coeff[offset], costFunc, 1.0f, tol, m_stageIter);
+}
+
+float GroupwiseRegistration::blockCost(const float *x, const vector<int> &index)
+{
+	// cost with the coefficients of a block (x) replaced
+	for (int i = 0; i < index.size(); i++) m_coeff[index[i]] = x[i];
+	return cost(m_coeff);
+}
+
+static double finiteDifference(double f0, double fp, bool validp, double fm, bool validm, double h)
+{
+	// a side creating folds is not used: the fold penalty is a barrier, not a slope
+	if (validp && validm) return (fp - fm) / (2 * h);
+	if (validp) return (fp - f0) / h;
+	if (validm) return (f0 - fm) / h;
+	return 0;
+}
+
+void GroupwiseRegistration::gradient(int offset, int n, double *grad)
+{
+	// central finite differences of the cost at the last evaluated coefficients
+	// a coefficient only changes the features of its subject: the cost is updated from a single row of the Gram matrix,
+	// and the subjects are processed in parallel without touching the shared feature vectors, the minimum cost or the writer
+	// (landmarks couple the subjects and the full covariance has no Gram matrix: the CLI refuses L-BFGS in these cases)
+	const float h = 1e-3f;
+	int nSamples = m_propertySamples.size();
+	int dim = nSamples * (m_nProperties + m_nSurfaceProperties);
+	double f0 = m_lastCost;
+
+	// the last evaluation has folds (its features are not sampled) or the covariance is not calibrated yet:
+	// the features and the Gram matrix are brought to the current coefficients first, and the fold penalty is left out
+	if (m_nFolds > 0 || !m_covCalibrated) f0 = entropy();
+
+	// the calibration failed and the covariance is computed in full: the Gram matrix is out of date, L-BFGS is stopped
+	if (!m_incrementalCov)
+	{
+		if (m_stopReason == NULL) m_stopReason = noGradient;
+		memset(grad, 0, sizeof(double) * n);
+		return;
+	}
+
+	vector<vector<int> > vars(m_nSubj);
+	for (int v = 0; v < n; v++) vars[((offset + v) % (m_nSubj * 2)) / 2].push_back(v);
+	m_pool->run(m_nSubj, [&](int subj)
+	{
+		if (vars[subj].empty()) return;
+		vector<float> feature(dim), cov(m_nSubj * m_nSubj), eig(m_nSubj), work(m_nSubj * 3 - 1);
+		vector<double> gram(m_nSubj * m_nSubj);
+		int folds = m_spharm[subj].folds;
+		for (int j = 0; j < vars[subj].size(); j++)
+		{
+			int v = vars[subj][j];
+			float c0 = m_coeff[offset + v];
+			bool validp, validm;
+			m_coeff[offset + v] = c0 + h;
+			float fp = subjectEntropy(subj, &feature[0], &gram[0], &cov[0], &eig[0], &work[0], validp);
+			m_coeff[offset + v] = c0 - h;
+			float fm = subjectEntropy(subj, &feature[0], &gram[0], &cov[0], &eig[0], &work[0], validm);
+			m_coeff[offset + v] = c0;
+			grad[v] = finiteDifference(f0, fp, validp, fm, validm, h);
+		}
+		// back to the deformation and tree of the current solution (its features are still in m_feature)
+		m_spharm[subj].deformDegree = -1;
+		updateDeformation(subj);
+		m_spharm[subj].locator->invalidate();
+		m_updated[subj] = true;
+		m_spharm[subj].folds = folds;
+		m_spharm[subj].foldVersion = m_spharm[subj].version;
+	});
+}
+
+float GroupwiseRegistration::subjectEntropy(int subj, float *feature, double *gram, float *cov, float *eig, float *work, bool &valid)
+{
+	// entropy if only the coefficients of subj differ from the last evaluation (no fold for the other subjects)
+	updateDeformation(subj);
+	valid = (testTriangleFlip(m_spharm[subj].sphere, m_spharm[subj].flip) == 0);
+	if (!valid) return 0;
+	m_spharm[subj].locator->invalidate();
+	updateSubjectProperties(subj, feature);
+
+	int nSamples = m_propertySamples.size();
+	int dim = nSamples * (m_nProperties + m_nSurfaceProperties);
+	memcpy(gram, m_gram, sizeof(double) * m_nSubj * m_nSubj);
+	for (int j = 0; j < m_nSubj; j++)
+	{
+		const float *xj = (j == subj) ? feature: &m_feature[j * dim];
+		double g = 0;
+		for (int k = 0; k < dim; k++) g += (double)m_feature_weight[k] * feature[k] * xj[k];
+		gram[subj * m_nSubj + j] = g;
+		gram[j * m_nSubj + subj] = g;
+	}
+	centeredCovariance(gram, cov);
+	eigenvalues(cov, m_nSubj, eig, work);
+
+	float E = 0;
+	float alpha = 1e-5;	// avoid a degenerative case
+	for (int i = 1; i < m_nSubj; i++)	// just ignore the first eigenvalue (trivial = 0)
+		E += log(eig[i] + alpha);
+
+	return E;
+}
+
+void GroupwiseRegistration::reportRecomputed(void)
+{
+	// average number of subjects whose deformation, folds and features were recomputed per evaluation
+	if (nIter > 0) cout << "Recomputed subjects per evaluation (degree " << m_degree_inc << "): " << (double)m_nRecomputed / nIter << " / " << m_nSubj << endl;
+	if (m_stopReason != NULL) cout << "Stage stopped (degree " << m_degree_inc << "): " << m_stopReason << " after " << nIter << " evaluations, " << elapsed() << "s" << endl;
+}
+
+void GroupwiseRegistration::beginStage(int n)
+{
+	// budgets of a stage optimizing n coefficients
+	int stage = max(m_degree_inc - m_degree_start, 0);
+	int maxIter = (m_stageMaxIter.empty()) ? 0: m_stageMaxIter[min(stage, (int)m_stageMaxIter.size() - 1)];
+	float stageTime = (m_stageTime.empty()) ? 0: m_stageTime[min(stage, (int)m_stageTime.size() - 1)];
+	m_stageIter = (maxIter > 0) ? maxIter: m_maxIter;	// iterations of the optimizer (per subject for the block optimizer)
+	m_stageEvaluations = maxIter;	// an explicit budget also bounds the cost evaluations of the whole stage
+	
+	// the remaining time is shared among the remaining stages (the final joint optimization included) according to
+	// their number of coefficients: the time left by a stage that stops early goes to the next ones
+	double now = elapsed();
+	m_stageDeadline = 0;
+	if (m_timeBudget > 0)
+	{
+		double remaining = n;
+		if (m_degree_inc < m_degree)
+		{
+			for (int d = m_degree_inc + 1; d < m_degree; d++) remaining += (2 * d + 1) * m_nSubj * 2;
+			remaining += m_csize * 2;
+		}
+		m_stageDeadline = now + max(m_timeBudget - now, 0.0) * n / remaining;
+	}
+	if (stageTime > 0) m_stageDeadline = (m_stageDeadline > 0) ? min(m_stageDeadline, now + stageTime): now + stageTime;
+
 	nIter = 0;
-	min_newuoa(m_csize * 2, m_coeff, costFunc, 1.0f, 1e-6f, m_maxIter);
+	m_nRecomputed = 0;
+	m_minHistory.clear();
+	m_stopReason = NULL;
+	if (m_stageDeadline > 0) cout << "Stage budget (degree " << m_degree_inc << "): " << m_stageIter << " evaluations, " << m_stageDeadline - now << "s" << endl;
+}
+
+void GroupwiseRegistration::updateStop(void)
+{
+	// called after each evaluation: the optimizers end the stage at their best point once a reason is set
+	if (m_convergenceWindow > 0) m_minHistory.push_back(m_mincost);
+	if (m_stopReason != NULL) return;
+
+	if (m_stageEvaluations > 0 && nIter >= m_stageEvaluations) m_stopReason = "iteration budget";
+	else if (m_stageDeadline > 0 && elapsed() >= m_stageDeadline) m_stopReason = "time budget";
+	else if (m_convergenceWindow > 0 && m_minHistory.size() > m_convergenceWindow)
+	{
+		float prev = m_minHistory[m_minHistory.size() - 1 - m_convergenceWindow];
+		if (prev != FLT_MAX && prev - m_mincost <= m_convergenceTol * fabs(prev)) m_stopReason = "convergence";
+	}
+}
+
+bool GroupwiseRegistration::stopped(void)
+{
+	return m_stopReason != NULL;
+}
+
+float GroupwiseRegistration::lastCost(void)
+{
+	return m_lastCost;
+}
+
+float *GroupwiseRegistration::coefficients(void)
+{
+	// current solution: m_coeff[nSubj * 2 * i + subj * 2 + {0: latitude, 1: longitude}] for the basis function i
+	return m_coeff;
+}
+
+double GroupwiseRegistration::elapsed(void)
+{
+	return std::chrono::duration<double>(std::chrono::steady_clock::now() - m_startTime).count();
 }
 
 int GroupwiseRegistration::icosahedron(int degree)
@@ -860,15 +1653,38 @@ int GroupwiseRegistration::icosahedron(int degree)
 	return m_propertySamples.size();
 }
 
-void GroupwiseRegistration::saveCoeff(const char *filename, int id)
+void GroupwiseRegistration::saveCheckpoint(bool done)
 {
-	FILE *fp = fopen(filename, "w");
-	fprintf(fp, "%f %f %f\n", m_spharm[id].pole[0], m_spharm[id].pole[1], m_spharm[id].pole[2]);
-	fprintf(fp, "%d\n", m_spharm[id].degree);
-	int n = (m_spharm[id].degree + 1) * (m_spharm[id].degree + 1);
-	for (int i = 0; i < n; i++)
+	if (m_checkpoint == NULL) return;
+
+	// the best coefficients are already saved as outputs: only the current stage is needed to resume
+	string tmp = AtomicFile::temporary(m_checkpoint);
+	FILE *fp = fopen(tmp.c_str(), "w");
+	bool written = (fp != NULL);
+	if (written)
 	{
-		fprintf(fp, "%f %f\n", *m_spharm[id].coeff[i], *m_spharm[id].coeff[n + i]);
+		written = fprintf(fp, "degree %d\n", m_degree_inc) > 0;
+		written = fprintf(fp, "status %s\n", (done) ? "done": "running") > 0 && written;
+		written = AtomicFile::commit(fp, tmp, m_checkpoint, written);
 	}
+	if (!written) cout << " Warning: the checkpoint " << m_checkpoint << " cannot be written\n";
+}
+
+int GroupwiseRegistration::loadCheckpoint(const char *filename)
+{
+	// incremental degree of an interrupted optimization, -1 if there is nothing to resume
+	FILE *fp = fopen(filename, "r");
+	if (fp == NULL) return -1;
+	int degree = -1;
+	char status[16] = "";
+	if (fscanf(fp, "degree %d\n", &degree) != 1 || fscanf(fp, "status %15s", status) != 1) degree = -1;
 	fclose(fp);
+	if (strcmp(status, "running") != 0) degree = -1;
+
+	return degree;
+}
+
+void GroupwiseRegistration::saveCoeff(const char *filename, int id)
+{
+	CoefficientWriter::save(filename, m_spharm[id].pole, m_spharm[id].degree, m_coeff, m_nSubj, id);
 }
@@ -2,7 +2,7 @@
 *	GroupwiseRegistration.h
 *
 *	Release: Sep 2016
-*	Update: Sep 2016
+*	Update: Sep 2016
 *
 *	University of North Carolina at Chapel Hill
 *	Department of Computer Science
@@ -12,45 +12,97 @@
 
 #pragma once
 #include <algorithm>
+#include <atomic>
+#include <chrono>
 #include <iostream>
 #include <vector>
 #include "Mesh.h"
 #include "AABB.h"
+#include "CoefficientWriter.h"
+#include "FaceLocator.h"
+#include "PropertyCache.h"
+#include "RunReport.h"
+#include "ThreadPool.h"
 
 using namespace std;
 
 class GroupwiseRegistration
 {
 public:
+	// storage of the vertex basis functions: memory vs. speed
+	enum BasisMode
+	{
+		FullBasis,		// float matrix of all the vertices (fastest)
+		HalfBasis,		// half-precision matrix (half the memory, ~5e-4 relative precision)
+		OnTheFlyBasis	// no storage: basis functions recomputed block by block at each deformation
+	};
+
+	// optimizer of the coefficients
+	enum Optimizer
+	{
+		NewuoaOptimizer,	// derivative-free (Powell's NEWUOA)
+		LbfgsOptimizer,		// L-BFGS with finite-difference gradients (properties only, incremental covariance)
+		BlockOptimizer		// NEWUOA on one subject at a time, the other subjects being fixed (sweeps over the cohort)
+	};
+
 	GroupwiseRegistration(void);
-	GroupwiseRegistration(const char **sphere, int nSubj, const char **property, int nProperties, const char **output, const float *weight, int deg = 5, const char **landmark = NULL, float weightLoc = 0, const char **coeff = NULL, const char **surf = NULL, int maxIter = 50000);
+	GroupwiseRegistration(const char **sphere, int nSubj, const char **property, int nProperties, const char **output, const float *weight, int deg = 5, const char **landmark = NULL, float weightLoc = 0, const char **coeff = NULL, const char **surf = NULL, int maxIter = 50000, int telemetryInterval = 0, int resumeDegree = 0, const char *checkpoint = NULL, float writeInterval = 5, int writeImprovements = 100, const char *container = NULL, bool textOutput = true, const char *coeffContainer = NULL, const char *propertyCache = NULL, int nThreads = 0, int basisMode = FullBasis, bool incrementalCovariance = true, int optimizer = NewuoaOptimizer, int blockPasses = 3, const int *samplingLevels = NULL, int nSamplingLevels = 0, float timeBudget = 0, const int *stageMaxIter = NULL, int nStageMaxIter = 0, const float *stageTime = NULL, int nStageTime = 0, int convergenceWindow = 0, float convergenceTol = 1e-4, const char *report = NULL);
 	~GroupwiseRegistration(void);
 	void run(void);
 	void saveCoeff(const char *filename, int id);
+	static int loadCheckpoint(const char *filename);
 	float cost(float *coeff, int statusStep = 10);
+	void gradient(int offset, int n, double *grad);
+	float blockCost(const float *x, const vector<int> &index);
+	bool stopped(void);
+	float lastCost(void);
+	float *coefficients(void);
 
 private:
+	friend class GroupwiseRegistrationTest;	// unit tests of the internal computations
+
 	// class members for initilaization
-	void init(const char **sphere, const char **property, const float *weight, const char **landmark, float weightLoc, const char **coeff, const char **surf, int samplingDegree = 3);
-	void initSphericalHarmonics(int subj, const char **coeff);
+	void init(const char **sphere, const char **property, const float *weight, const char **landmark, float weightLoc, const char **coeff, const char **surf, int samplingDegree = 3, const char *coeffContainer = NULL);
+	void initSubject(int subj, const char **sphere, const char **property, const char **landmark, const char **coeff, const char **surf, ostream &log);
+	void initSphericalHarmonics(int subj, const char **coeff, ostream &log);
 	void initTriangleFlipping(int subj);
-	void initProperties(int subj, const char **property, int nHeaderLines);
+	void initProperties(int subj, const char **property, int nHeaderLines, ostream &log);
 	void initLandmarks(int subj, const char **landmark);
+	void initFeatures(int samplingDegree);
 	int icosahedron(int degree);
 
+	// multiresolution sampling of the properties
+	int samplingLevel(int degree);
+	void updateSamplingLevel(void);
+
+	// checkpoint of the incremental optimization
+	void saveCheckpoint(bool done);
+	void saveReport(bool completed);
+
 	// entropy computation
 	void optimization(void);
+	void minimize(int offset, int n, float tol);
+	void reportRecomputed(void);
+	void beginStage(int n);
+	void updateStop(void);
+	double elapsed(void);
 	void updateLandmark(void);
 	void updateLandmarkMedian(void);
 	void updateProperties(void);
-	void eigenvalues(float *M, int dim, float *eig);
+	void updateSubjectProperties(int subj, float *feature);
+	float subjectEntropy(int subj, float *feature, double *gram, float *cov, float *eig, float *work, bool &valid);
+	void updateCovariance(int dim);
+	void centeredCovariance(const double *gram, float *cov);
+	void eigenvalues(float *M, int dim, float *eig, float *work);
 	float entropy(void);
-	float propertyInterpolation(float *refMap, int index, float *coeff, Mesh *mesh);
+	int updateFolds(int &nRecomputed);
+	void interpolateProperties(const int *index, const float *weight, int nSamples, const float *property, float *feature);
 	int testTriangleFlip(Mesh *mesh, const bool *flip);
 
 	// deformation field reconstruction
-	void updateDeformation(int subject);
+	bool updateDeformation(int subject);
 	bool updateCoordinate(const float *v0, float *v1, const float *Y, const float **coeff, float degree, const float *pole);
+	bool deformCoordinate(const float *v0, float *v1, const float *delta, const float *pole);
 	
 private:
 	struct point
@@ -65,19 +117,33 @@ private:
 		int degree;
 		float **coeff;
 		float **coeff_prev_step;
+		float *basis;	// basis functions of all the vertices: nVertex x (m_degree + 1)^2, row-major (FullBasis)
+		unsigned short *basisHalf;	// the same in half precision (HalfBasis)
+		float *delta;	// displacements (latitude, longitude) of all the vertices
 		float pole[3];
 		vector<point *> vertex;
 		AABB *tree;
+		FaceLocator *locator;	// face of the sampling points: walk from tree_cache, tree (fully rebuilt if stale) as fallback
 		Mesh *sphere;
 		Mesh *surf;
-		float *property;
+		float *property;	// properties divided by their standard deviation: nVertex x (m_nProperties + m_nSurfaceProperties), row-major
 		int *tree_cache;
+		// sparse interpolation operator of the sampling points (nSamples x nVertex): the 3 vertices of the face
+		// containing each sampling point and their barycentric weights, rebuilt at each deformation
+		int *interpIndex;
+		float *interpWeight;
 		float *meanProperty;
 		float *maxProperty;
 		float *minProperty;
 		float *sdevProperty;
 		vector<point *> landmark;
 		bool *flip;
+
+		// dirty tracking: the version is incremented whenever the deformation changes
+		unsigned int version;
+		int deformDegree;	// incremental degree of the current deformation (-1: not deformed yet)
+		unsigned int foldVersion;	// version of the cached fold count
+		int folds;
 	};
 
 	int m_nSubj;
@@ -87,12 +153,17 @@ private:
 	int m_maxIter;
 	int m_degree;
 	int m_degree_inc;	// incremental degree
+	int m_degree_start;	// first degree of the incremental optimization
 	
 	float *m_coeff;
 	float *m_coeff_prev_step;	// previous coefficients
 	bool *m_updated;
 	spharm *m_spharm;
 	vector<float *> m_propertySamples;
+	vector<int> m_samplingLevel;	// icosahedron level of each stage (empty: level 4 for all the stages)
+	int m_samplingDegree;	// icosahedron level of m_propertySamples
+	vector<float> m_propertyWeight;	// weighting factors of the properties
+	float m_weightLoc;	// weighting factor of the location information
 	
 	float m_mincost;
 	
@@ -102,12 +173,72 @@ private:
 	float *m_feature_weight;
 	float *m_eig;
 	float *m_work;	// for lapack eigenvalue computation
+
+	// incremental dual covariance: weighted Gram matrix of the feature vectors, whose rows are only recomputed for the
+	// subjects whose feature vector changed (m_featureChanged); the centered covariance is derived from it
+	bool m_incrementalCov;
+	bool m_covCalibrated;	// the normalization of Statistics::wcov_trans is found at the first evaluation
+	double m_covScale;
+	double *m_gram;
+	bool *m_featureChanged;
 	
 	// tic
 	int nIter;
+	long long m_nRecomputed;	// subjects recomputed over the evaluations of the current stage
+	int m_nFolds;	// folds of the last evaluation
+	float m_lastCost;	// cost of the last evaluation
+
+	// budgets: a stage stops at its deadline, after its number of evaluations, or once m_mincost does not improve
+	// by more than m_convergenceTol (relative) over m_convergenceWindow evaluations
+	float m_timeBudget;	// total time in seconds (0: no limit), shared among the stages according to their number of coefficients
+	vector<int> m_stageMaxIter;	// evaluations of each stage, the last one being repeated (empty or 0: m_maxIter)
+	vector<float> m_stageTime;	// time of each stage in seconds, the last one being repeated (empty or 0: no limit)
+	int m_convergenceWindow;	// 0: disabled
+	float m_convergenceTol;
+	int m_stageIter;	// maximum iterations of the optimizer in the current stage
+	int m_stageEvaluations;	// maximum cost evaluations of the current stage (0: no limit)
+	double m_stageDeadline;	// elapsed time at which the current stage stops (0: no limit)
+	vector<float> m_minHistory;	// m_mincost after each evaluation of the current stage
+	const char *m_stopReason;	// why the current stage stopped (NULL: running)
+
+	int m_optimizer;	// Optimizer
+	int m_blockPasses;	// maximum number of sweeps over the subjects (BlockOptimizer)
+
+	// worker threads for the per-subject computations
+	ThreadPool *m_pool;
+
+	// basis storage (BasisMode) and number of vertices per block for the compact modes
+	int m_basisMode;
+	int m_basisBlock;
+
+	// telemetry: one machine-readable record every m_telemetryInterval evaluations (0: disabled)
+	int m_telemetryInterval;
+	std::chrono::steady_clock::time_point m_startTime;
+
+	// report of the run: time and memory of the phases, and calls of the expensive routines
+	RunReport m_report;
+	const char *m_reportFile;	// JSON report (NULL: no report)
+	long long m_nCost;
+	atomic<long long> m_nClosestFace;	// queries of the AABB trees (the face walk failed)
+	atomic<long long> m_nFaceHit;	// the cached face still contains the sampling point
+	atomic<long long> m_nFaceWalk;	// found by walking from the cached face
+	atomic<long long> m_nFaceSteps;	// faces crossed by the walks
+	atomic<long long> m_nTreeRebuild;	// full rebuilds of the AABB trees (AABB::update), only when a face walk fails
+	atomic<long long> m_nEigen;
 
 	// output list
 	const char **m_output;
+	CoefficientWriter *m_writer;	// background writer of the best solution
+
+	// previous solutions from a binary container (warm start)
+	vector<string> m_warmName;
+	vector<float> m_warmPole;
+	vector<float> m_warmCoeff;
+	int m_warmDegree;
+
+	// checkpoint file: stage of the incremental optimization (NULL: no checkpoint)
+	const char *m_checkpoint;
+	const char *m_propertyCache;	// directory of the binary property caches
 };
 
 class cost_function
@@ -120,10 +251,62 @@ public:
 
     double operator () (float *arg)
     {
+		if (m_instance->stopped()) return (double)m_instance->lastCost();	// the stage is over: no more evaluations
 		float cost = m_instance->cost(arg);
         return (double)cost;
     }
 
+    bool stop(void)
+    {
+		return m_instance->stopped();
+    }
+
+private:
+	GroupwiseRegistration *m_instance;
+};
+
+class block_cost_function
+{
+public:
+    block_cost_function (GroupwiseRegistration *instance, const vector<int> &index): m_index(index)
+    {
+        m_instance = instance;
+    }
+
+    double operator () (float *arg)
+    {
+		if (m_instance->stopped()) return (double)m_instance->lastCost();	// the stage is over: no more evaluations
+		float cost = m_instance->blockCost(arg, m_index);
+        return (double)cost;
+    }
+
+    bool stop(void)
+    {
+		return m_instance->stopped();
+    }
+
+private:
+	GroupwiseRegistration *m_instance;
+	const vector<int> &m_index;
+};
+
+class gradient_function
+{
+public:
+    gradient_function (GroupwiseRegistration *instance, int offset, int n)
+    {
+        m_instance = instance;
+        m_offset = offset;
+        m_n = n;
+    }
+
+    void operator () (float *arg, double *grad)
+    {
+		m_instance->gradient(m_offset, m_n, grad);
+    }
+
 private:
 	GroupwiseRegistration *m_instance;
+	int m_offset;
+	int m_n;
 };
@@ -0,0 +1,127 @@
+/*************************************************
+*	PropertyCache.cpp
+*
+*	Binary cache of the property files
+*	Part of the Groups command line module
+*************************************************/
+
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <sys/stat.h>
+#include "AtomicFile.h"
+#include "PropertyCache.h"
+#include "Mesh.h"
+
+string PropertyCache::cacheName(const char *property, const char *cacheDir)
+{
+	// [cacheDir]/[property file name].[hash of its full path].bin
+	string path, name = property;
+	long long size, mtime;
+	if (!source(property, path, size, mtime)) path = property;
+	size_t pivot = name.find_last_of("/\\");
+	if (pivot != string::npos) name = name.substr(pivot + 1);
+
+	unsigned long long hash = 14695981039346656037ULL;	// 64-bit FNV-1a
+	for (int i = 0; i < path.size(); i++) hash = (hash ^ (unsigned char)path[i]) * 1099511628211ULL;
+	char key[17];
+	snprintf(key, sizeof(key), "%016llx", hash);
+
+	return string(cacheDir) + "/" + name + "." + key + ".bin";
+}
+
+bool PropertyCache::source(const char *property, string &path, long long &size, long long &mtime)
+{
+	// absolute path, size and modification time of a property file
+	struct stat info;
+	if (::stat(property, &info) != 0) return false;
+	size = (long long)info.st_size;
+	mtime = (long long)info.st_mtime;
+#ifdef _WIN32
+	char full[_MAX_PATH];
+	path = (_fullpath(full, property, _MAX_PATH) != NULL) ? full: property;
+#else
+	char *full = realpath(property, NULL);
+	path = (full != NULL) ? full: property;
+	free(full);
+#endif
+	return true;
+}
+
+void PropertyCache::statistics(const float *value, int nValues, float *stat)
+{
+	// the same statistics as computed from the text files
+	stat[0] = Statistics::mean(value, nValues);
+	stat[1] = Statistics::min(value, nValues);
+	stat[2] = Statistics::max(value, nValues);
+	stat[3] = sqrt(Statistics::var(value, nValues));
+}
+
+bool PropertyCache::build(const char *property, const char *cache, int nHeaderLines)
+{
+	FILE *fp = fopen(property, "r");
+	if (fp == NULL) return false;
+
+	// remove header lines
+	char line[1024];
+	for (int j = 0; j < nHeaderLines; j++) fgets(line, sizeof(line), fp);
+
+	// load property information
+	vector<float> value;
+	float v;
+	while (fscanf(fp, "%f", &v) == 1) value.push_back(v);
+	fclose(fp);
+	if (value.empty()) return false;
+
+	float stat[4];
+	statistics(&value[0], value.size(), stat);
+
+	return save(property, cache, value.size(), &value[0], stat);
+}
+
+bool PropertyCache::save(const char *property, const char *cache, int nValues, const float *value, const float *stat)
+{
+	string path;
+	long long size, mtime;
+	if (!source(property, path, size, mtime)) return false;
+	int length = path.size();
+
+	string tmp = AtomicFile::temporary(cache);
+	FILE *fp = fopen(tmp.c_str(), "wb");
+	if (fp == NULL) return false;
+	bool written = fwrite("GRPPROP2", 1, 8, fp) == 8 && fwrite(&nValues, sizeof(int), 1, fp) == 1 &&
+				fwrite(&size, sizeof(long long), 1, fp) == 1 && fwrite(&mtime, sizeof(long long), 1, fp) == 1 &&
+				fwrite(&length, sizeof(int), 1, fp) == 1 && fwrite(path.c_str(), 1, length, fp) == length &&
+				fwrite(stat, sizeof(float), 4, fp) == 4 && fwrite(value, sizeof(float), nValues, fp) == nValues;
+
+	return AtomicFile::commit(fp, tmp, cache, written);
+}
+
+bool PropertyCache::load(const char *property, const char *cache, int nValues, float *value, float *stat)
+{
+	// the cache must have been built from this very property file, unchanged since
+	string path;
+	long long size, mtime;
+	if (!source(property, path, size, mtime)) return false;
+
+	FILE *fp = fopen(cache, "rb");
+	if (fp == NULL) return false;
+	char magic[8];
+	int n, length;
+	long long cachedSize, cachedTime;
+	bool valid = fread(magic, 1, 8, fp) == 8 && memcmp(magic, "GRPPROP2", 8) == 0 &&
+				fread(&n, sizeof(int), 1, fp) == 1 && n == nValues &&
+				fread(&cachedSize, sizeof(long long), 1, fp) == 1 && cachedSize == size &&
+				fread(&cachedTime, sizeof(long long), 1, fp) == 1 && cachedTime == mtime &&
+				fread(&length, sizeof(int), 1, fp) == 1 && length == path.size();
+	if (valid)
+	{
+		vector<char> cachedPath(length);
+		valid = fread(&cachedPath[0], 1, length, fp) == length && memcmp(&cachedPath[0], path.c_str(), length) == 0 &&
+				fread(stat, sizeof(float), 4, fp) == 4 && fread(value, sizeof(float), nValues, fp) == nValues;
+	}
+	fclose(fp);
+
+	return valid;
+}
@@ -0,0 +1,35 @@
+/*************************************************
+*	PropertyCache.h
+*
+*	Binary cache of the property files
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <string>
+#include <vector>
+
+using namespace std;
+
+// binary cache of a property (attribute .txt) file with its precomputed statistics:
+//	char magic[8] = "GRPPROP2"
+//	int32 nValues
+//	int64 size, mtime (of the property file)
+//	int32 length
+//	char path[length] (absolute path of the property file)
+//	float32 mean, min, max, sdev
+//	float32 values[nValues]
+// the name of a cache depends on the full path of its property file, and a cache is used only if it was built from
+// the same file (path, size and modification time): property files of the same name in other directories never share a cache
+class PropertyCache
+{
+public:
+	static string cacheName(const char *property, const char *cacheDir);
+	static bool build(const char *property, const char *cache, int nHeaderLines);
+	static bool load(const char *property, const char *cache, int nValues, float *value, float *stat);
+	static bool save(const char *property, const char *cache, int nValues, const float *value, const float *stat);
+	static void statistics(const float *value, int nValues, float *stat);
+
+private:
+	static bool source(const char *property, string &path, long long &size, long long &mtime);
+};
@@ -0,0 +1,192 @@
+/*************************************************
+*	RunReport.cpp
+*
+*	JSON report of a run: phases, memory, counters
+*	Part of the Groups command line module
+*************************************************/
+
+#include <algorithm>
+#include <cstdio>
+#include <sstream>
+#ifdef _WIN32
+#include <windows.h>
+#include <psapi.h>
+#else
+#include <sys/resource.h>
+#include <unistd.h>
+#ifdef __APPLE__
+#include <mach/mach.h>
+#endif
+#endif
+#include "AtomicFile.h"
+#include "RunReport.h"
+
+static string quote(const string &s)
+{
+	string q = "\"";
+	for (int i = 0; i < s.size(); i++)
+	{
+		if (s[i] == '"' || s[i] == '\\') q += '\\';
+		q += s[i];
+	}
+	return q + "\"";
+}
+
+RunReport::RunReport(void)
+{
+	m_start = Clock::now();
+}
+
+RunReport::Mark RunReport::mark(void)
+{
+	Mark m;
+	m.time = Clock::now();
+	m.rss = currentRSS();
+	m.peak = peakRSS();
+	return m;
+}
+
+bool RunReport::earlier(const Call &a, const Call &b)
+{
+	return a.start < b.start;
+}
+
+long long RunReport::currentRSS(void)
+{
+#ifdef _WIN32
+	PROCESS_MEMORY_COUNTERS pmc;
+	if (GetProcessMemoryInfo(GetCurrentProcess(), &pmc, sizeof(pmc))) return (long long)pmc.WorkingSetSize;
+	return 0;
+#elif defined(__APPLE__)
+	mach_task_basic_info_data_t info;
+	mach_msg_type_number_t count = MACH_TASK_BASIC_INFO_COUNT;
+	if (task_info(mach_task_self(), MACH_TASK_BASIC_INFO, (task_info_t)&info, &count) != KERN_SUCCESS) return 0;
+	return (long long)info.resident_size;
+#else
+	// total and resident pages
+	FILE *fp = fopen("/proc/self/statm", "r");
+	if (fp == NULL) return 0;
+	long long size, resident;
+	bool valid = fscanf(fp, "%lld %lld", &size, &resident) == 2;
+	fclose(fp);
+	return (valid) ? resident * sysconf(_SC_PAGESIZE): 0;
+#endif
+}
+
+long long RunReport::peakRSS(void)
+{
+#ifdef _WIN32
+	PROCESS_MEMORY_COUNTERS pmc;
+	if (GetProcessMemoryInfo(GetCurrentProcess(), &pmc, sizeof(pmc))) return (long long)pmc.PeakWorkingSetSize;
+	return 0;
+#else
+	struct rusage usage;
+	if (getrusage(RUSAGE_SELF, &usage) != 0) return 0;
+#ifdef __APPLE__
+	return (long long)usage.ru_maxrss;	// bytes
+#else
+	return (long long)usage.ru_maxrss * 1024;	// kilobytes
+#endif
+#endif
+}
+
+void RunReport::add(const string &phase, const Mark &start)
+{
+	Mark end = mark();
+	Call call;
+	call.start = chrono::duration<double>(start.time - m_start).count();
+	call.end = chrono::duration<double>(end.time - m_start).count();
+	call.rssStart = start.rss;
+	call.rssEnd = end.rss;
+	call.peakStart = start.peak;
+	call.peakEnd = end.peak;
+
+	lock_guard<mutex> lock(m_mutex);
+	if (m_phase.find(phase) == m_phase.end()) m_order.push_back(phase);
+	m_phase[phase].push_back(call);
+}
+
+void RunReport::count(const string &name, long long n)
+{
+	lock_guard<mutex> lock(m_mutex);
+	for (int i = 0; i < m_counter.size(); i++)
+		if (m_counter[i].first == name)
+		{
+			m_counter[i].second = n;
+			return;
+		}
+	m_counter.push_back(make_pair(name, n));
+}
+
+void RunReport::info(const string &name, const string &value)
+{
+	lock_guard<mutex> lock(m_mutex);
+	m_info.push_back(make_pair(name, quote(value)));
+}
+
+void RunReport::info(const string &name, double value)
+{
+	ostringstream os;
+	os << value;
+	lock_guard<mutex> lock(m_mutex);
+	m_info.push_back(make_pair(name, os.str()));
+}
+
+double RunReport::elapsed(void) const
+{
+	return chrono::duration<double>(Clock::now() - m_start).count();
+}
+
+bool RunReport::save(const char *filename, bool completed)
+{
+	lock_guard<mutex> lock(m_mutex);
+	ostringstream os;
+	os << "{\n";
+	os << "  \"completed\": " << ((completed) ? "true": "false") << ",\n";
+	os << "  \"elapsed\": " << elapsed() << ",\n";
+	os << "  \"peak_rss\": " << peakRSS() << ",\n";
+	for (int i = 0; i < m_info.size(); i++) os << "  " << quote(m_info[i].first) << ": " << m_info[i].second << ",\n";
+	os << "  \"phases\": [\n";
+	for (int i = 0; i < m_order.size(); i++)
+	{
+		// overlapping calls (from several threads) are merged into periods
+		vector<Call> call = m_phase[m_order[i]];
+		sort(call.begin(), call.end(), earlier);
+		double seconds = 0, threadSeconds = 0;
+		long long growth = 0, peakGrowth = 0;
+		for (int j = 0; j < call.size(); )
+		{
+			Call period = call[j];
+			for (; j < call.size() && call[j].start <= period.end; j++)
+			{
+				threadSeconds += call[j].end - call[j].start;
+				if (call[j].end > period.end)
+				{
+					period.end = call[j].end;
+					period.rssEnd = call[j].rssEnd;
+				}
+				period.peakEnd = max(period.peakEnd, call[j].peakEnd);
+			}
+			seconds += period.end - period.start;
+			growth += period.rssEnd - period.rssStart;
+			peakGrowth += period.peakEnd - period.peakStart;
+		}
+		os << "    {\"name\": " << quote(m_order[i]) << ", \"seconds\": " << seconds << ", \"thread_seconds\": " << threadSeconds << ", \"calls\": " << call.size();
+		os << ", \"rss_growth\": " << growth << ", \"peak_rss_growth\": " << peakGrowth << "}";
+		os << ((i + 1 < m_order.size()) ? ",\n": "\n");
+	}
+	os << "  ],\n";
+	os << "  \"counters\": {";
+	for (int i = 0; i < m_counter.size(); i++) os << ((i > 0) ? ", ": "") << quote(m_counter[i].first) << ": " << m_counter[i].second;
+	os << "}\n";
+	os << "}\n";
+
+	// written next to the destination first, so that a reader never sees a partial report
+	string tmp = AtomicFile::temporary(filename);
+	FILE *fp = fopen(tmp.c_str(), "w");
+	if (fp == NULL) return false;
+	string report = os.str();
+	bool written = fwrite(report.c_str(), 1, report.size(), fp) == report.size();
+
+	return AtomicFile::commit(fp, tmp, filename, written);
+}
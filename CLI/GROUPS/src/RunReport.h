@@ -0,0 +1,59 @@
+/*************************************************
+*	RunReport.h
+*
+*	JSON report of a run: phases, memory, counters
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <chrono>
+#include <map>
+#include <mutex>
+#include <string>
+#include <vector>
+
+using namespace std;
+
+// time and resident memory of the phases of a run, with counters, saved as a JSON report.
+// A phase may be added several times (e.g. once per subject, from several threads): its wall time covers the periods
+// during which at least one of its calls was running, its thread time is the sum of the durations of the calls, and
+// its memory growth is measured over these periods: rss_growth for the resident memory (at their end minus at their
+// start) and peak_rss_growth for the rise of the peak resident memory of the process.
+class RunReport
+{
+public:
+	typedef chrono::steady_clock Clock;
+
+	// start of a phase
+	struct Mark
+	{
+		Clock::time_point time;
+		long long rss, peak;
+	};
+
+	RunReport(void);
+	static Mark mark(void);
+	static long long currentRSS(void);	// bytes (0: not available)
+	static long long peakRSS(void);	// bytes (0: not available)
+	void add(const string &phase, const Mark &start);
+	void count(const string &name, long long n);
+	void info(const string &name, const string &value);
+	void info(const string &name, double value);
+	double elapsed(void) const;
+	bool save(const char *filename, bool completed);
+
+private:
+	struct Call
+	{
+		double start, end;	// seconds since the start of the run
+		long long rssStart, rssEnd, peakStart, peakEnd;
+	};
+	static bool earlier(const Call &a, const Call &b);
+
+	Clock::time_point m_start;
+	mutex m_mutex;
+	vector<string> m_order;	// phases in order of first appearance
+	map<string, vector<Call> > m_phase;
+	vector<pair<string, long long> > m_counter;
+	vector<pair<string, string> > m_info;	// JSON values
+};
@@ -0,0 +1,83 @@
+/*************************************************
+*	ThreadPool.cpp
+*
+*	Pool of worker threads for per-subject work
+*	Part of the Groups command line module
+*************************************************/
+
+#include "ThreadPool.h"
+
+ThreadPool::ThreadPool(int nThreads)
+{
+	m_task = NULL;
+	m_n = 0;
+	m_next = 0;
+	m_active = 0;
+	m_generation = 0;
+	m_stop = false;
+
+	if (nThreads <= 0) nThreads = thread::hardware_concurrency();
+	for (int i = 1; i < nThreads; i++) m_thread.push_back(thread(&ThreadPool::worker, this));
+}
+
+ThreadPool::~ThreadPool(void)
+{
+	{
+		lock_guard<mutex> lock(m_mutex);
+		m_stop = true;
+	}
+	m_start.notify_all();
+	for (int i = 0; i < m_thread.size(); i++) m_thread[i].join();
+}
+
+int ThreadPool::size(void) const
+{
+	return m_thread.size() + 1;
+}
+
+void ThreadPool::run(int n, const function<void(int)> &task)
+{
+	if (m_thread.empty() || n <= 1)
+	{
+		for (int i = 0; i < n; i++) task(i);
+		return;
+	}
+
+	{
+		lock_guard<mutex> lock(m_mutex);
+		m_task = &task;
+		m_n = n;
+		m_next = 0;
+		m_active = m_thread.size();
+		m_generation++;
+	}
+	m_start.notify_all();
+	work();
+
+	unique_lock<mutex> lock(m_mutex);
+	m_done.wait(lock, [this] { return m_active == 0; });
+	m_task = NULL;
+}
+
+void ThreadPool::work(void)
+{
+	for (int i = m_next++; i < m_n; i = m_next++) (*m_task)(i);
+}
+
+void ThreadPool::worker(void)
+{
+	unsigned int generation = 0;
+	unique_lock<mutex> lock(m_mutex);
+	while (true)
+	{
+		m_start.wait(lock, [&] { return m_stop || m_generation != generation; });
+		if (m_stop) return;
+		generation = m_generation;
+
+		lock.unlock();
+		work();
+		lock.lock();
+
+		if (--m_active == 0) m_done.notify_one();
+	}
+}
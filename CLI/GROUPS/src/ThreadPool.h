@@ -0,0 +1,43 @@
+/*************************************************
+*	ThreadPool.h
+*
+*	Pool of worker threads for per-subject work
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <atomic>
+#include <condition_variable>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+using namespace std;
+
+// persistent worker threads running task(0), ..., task(n - 1) in parallel: the calling thread takes part in the work
+// and run() returns once every task is done. Tasks are dispatched dynamically, so they must not depend on their order.
+class ThreadPool
+{
+public:
+	ThreadPool(int nThreads = 0);	// 0: number of cores
+	~ThreadPool(void);
+	int size(void) const;
+	void run(int n, const function<void(int)> &task);
+
+private:
+	void worker(void);
+	void work(void);
+
+private:
+	vector<thread> m_thread;
+	mutex m_mutex;
+	condition_variable m_start;
+	condition_variable m_done;
+	const function<void(int)> *m_task;
+	int m_n;
+	atomic<int> m_next;
+	int m_active;
+	unsigned int m_generation;
+	bool m_stop;
+};
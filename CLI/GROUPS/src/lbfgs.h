@@ -0,0 +1,119 @@
+/*************************************************
+*	lbfgs.h
+*
+*	Limited-memory BFGS minimizer
+*	Part of the Groups command line module
+*************************************************/
+
+#pragma once
+#include <cmath>
+#include <vector>
+
+using namespace std;
+
+// limited-memory BFGS with a backtracking (Armijo) line search
+// func(x) returns the cost at x, grad(x, g) fills the gradient at x: grad is always called right after func on the same x.
+// The displacement of a step is limited to maxStep per variable; the minimization stops once the relative decrease of an
+// accepted step is below tol, no descent step is found, max_iter iterations are done, or func.stop() is true: then
+// neither func nor grad is called anymore, and x is the last evaluated point (or the last accepted one).
+template<class Func, class Grad>
+double min_lbfgs(int n, float *x, Func &func, Grad &grad, float maxStep = 0.1f, double tol = 1e-6, int max_iter = 5000, int m = 7)
+{
+	vector<float> x0(n);
+	vector<double> g(n), g0(n), d(n), alpha(m);
+	vector<vector<double> > s, y;	// last m steps and gradient changes
+	vector<double> rho;
+
+	double f = func(x);
+	if (func.stop()) return f;
+	grad(x, &g[0]);
+	for (int iter = 0; iter < max_iter && !func.stop(); iter++)
+	{
+		// two-loop recursion: d = -H g
+		int k = s.size();
+		for (int i = 0; i < n; i++) d[i] = g[i];
+		for (int j = k - 1; j >= 0; j--)
+		{
+			double a = 0;
+			for (int i = 0; i < n; i++) a += s[j][i] * d[i];
+			alpha[j] = rho[j] * a;
+			for (int i = 0; i < n; i++) d[i] -= alpha[j] * y[j][i];
+		}
+		if (k > 0)
+		{
+			double sy = 0, yy = 0;
+			for (int i = 0; i < n; i++) { sy += s[k - 1][i] * y[k - 1][i]; yy += y[k - 1][i] * y[k - 1][i]; }
+			for (int i = 0; i < n; i++) d[i] *= sy / yy;
+		}
+		for (int j = 0; j < k; j++)
+		{
+			double b = 0;
+			for (int i = 0; i < n; i++) b += y[j][i] * d[i];
+			b *= rho[j];
+			for (int i = 0; i < n; i++) d[i] += s[j][i] * (alpha[j] - b);
+		}
+		double gd = 0, dmax = 0;
+		for (int i = 0; i < n; i++)
+		{
+			d[i] = -d[i];
+			gd += g[i] * d[i];
+		}
+		if (gd >= 0)	// not a descent direction: restart from the steepest descent
+		{
+			s.clear(); y.clear(); rho.clear();
+			gd = 0;
+			for (int i = 0; i < n; i++) { d[i] = -g[i]; gd -= g[i] * g[i]; }
+		}
+		if (gd == 0) break;	// zero gradient
+		for (int i = 0; i < n; i++) dmax = max(dmax, fabs(d[i]));
+		double t = (dmax > maxStep) ? maxStep / dmax: 1;
+
+		// backtracking line search
+		for (int i = 0; i < n; i++) x0[i] = x[i];
+		double fnew = f;
+		bool accepted = false;
+		for (int trial = 0; trial < 20 && !accepted; trial++)
+		{
+			if (func.stop()) break;	// func would return the last cost without evaluating the trial point
+			for (int i = 0; i < n; i++) x[i] = x0[i] + (float)(t * d[i]);
+			fnew = func(x);
+			if (fnew <= f + 1e-4 * t * gd) accepted = true;
+			else t *= 0.5;
+		}
+		if (!accepted)
+		{
+			// back to the last accepted point
+			for (int i = 0; i < n; i++) x[i] = x0[i];
+			if (!func.stop()) func(x);
+			break;
+		}
+		if (func.stop())	// no gradient beyond the budget: the accepted point is the last one
+		{
+			f = fnew;
+			break;
+		}
+
+		// history update
+		for (int i = 0; i < n; i++) g0[i] = g[i];
+		grad(x, &g[0]);
+		vector<double> sk(n), yk(n);
+		double sy = 0;
+		for (int i = 0; i < n; i++)
+		{
+			sk[i] = (double)x[i] - x0[i];
+			yk[i] = g[i] - g0[i];
+			sy += sk[i] * yk[i];
+		}
+		if (sy > 1e-12)
+		{
+			s.push_back(sk); y.push_back(yk); rho.push_back(1 / sy);
+			if (s.size() > m) { s.erase(s.begin()); y.erase(y.begin()); rho.erase(rho.begin()); }
+		}
+
+		bool converged = fabs(f - fnew) <= tol * max(1.0, fabs(f));
+		f = fnew;
+		if (converged) break;
+	}
+
+	return f;
+}
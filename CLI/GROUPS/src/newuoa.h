@@ -1384,7 +1384,14 @@ L290:
 	}
 	++nf;
 L310:
-	if (nf > nftest) {
+	if (nf > nftest || func.stop()) {	/* func.stop(): early stop requested by the caller (budget), at the best point */
+		/* During the initialization (NF <= NPT), XOPT is not set yet:
+		 * the best point is the interpolation point KOPT. */
+		if (nf <= npt) {
+			i__1 = n;
+			for (i__ = 1; i__ <= i__1; ++i__)
+				xopt[i__] = xpt[kopt + i__ * xpt_dim1];
+		}
 		--nf;
 //		fprintf(stderr, "++ Return from NEWUOA because CALFUN has been called MAXFUN times.\n");
 		goto L530;
@@ -13,6 +13,7 @@
 #include <cstdlib>
 #include <vector>
 #include <string>
+#include <fstream>
 #include <dirent.h>
 #include "GroupsCLP.h"
 #include "GroupwiseRegistration.h"
@@ -52,6 +53,35 @@ void getTrimmedList(vector<string> &list, const vector<string> &name)
     sort(list.begin(), list.begin() + list.size());
 }
 
+bool fileExists(const string &filename)
+{
+    FILE *fp = fopen(filename.c_str(), "r");
+    if (fp == NULL) return false;
+    fclose(fp);
+    return true;
+}
+
+bool getManifest(const string &filename, vector<string> &subjName, vector<string> &listSphere, vector<string> &listSurf, vector<string> &listProperty)
+{
+    // manifest written by GroupsLogic: one "<keyword> <value>" entry per line, properties are already ordered subject by subject
+    ifstream manifest(filename.c_str());
+    if (!manifest.is_open()) return false;
+
+    string line;
+    while (getline(manifest, line))
+    {
+        size_t pivot = line.find(' ');
+        if (line.empty() || line[0] == '#' || pivot == string::npos) continue;
+        string keyword = line.substr(0, pivot);
+        string value = line.substr(pivot + 1);
+        if (keyword == "subject") subjName.push_back(value);
+        else if (keyword == "sphere") listSphere.push_back(value);
+        else if (keyword == "surface") listSurf.push_back(value);
+        else if (keyword == "property") listProperty.push_back(value);
+    }
+    return !subjName.empty() && subjName.size() == listSphere.size();
+}
+
 int main(int argc, char *argv[])
 {
     PARSE_ARGS;
@@ -62,17 +92,32 @@ int main(int argc, char *argv[])
         return EXIT_SUCCESS;
     }
     
+    // subject names
+    vector<string> subjName;
+
+    // the manifest already provides the resolved lists: no need to scan and trim the directories
+    if (!manifest.empty())
+    {
+        listSphere.clear(); listSurf.clear(); listProperty.clear();
+        if (!getManifest(manifest, subjName, listSphere, listSurf, listProperty))
+        {
+            cout << "Fatal error: invalid manifest " << manifest << endl;
+            return EXIT_FAILURE;
+        }
+    }
+
     // update list files from the directory information
-    if (!dirSphere.empty() && listSphere.empty()) getListFile(dirSphere, listSphere, "vtk");// listSphere.erase(listSphere.begin() + 30, listSphere.begin() + listSphere.size());
-    if (!dirProperty.empty() && listProperty.empty()) getListFile(dirProperty, listProperty, "txt");
-    if (!dirSurf.empty() && listSurf.empty()) getListFile(dirSurf, listSurf, "vtk");
+    if (manifest.empty())
+    {
+        if (!dirSphere.empty() && listSphere.empty()) getListFile(dirSphere, listSphere, "vtk");// listSphere.erase(listSphere.begin() + 30, listSphere.begin() + listSphere.size());
+        if (!dirProperty.empty() && listProperty.empty()) getListFile(dirProperty, listProperty, "txt");
+        if (!dirSurf.empty() && listSurf.empty()) getListFile(dirSurf, listSurf, "vtk");
+    }
     if (!dirLandmark.empty() && listLandmark.empty()) getListFile(dirLandmark, listLandmark, "txt");
     if (!dirCoeff.empty() && listCoeff.empty()) getListFile(dirCoeff, listCoeff, "coeff");
 
-    // subject names
     int nSubj = listSphere.size();
-    vector<string> subjName;
-    if (nSubj > 0)
+    if (nSubj > 0 && subjName.empty())
     {
         for (int i = 0; i < nSubj; i++)
         {
@@ -98,14 +143,75 @@ int main(int argc, char *argv[])
     for (int i = 0; i < nSubj; i++) listOutput.push_back(dirOutput + "/" + subjName[i] + ".coeff");
     
     // trim all irrelevant files to the sphere files
-    if (!dirProperty.empty()) getTrimmedList(listProperty, subjName);
+    if (manifest.empty() && !dirProperty.empty()) getTrimmedList(listProperty, subjName);
     if (!dirLandmark.empty()) getTrimmedList(listLandmark, subjName);
     if (!dirCoeff.empty()) getTrimmedList(listCoeff, subjName);
-    if (!dirProperty.empty()) getTrimmedList(listProperty, listFilter);
+    if (manifest.empty() && !dirProperty.empty()) getTrimmedList(listProperty, listFilter);
     if (listWeight.empty())
     for (int i = 0; i < listProperty.size() / nSubj; i++)
     listWeight.push_back(1);
 
+    // preprocessing: binary caches of the property files
+    if (buildPropertyCache)
+    {
+        if (dirPropertyCache.empty())
+        {
+            cout << "Fatal error: no property cache directory is provided!" << endl;
+            return EXIT_FAILURE;
+        }
+        int nCache = 0;
+        for (int i = 0; i < listProperty.size(); i++)
+        {
+            string cache = PropertyCache::cacheName(listProperty[i].c_str(), dirPropertyCache.c_str());
+            if (PropertyCache::build(listProperty[i].c_str(), cache.c_str(), 3)) nCache++;
+            else cout << "Warning: " << listProperty[i] << " cannot be cached" << endl;
+        }
+        cout << "Property cache: " << nCache << "/" << listProperty.size() << " files in " << dirPropertyCache << endl;
+        cout << "All done!" << endl;
+        return (nCache == listProperty.size()) ? EXIT_SUCCESS: EXIT_FAILURE;
+    }
+
+    // binary container of all the solutions
+    bool textOutput = (outputFormat != "binary");
+    string container = (outputFormat != "text" && !dirOutput.empty()) ? dirOutput + "/GroupsCoefficients.bin": "";
+
+    // previous solutions: a binary container in the coefficient directory is used if there is no text coefficient file
+    string coeffContainer;
+    if (!dirCoeff.empty() && listCoeff.empty() && fileExists(dirCoeff + "/GroupsCoefficients.bin")) coeffContainer = dirCoeff + "/GroupsCoefficients.bin";
+
+    // report of the run
+    if (report.empty() && !dirOutput.empty()) report = dirOutput + "/GroupsReport.json";
+
+    // checkpoint of the incremental optimization
+    string checkpoint = (dirOutput.empty()) ? "": dirOutput + "/Groups.checkpoint";
+    int resumeDegree = 0;
+    if (resume && !checkpoint.empty())
+    {
+        int degreeInc = GroupwiseRegistration::loadCheckpoint(checkpoint.c_str());
+        bool available = (degreeInc > 0);
+        if (textOutput)
+            for (int i = 0; i < listOutput.size() && available; i++)
+                available = fileExists(listOutput[i]);
+        else available = available && fileExists(container);
+        if (available)
+        {
+            // warm start from the last saved solutions, as with --coefficientDir
+            cout << "Resuming the optimization at degree " << degreeInc << endl;
+            if (textOutput)
+            {
+                listCoeff = listOutput;
+                coeffContainer.clear();
+            }
+            else
+            {
+                listCoeff.clear();
+                coeffContainer = container;
+            }
+            resumeDegree = degreeInc;
+        }
+        else cout << "Nothing to resume: starting from scratch" << endl;
+    }
+
     int nProperties = listProperty.size();
     int nOutput = listOutput.size();
     int nWeight = listWeight.size();
@@ -150,6 +256,11 @@ int main(int argc, char *argv[])
         cout << "Fatal error: # of properties is incosistent with # of weighting factors!" << endl;
         return EXIT_FAILURE;
     }
+    else if (optimizer == "lbfgs" && (nLandmark > 0 || fullCovariance))
+    {
+        cout << "Fatal error: the lbfgs optimizer supports neither landmarks nor the full covariance!" << endl;
+        return EXIT_FAILURE;
+    }
     
     for (int i = 0; i < nSubj; i++) sphere[i] = listSphere[i].c_str();
     for (int i = 0; i < nProperties; i++) property[i] = listProperty[i].c_str();
@@ -166,10 +277,19 @@ int main(int argc, char *argv[])
     cout << "Output: " << nOutput << endl;					for (int i = 0; i < nOutput; i++) cout << output[i] << endl;
     cout << "Landmark: " << nLandmark << endl;				for (int i = 0; i < nLandmark; i++) cout << landmark[i] << endl;
     cout << "Coefficient: " << nCoeff << endl;				for (int i = 0; i < nCoeff; i++) cout << coeff[i] << endl;
+    if (!coeffContainer.empty()) cout << "Coefficient container: " << coeffContainer << endl;
     cout << "Surface: " << nSurf << endl;					for (int i = 0; i < nSurf; i++) cout << surf[i] << endl;
     
     try{
-        GroupwiseRegistration groups(sphere, nSubj, property, nProperties / nSubj, output, weight, degree, landmark, weightLoc, coeff, surf, maxIter);
+        GroupwiseRegistration groups(sphere, nSubj, property, nProperties / nSubj, output, weight, degree, landmark, weightLoc, coeff, surf, maxIter, telemetryInterval, resumeDegree, (checkpoint.empty()) ? NULL: checkpoint.c_str(), writeInterval, writeImprovements,
+                                     (container.empty()) ? NULL: container.c_str(), textOutput, (coeffContainer.empty()) ? NULL: coeffContainer.c_str(),
+                                     (dirPropertyCache.empty()) ? NULL: dirPropertyCache.c_str(), nThreads,
+                                     (basisMode == "half") ? GroupwiseRegistration::HalfBasis: (basisMode == "onthefly") ? GroupwiseRegistration::OnTheFlyBasis: GroupwiseRegistration::FullBasis,
+                                     !fullCovariance, (optimizer == "lbfgs") ? GroupwiseRegistration::LbfgsOptimizer: (optimizer == "block") ? GroupwiseRegistration::BlockOptimizer: GroupwiseRegistration::NewuoaOptimizer,
+                                     blockPasses, (listSamplingLevel.empty()) ? NULL: &listSamplingLevel[0], listSamplingLevel.size(),
+                                     timeBudget, (listStageMaxIter.empty()) ? NULL: &listStageMaxIter[0], listStageMaxIter.size(),
+                                     (listStageTime.empty()) ? NULL: &listStageTime[0], listStageTime.size(), convergenceWindow, convergenceTol,
+                                     (report.empty()) ? NULL: report.c_str());
         groups.run();
         
         // delete memory allocation
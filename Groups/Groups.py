@@ -4,7 +4,10 @@ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
 
-import shutil
+import multiprocessing
+import time
+
+from GroupsLib import GroupsProcess, GroupsRunner
 
 #
 # Groups
@@ -182,6 +185,47 @@ class GroupsWidget(ScriptedLoadableModuleWidget):
         self.maxIter.value = 5000
         self.paramQFormLayout.addRow("Maximum number of iteration:", self.maxIter)
 
+        # Icosahedron level of the property sampling per degree stage, coarse to fine (option: --samplingLevels)
+        self.samplingLevels = qt.QLineEdit()
+        self.samplingLevels.setPlaceholderText("e.g. 2,3,4 (default: 4)")
+        self.samplingLevels.setValidator(qt.QRegExpValidator(qt.QRegExp("[0-9]+(,[0-9]+)*")))
+        self.paramQFormLayout.addRow("Sampling levels per degree stage:", self.samplingLevels)
+
+        # Budgets: total time shared among the degree stages, per-stage limits and convergence
+        # (options: --timeBudget, --stageMaxIter, --stageTime, --convergenceWindow, --convergenceTol)
+        self.timeBudget = qt.QSpinBox()
+        self.timeBudget.minimum = 0
+        self.timeBudget.maximum = 1000000
+        self.timeBudget.value = 0
+        self.timeBudget.setSuffix(" s")
+        self.timeBudget.setSpecialValueText("No limit")
+        self.paramQFormLayout.addRow("Total time budget:", self.timeBudget)
+
+        self.stageMaxIter = qt.QLineEdit()
+        self.stageMaxIter.setPlaceholderText("e.g. 2000,1000 (default: maximum number of iteration)")
+        self.stageMaxIter.setValidator(qt.QRegExpValidator(qt.QRegExp("[0-9]+(,[0-9]+)*")))
+        self.paramQFormLayout.addRow("Evaluations per degree stage:", self.stageMaxIter)
+
+        self.stageTime = qt.QLineEdit()
+        self.stageTime.setPlaceholderText("e.g. 60,120 in seconds (default: no limit)")
+        self.stageTime.setValidator(qt.QRegExpValidator(qt.QRegExp("[0-9.]+(,[0-9.]+)*")))
+        self.paramQFormLayout.addRow("Time per degree stage:", self.stageTime)
+
+        self.convergenceWindow = qt.QSpinBox()
+        self.convergenceWindow.minimum = 0
+        self.convergenceWindow.maximum = 100000
+        self.convergenceWindow.value = 0
+        self.convergenceWindow.setSpecialValueText("Disabled")
+        self.paramQFormLayout.addRow("Convergence window (evaluations):", self.convergenceWindow)
+
+        self.convergenceTol = ctk.ctkDoubleSpinBox()
+        self.convergenceTol.decimals = 6
+        self.convergenceTol.minimum = 0
+        self.convergenceTol.maximum = 1
+        self.convergenceTol.singleStep = 1e-4
+        self.convergenceTol.value = 1e-4
+        self.paramQFormLayout.addRow("Convergence tolerance (relative):", self.convergenceTol)
+
         # Name simplification
         self.property = ""
         self.propertyValue = ""
@@ -196,13 +240,25 @@ class GroupsWidget(ScriptedLoadableModuleWidget):
         self.applyButton.enabled = False
         self.ioQVBox.addWidget(self.applyButton)
 
+        self.cancelButton = qt.QPushButton("Cancel")
+        self.cancelButton.enabled = False
+        self.ioQVBox.addWidget(self.cancelButton)
+
         self.errorLabel = qt.QLabel("Error: Invalide inputs")
         self.errorLabel.hide()
         self.errorLabel.setStyleSheet("color: rgb(255, 0, 0);")
         self.ioQVBox.addWidget(self.errorLabel)
 
+        self.progressLabel = qt.QLabel("")
+        self.progressLabel.hide()
+        self.ioQVBox.addWidget(self.progressLabel)
+
+        # Running job of the CLI
+        self.job = None
+
         # Connections
         self.applyButton.connect('clicked(bool)', self.onApplyButtonClicked)
+        self.cancelButton.connect('clicked(bool)', self.onCancelButtonClicked)
 
         # ----- Add vertical spacer ----- #
         self.layout.addStretch(1)
@@ -218,7 +274,8 @@ class GroupsWidget(ScriptedLoadableModuleWidget):
 
     ## Function cleanup(self):
     def cleanup(self):
-        pass
+        if self.job is not None:
+            self.job.cancel()
 
     ## Function onSelect(self):
     # Check if each directory (Models, Property, Sphere and Output) have been chosen.
@@ -281,7 +338,8 @@ class GroupsWidget(ScriptedLoadableModuleWidget):
         self.outputDirectory = str(self.outputDirectorySelector.directory)
 
         if not self.enableParamCB.checkState():
-            endGroup = logic.runGroups(modelsDir=self.modelsDirectory, propertyDir=self.propertyDirectory, sphereDir=self.sphereDirectory, outputDir=self.outputDirectory, procalign=self.chooseProcalign.checkState())
+            self.job = logic.runGroupsAsync(modelsDir=self.modelsDirectory, propertyDir=self.propertyDirectory, sphereDir=self.sphereDirectory, outputDir=self.outputDirectory, procalign=self.chooseProcalign.checkState(),
+                                            progressCallback=self.onGroupsProgress, finishedCallback=self.onGroupsFinished)
 
         else:
             # ----- Creation of string for the specified properties and their values ----- #
@@ -338,221 +396,312 @@ class GroupsWidget(ScriptedLoadableModuleWidget):
 
             d = int(self.degreeSpharm.value)
             m = int(self.maxIter.value)
+            levels = str(self.samplingLevels.text).strip(',')
+            stageMaxIter = str(self.stageMaxIter.text).strip(',')
+            stageTime = str(self.stageTime.text).strip(',')
 
-            endGroup = logic.runGroups(modelsDir = self.modelsDirectory, propertyDir = self.propertyDirectory,
+            self.job = logic.runGroupsAsync(modelsDir = self.modelsDirectory, propertyDir = self.propertyDirectory,
                                     sphereDir = self.sphereDirectory, outputDir = self.outputDirectory, procalign=self.chooseProcalign.checkState(), 
-                                    properties = self.property, propValues = self.propertyValue, degree = d, maxIter = m)
+                                    properties = self.property, propValues = self.propertyValue, degree = d, maxIter = m,
+                                    samplingLevels = levels if levels else None,
+                                    timeBudget = int(self.timeBudget.value), stageMaxIter = stageMaxIter if stageMaxIter else None,
+                                    stageTime = stageTime if stageTime else None, convergenceWindow = int(self.convergenceWindow.value),
+                                    convergenceTol = float(self.convergenceTol.value),
+                                    progressCallback=self.onGroupsProgress, finishedCallback=self.onGroupsFinished)
 
         ## Groups didn't run because of invalid inputs
-        if not endGroup:
+        if self.job is None:
+            self.errorLabel.show()
+            return
+
+        self.applyButton.enabled = False
+        self.cancelButton.enabled = True
+        self.progressLabel.text = "Groups is running..."
+        self.progressLabel.show()
+
+    ## Function onCancelButtonClicked(self):
+    # Stop the running CLI
+    def onCancelButtonClicked(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    ## Function onGroupsProgress(self, job):
+    # Display the last cost printed by the CLI
+    def onGroupsProgress(self, job):
+        self.progressLabel.text = "Stage %d - Iteration %d - Cost: %g (min: %g)" % (job.stage, job.iteration, job.cost, job.minCost)
+
+    ## Function onGroupsFinished(self, job):
+    # Restore the buttons once the CLI is over
+    def onGroupsFinished(self, job):
+        self.job = None
+        self.cancelButton.enabled = False
+        self.onSelect()
+        self.progressLabel.text = "Groups %s after %d s" % (job.status, job.elapsedTime())
+        if job.status == GroupsJob.Failed:
             self.errorLabel.show()
 
 #
 # GroupsLogic
 #
 
-class GroupsLogic(ScriptedLoadableModuleLogic):
+class GroupsLogic(ScriptedLoadableModuleLogic, GroupsRunner):
     """This class should implement all the actual
   computation done by your module.  The interface
   should be such that other python code can import
   this class and make use of the functionality without
   requiring an instance of the Widget.
+  The command lines are built, checked and parsed by GroupsRunner (GroupsLib), which does not
+  depend on Slicer: this class runs the CLI as a QProcess (GroupsJob) and locates its executable.
   Uses ScriptedLoadableModuleLogic base class, available at:
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
-    ## Function runGroups(...)
-    #   Check if directories are ok
-    #   Create the command line
-    #   Call the CLI Groups
-    def runGroups(self, modelsDir, propertyDir, sphereDir, outputDir, procalign=False, properties=0, propValues=0, degree=0, maxIter=0):
-        print "--- function runGroups() ---"
+    def __init__(self, parent=None):
+        ScriptedLoadableModuleLogic.__init__(self, parent)
+        GroupsRunner.__init__(self)
+        # Jobs run without blocking Slicer's event loop
+        self.jobClass = GroupsJob
+
+    ## Function runGroupsQueue(specs, maxWorkers=0, wait=True)
+    #   Run a list of Groups jobs (see GroupsJobQueue) as parallel CLI processes
+    #   maxWorkers: maximum number of simultaneous processes (0: number of cores)
+    #   Return the list of results if wait, else the running GroupsJobQueue
+    def runGroupsQueue(self, specs, maxWorkers=0, wait=True, finishedCallback=None):
+        queue = GroupsJobQueue(self, specs, maxWorkers=maxWorkers, finishedCallback=finishedCallback)
+        if wait:
+            return queue.wait()
+        queue.start()
+        return queue
+
+    ## Function groupsPath()
+    #   Path of the CLI Groups executable: executable given to the runner or GROUPS_EXECUTABLE
+    #   (e.g. a build tree), else the CLI packaged with the module, in the hidden CLI modules
+    def groupsPath(self):
+        if self.executable or os.environ.get("GROUPS_EXECUTABLE"):
+            return GroupsRunner.groupsPath(self)
+
+        scriptedModulesPath = os.path.dirname(slicer.modules.groups.path)
+        groups = os.path.join(scriptedModulesPath, '..', 'hidden-cli-modules', 'Groups')
+        if sys.platform == 'win32':
+            groups += '.exe'
+        return groups
 
-        """
-        Calling Groups CLI
-            Arguments:
-             --surfaceDir: Directory with input models
-             --propertyDir: Property folder (txt files from SPHARM)
-             --sphereDir: Sphere folder
-             --outputDir: Output directory
-             --filter: Properties to consider
-             -w: weights associated with each property
-             -d: Degree of deformation field
-             --maxIter: Maximum number of iteration
-        """
 
-        #####################################################################################
-        ## ----- Check if directories contents correctly match with models Directory ----- ##
-        # For each shape, files should have the same name, with different extension.
-        #       Mesh: [name].vtk
-        #       Properties: 8 x [name].vtk.[prop].txt
-        #       Sphere: [name].txt.vtk
-# if file[len(file)-len(suffixSphere):] == suffixSphere:
-        
-
-        ## Preparation of the reference list (from modelsDir)
-        listModelsDir = os.listdir(modelsDir)
-        listModelsName = list()
-        if listModelsDir.count(".DS_Store"):
-            listModelsDir.remove(".DS_Store")
-        if not len(listModelsDir):
-            return False
+#
+# GroupsJob
+#
 
+class GroupsJob(GroupsProcess):
+    """Handle on one run of the Groups CLI inside Slicer.
+  Same as GroupsProcess (GroupsLib), except that the CLI is a QProcess whose output is read
+  from Slicer's event loop, so that the callbacks are called in the main thread.
+  """
 
-        # Get the list of all basename + check if they are all vtk files
-        for i in range(0, len(listModelsDir)):
-            if procalign:
-                modelsExtension = "_surfSPHARM_procalign.vtk"
-            else:
-                modelsExtension = "_surfSPHARM.vtk"
-            listModelsName.append( listModelsDir[i][:len(listModelsDir[i])-len(modelsExtension)] )
-            print "heeeeeeee " + listModelsDir[i][:len(listModelsDir[i])-len(modelsExtension)]
-            print "model num " + str(i) + " : " + listModelsName[i]
-
-        ## Check other directories
-        listPropertyDir = os.listdir(propertyDir)
-        listPropertyName = list()
-        if listPropertyDir.count(".DS_Store"):
-            listPropertyDir.remove(".DS_Store")
-        # There should be 6 files for each one in modelsDir
-        for i in range(0, len(listPropertyDir)):
-            listPropertyName.append(str(('_').join(listPropertyDir[i].split('_')[:-2])))
-        for file in listModelsName:
-            if listPropertyName.count(file) != 6:
-                print "Properties. Not enough properties for " + str(file)
-                return False        
-
-
-        listSphereDir = os.listdir(sphereDir)
-        listSphereName = list()
-        if listSphereDir.count(".DS_Store"):
-            listSphereDir.remove(".DS_Store")
-        # There should be the same basename files
-        suffix = "_surf_para.vtk"
-        for i in range(0, len(listSphereDir)): 
-            end = listSphereDir[i][len(listSphereDir[i])-len(suffix):]
-            print end
-            if end == suffix:
-                listSphereName.append('_'.join(listSphereDir[i].split('_')[:-2]))
-            else:
-                listSphereName.append('_'.join(listSphereDir[i].split('_')[:-1]))
-
-        for file in listModelsName:
-            if listSphereName.count(file) != 1:
-                print "Sphere. Wrong correspondence between name files " + str(file)
-                return False
-
-        # Get the list of all basename + check if they are all vtk files
-        # for i in range(0, len(listModelsDir)):
-        #     extension = listModelsDir[i].split('.')[-1]
-        #     if extension == 'vtk':
-        #         listModelsName.append('.'.join(listModelsDir[i].split('.')[:-1]))
-
-        # ## Check other directories
-        # listPropertyDir = os.listdir(propertyDir)
-        # listPropertyName = list()
-        # if listPropertyDir.count(".DS_Store"):
-        #     listPropertyDir.remove(".DS_Store")
-        # # There should be 8 files for each one in modelsDir
-        # listPropertyName = ['.'.join(file.split('.')[:-3]) for file in listPropertyDir]
-        # for file in listModelsName:
-        #     if listPropertyName.count(file) != 6:
-        #         print "Properties. Not enough properties for " + str(file)
-        #         return False
-
-        # listSphereDir = os.listdir(sphereDir)
-        # listSphereName = list()
-        # if listSphereDir.count(".DS_Store"):
-        #     listSphereDir.remove(".DS_Store")
-        # # There should be the same basename files
-        # listSphereName = ['.'.join(file.split('.')[:-2]) for file in listSphereDir]
-        # for file in listModelsName:
-        #     if listSphereName.count(file) != 1:
-        #         print "Sphere. Wrong correspondence between name files " + str(file)
-        #         return False
-
-        ############################################
-        # ----- Creation of the command line ----- #
-
-        # Avec le make package
-        # self.moduleName = "Groups"
-        # scriptedModulesPath = eval('slicer.modules.%s.path' % self.moduleName.lower())
-        # scriptedModulesPath = os.path.dirname(scriptedModulesPath)
-        
-        # libPath = os.path.join(scriptedModulesPath)
-        # sys.path.insert(0, libPath)
-        # groups = os.path.join(scriptedModulesPath, '../hidden-cli-modules/Groups')
-
-        # Sans le make package
-        groups = "/Users/prisgdd/Documents/Projects/Groups/GROUPS-build/Groups-build/bin/Groups"
-
-        arguments = list()
-        arguments.append("--surfaceDir")
-        arguments.append(modelsDir)
-        arguments.append("--propertyDir")
-        arguments.append(propertyDir)
-        arguments.append("--sphereDir")
-        arguments.append(sphereDir)
-        arguments.append("--outputDir")
-        arguments.append(outputDir)
-
-        if properties and propValues:
-            # If # of properties and # of weights aren't the same, we cut those at the end
-            if properties.count(',') > propValues.count(','):
-                while properties.count(',') > propValues.count(','):
-                    properties = (','.join(properties.split(',')[:-1]))
-            elif propValues.count(',') > properties.count(','):
-                while propValues.count(',') > properties.count(','):
-                    propValues = (','.join(propValues.split(',')[:-1]))
-            arguments.append("--filter")
-            arguments.append(properties)
-            arguments.append("-w")
-            arguments.append(propValues)
-        else:       # If no properties specified - Default: each property with weight=1
-            arguments.append("--filter")
-            arguments.append("medialMeshArea.txt,medialMeshPartialArea.txt,medialMeshRadius.txt,medialMeshPartialRadius.txt,paraPhi.txt,paraTheta.txt")
-            arguments.append("-w")
-            arguments.append("1.0,1.0,1.0,1.0,1.0,1.0")
-
-        if degree:
-            arguments.append("-d")
-            arguments.append(int(degree))
-        else:           # Default: degree=5
-            arguments.append("-d")
-            arguments.append(5)
-
-        if maxIter:
-            arguments.append("--maxIter")
-            arguments.append(maxIter)
-        else:           # Default: # maximum of iteration = 5000
-            arguments.append("--maxIter")
-            arguments.append(5000)
-
-        ############################
-        # ----- Call the CLI ----- #
+    ## Function start()
+    #   Launch the CLI, return immediately
+    def start(self):
         self.process = qt.QProcess()
         self.process.setProcessChannelMode(qt.QProcess.MergedChannels)
-
-        # print "Calling " + os.path.basename(groups)
-        self.process.start(groups, arguments)
-        self.process.waitForStarted()
-        # # print "state: " + str(self.process.state())
+        self.process.connect('readyReadStandardOutput()', self.onReadyRead)
+        self.process.connect('finished(int,QProcess::ExitStatus)', self.onFinished)
+        # errorOccurred is only available since Qt 5.6
+        if not self.process.connect('errorOccurred(QProcess::ProcessError)', self.onError):
+            self.process.connect('error(QProcess::ProcessError)', self.onError)
+
+        self.status = GroupsJob.Running
+        self.startTime = time.time()
+        self.process.start(self.executable, self.arguments)
+
+        if self.timeout > 0:
+            self._timer = qt.QTimer()
+            self._timer.setSingleShot(True)
+            self._timer.connect('timeout()', self.onTimeout)
+            self._timer.start(int(self.timeout * 1000))
+
+    ## Function wait()
+    #   Block until the process is over (or the timeout is reached)
+    def wait(self):
+        if self.process is None:
+            return self.status
+        # a process that could not start would not finish either
+        if self.isRunning() and not self.process.waitForStarted(-1) and self.process.error() == qt.QProcess.FailedToStart:
+            self.onError(qt.QProcess.FailedToStart)
+        if self.isRunning():
+            if self.timeout > 0:
+                remaining = self.timeout - (time.time() - self.startTime)
+                if remaining <= 0 or not self.process.waitForFinished(int(remaining * 1000)):
+                    self.onTimeout()
+            else:
+                self.process.waitForFinished(-1)
+        # Qt may not have delivered the last signals yet
+        self.onReadyRead()
+        if self.isRunning():
+            self.onFinished(self.process.exitCode(), self.process.exitStatus())
+        return self.status
+
+    def _stop(self, status):
+        if not self.isRunning():
+            return
+        self.status = status
+        self.process.kill()
         self.process.waitForFinished(-1)
-        # print "error: " + str(self.process.error())
+        self.onReadyRead()
+        self._finish(self.process.exitCode())
+
+    ## Function onReadyRead()
+    #   Read the new output of the CLI and parse the complete lines
+    def onReadyRead(self):
+        if self.process is None:
+            return
+        data = str(self.process.readAllStandardOutput())
+        if not data:
+            return
+        self.output += data
+        lines = (self._buffer + data).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self.parseLine(line)
+
+    ## Function onFinished(exitCode, exitStatus)
+    def onFinished(self, exitCode, exitStatus=None):
+        if not self.isRunning():
+            return
+        self.onReadyRead()
+        GroupsProcess.onFinished(self, exitCode, exitStatus)
+
+    ## Function onError(error)
+    #   The process could not start (missing executable, permissions): no finished signal will follow
+    #   The other errors (crash, ...) are reported by onFinished
+    def onError(self, error):
+        if not self.isRunning() or error != qt.QProcess.FailedToStart:
+            return
+        self.output += "Could not start " + self.executable + ": " + self.process.errorString() + "\n"
+        self.status = GroupsJob.Failed
+        self._finish(None)
+
+    def _stopTimer(self):
+        self._timer.stop()
 
-        processOutput = str(self.process.readAll())
-        sizeProcessOutput = len(processOutput)
 
-        finStr = processOutput[sizeProcessOutput - 10:sizeProcessOutput]
-        print "finStr : " + finStr
 
-        print "\n\n --------------------------- \n"
-        print processOutput
-        print "\n\n --------------------------- \n"
-        if finStr == "All done!\n":
-            return True
+#
+# GroupsJobQueue
+#
 
-        return False
+class GroupsJobQueue(object):
+    """Run many Groups CLI jobs as parallel processes, at most maxWorkers at a time.
+  Each run spec is a dictionary of the runGroupsAsync() arguments
+  (modelsDir, propertyDir, sphereDir, outputDir, procalign, properties, propValues, degree, maxIter, timeout).
+  The output of each job is written to its own log file (spec "logFile", default: [outputDir]/Groups.log).
+  A job which fails, times out, has invalid inputs or a spec raising an error does not stop the other ones.
+  Unless its spec sets nThreads, each job gets its share of the cores (cores / maxWorkers threads).
+  """
+
+    # Status of a spec whose inputs did not pass the checks
+    Invalid = "invalid"
+
+    def __init__(self, logic, specs, maxWorkers=0, finishedCallback=None):
+        self.logic = logic
+        self.maxWorkers = maxWorkers if maxWorkers > 0 else multiprocessing.cpu_count()
+        self.finishedCallback = finishedCallback
+
+        self.entries = list()
+        for spec in specs:
+            logFile = spec.get("logFile", os.path.join(spec["outputDir"], "Groups.log"))
+            self.entries.append({"spec": spec, "job": None, "status": GroupsJob.Pending, "logFile": logFile})
+        self._next = 0
+        self._running = 0
+        self._notified = False
+        self._loop = None
+
+    ## Function start()
+    #   Launch as many jobs as allowed, return immediately
+    def start(self):
+        while self._running < self.maxWorkers and self._next < len(self.entries):
+            entry = self.entries[self._next]
+            self._next += 1
+            self._startEntry(entry)
+        if not self.isDone():
+            return
+        if self._loop is not None:
+            self._loop.quit()
+        if not self._notified:
+            self._notified = True
+            if self.finishedCallback:
+                self.finishedCallback(self)
+
+    def _startEntry(self, entry):
+        spec = dict(entry["spec"])
+        spec.pop("logFile", None)
+        spec.setdefault("nThreads", max(1, multiprocessing.cpu_count() // self.maxWorkers))
+        # Counted as running before the start: a job which cannot start finishes (onJobFinished) inside runGroupsAsync
+        entry["status"] = GroupsJob.Running
+        self._running += 1
+        try:
+            job = self.logic.runGroupsAsync(finishedCallback=lambda job, entry=entry: self.onJobFinished(entry, job), **spec)
+        except Exception as e:
+            # A bad spec (unreadable directory, wrong argument, ...) only fails its own entry
+            self._running -= 1
+            entry["status"] = GroupsJob.Failed
+            self._writeLog(entry, "Could not start the job: " + str(e) + "\n")
+            return
+        if job is None:
+            self._running -= 1
+            entry["status"] = GroupsJobQueue.Invalid
+            self._writeLog(entry, "Invalid inputs\n")
+            return
+        entry["job"] = job
+
+    ## Function onJobFinished(entry, job)
+    #   Save the log of the job and launch the next one
+    def onJobFinished(self, entry, job):
+        entry["job"] = job
+        entry["status"] = job.status
+        self._writeLog(entry, job.output)
+        self._running -= 1
+        self.start()
+
+    def _writeLog(self, entry, output):
+        try:
+            with open(entry["logFile"], "w") as log:
+                log.write(output)
+        except IOError as e:
+            print "Could not write the log " + entry["logFile"] + ": " + str(e)
+
+    ## Function wait()
+    #   Block until every job is over: a local event loop delivers the signals of the jobs,
+    #   and the last finished job (onJobFinished) quits it
+    def wait(self):
+        self._loop = qt.QEventLoop()
+        self.start()
+        if not self.isDone():
+            self._loop.exec_()
+        self._loop = None
+        return self.results()
+
+    ## Function cancel()
+    #   Stop the running jobs and drop the pending ones
+    def cancel(self):
+        for entry in self.entries[self._next:]:
+            entry["status"] = GroupsJob.Cancelled
+        self._next = len(self.entries)
+        for entry in self.entries:
+            if entry["job"] is not None:
+                entry["job"].cancel()
+
+    def isDone(self):
+        return self._next == len(self.entries) and self._running == 0
+
+    ## Function results()
+    #   Status of each run spec, in the order of the specs
+    def results(self):
+        results = list()
+        for entry in self.entries:
+            job = entry["job"]
+            results.append({"spec": entry["spec"], "status": entry["status"], "logFile": entry["logFile"],
+                            "exitCode": job.exitCode if job is not None else None,
+                            "elapsedTime": job.elapsedTime() if job is not None else 0})
+        return results
 
 
 class GroupsTest(ScriptedLoadableModuleTest):
@@ -562,19 +711,18 @@ class GroupsTest(ScriptedLoadableModuleTest):
         https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
         """
 
+    # Tolerances of the comparison of the coefficients with the expected ones
+    atol = 1e-5
+    rtol = 1e-4
+
     def setUp(self):
         """ Do whatever is needed to reset the state - typically a scene clear will be enough.
             """
         slicer.mrmlScene.Clear(0)
 
         ## Prepare data & paths
-        self.initialPath = "/Users/prisgdd/Documents/Projects/GroupsExtension/dataTest/"
-        self.localPath = slicer.app.temporaryPath + "/dataTest"
-
-        if os.path.isdir(self.localPath):
-            shutil.rmtree(self.localPath)
-
-        shutil.copytree(self.initialPath, self.localPath)
+        # The dataset (inputs, outputs of the CLI in outputTest and expected outputs in outputVerif) is only read
+        self.dataPath = "/Users/prisgdd/Documents/Projects/GroupsExtension/dataTest"
 
     def runTest(self):
         """Run as few or as many tests as needed here.
@@ -602,19 +750,16 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 1')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        landmarkDir = self.localPath + "/landmark"
-        sphereDir = self.localPath + "/sphere"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        landmarkDir = self.dataPath + "/landmark"
+        sphereDir = self.dataPath + "/sphere"
         degree = 5
         maxIter = 1000
         properties = "C.txt,S.txt"
         propertiesValues = "0.5,0.25"
-        outputVerif1 = self.localPath + "/outputVerif/outputVerif1"
-        outputDir1 = self.localPath + "/outputTest/outputTest1"
-
-        if not os.path.exists(outputDir1):
-            os.mkdir(outputDir1)
+        outputVerif1 = self.dataPath + "/outputVerif/outputVerif1"
+        outputDir1 = self.dataPath + "/outputTest/outputTest1"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -623,7 +768,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 propValues=propertiesValues, landmark=landmarkDir, degree=degree, maxIter=maxIter)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir1, outputVerif1, meshDir):
+        if self.outputcomparison(outputDir1, outputVerif1):
             self.delayDisplay('Test 1 passed!')
             return True
         else:
@@ -634,19 +779,16 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 2')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        landmarkDir = self.localPath + "/landmark"
-        sphereDir = self.localPath + "/sphere"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        landmarkDir = self.dataPath + "/landmark"
+        sphereDir = self.dataPath + "/sphere"
         degree = 5
         maxIter = 5000
         properties = "C.txt,H.txt,Kappa1.txt,S.txt,K.txt,Kappa2.txt,DPhi.txt,DTheta.txt"
         propertiesValues = "0.2,1.0,0.3,0.25,0.3,0.8,0.1,0.4"
-        outputDir2 = self.localPath + "/outputTest/outputTest2"
-        outputVerif2 = self.localPath + "/outputVerif/outputVerif2"
-
-        if not os.path.exists(outputDir2):
-            os.mkdir(outputDir2)
+        outputDir2 = self.dataPath + "/outputTest/outputTest2"
+        outputVerif2 = self.dataPath + "/outputVerif/outputVerif2"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -655,7 +797,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 propValues=propertiesValues, landmark=landmarkDir, degree=degree, maxIter=maxIter)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir2, outputVerif2, meshDir):
+        if self.outputcomparison(outputDir2, outputVerif2):
             self.delayDisplay('Test 2 passed!')
             return True
         else:
@@ -666,18 +808,15 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 3')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        sphereDir = self.localPath + "/sphere"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        sphereDir = self.dataPath + "/sphere"
         degree = 5
         maxIter = 1000
         properties = "C.txt,S.txt"
         propertiesValues = "0.5,0.25"
-        outputDir3 = self.localPath + "/outputTest/outputTest3"
-        outputVerif3 = self.localPath + "/outputVerif/outputVerif3"
-
-        if not os.path.exists(outputDir3):
-            os.mkdir(outputDir3)
+        outputDir3 = self.dataPath + "/outputTest/outputTest3"
+        outputVerif3 = self.dataPath + "/outputVerif/outputVerif3"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -686,7 +825,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 propValues=propertiesValues, degree=degree, maxIter=maxIter)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir3, outputVerif3, meshDir):
+        if self.outputcomparison(outputDir3, outputVerif3):
             self.delayDisplay('Test 3 passed!')
             return True
         else:
@@ -697,17 +836,14 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 4')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        landmarkDir = self.localPath + "/landmark"
-        sphereDir = self.localPath + "/sphere"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        landmarkDir = self.dataPath + "/landmark"
+        sphereDir = self.dataPath + "/sphere"
         degree = 18
         maxIter = 1000
-        outputDir4 = self.localPath + "/outputTest/outputTest4"
-        outputVerif4 = self.localPath + "/outputVerif/outputVerif4"
-
-        if not os.path.exists(outputDir4):
-            os.mkdir(outputDir4)
+        outputDir4 = self.dataPath + "/outputTest/outputTest4"
+        outputVerif4 = self.dataPath + "/outputVerif/outputVerif4"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -715,7 +851,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 sphereDir=sphereDir, outputDir=outputDir4, landmark=landmarkDir, degree=degree, maxIter=maxIter)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir4, outputVerif4, meshDir):
+        if self.outputcomparison(outputDir4, outputVerif4):
             self.delayDisplay('Test 4 passed!')
             return True
         else:
@@ -726,19 +862,16 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 5')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        sphereDir = self.localPath + "/sphere"
-        landmarkDir = self.localPath + "/landmark"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        sphereDir = self.dataPath + "/sphere"
+        landmarkDir = self.dataPath + "/landmark"
         degree = 5
         maxIter = 1000
         properties = "DPhi.txt,C.txt,S.txt,Kappa1.txt"
         propertiesValues = "0.1,0.3"
-        outputDir5 = self.localPath + "/outputTest/outputTest5"
-        outputVerif5 = self.localPath + "/outputVerif/outputVerif5"
-
-        if not os.path.exists(outputDir5):
-            os.mkdir(outputDir5)
+        outputDir5 = self.dataPath + "/outputTest/outputTest5"
+        outputVerif5 = self.dataPath + "/outputVerif/outputVerif5"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -747,7 +880,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 sphereDir=sphereDir, outputDir=outputDir5, landmark=landmarkDir, degree=degree, maxIter=maxIter)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir5, outputVerif5, meshDir):
+        if self.outputcomparison(outputDir5, outputVerif5):
             self.delayDisplay('Test 5 passed!')
             return True
         else:
@@ -758,17 +891,14 @@ class GroupsTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Start test 6')
 
         ## --- Prepare parameters --- ##
-        meshDir = self.localPath + "/Mesh"
-        propertiesDir = self.localPath + "/attributes"
-        sphereDir = self.localPath + "/sphere"
-        landmarkDir = self.localPath + "/landmark"
+        meshDir = self.dataPath + "/Mesh"
+        propertiesDir = self.dataPath + "/attributes"
+        sphereDir = self.dataPath + "/sphere"
+        landmarkDir = self.dataPath + "/landmark"
         properties = "C.txt,S.txt"
         propertiesValues = "0.5,0.25"
-        outputDir6 = self.localPath + "/outputTest/outputTest6"
-        outputVerif6 = self.localPath + "/outputVerif/outputVerif6"
-
-        if not os.path.exists(outputDir6):
-            os.mkdir(outputDir6)
+        outputDir6 = self.dataPath + "/outputTest/outputTest6"
+        outputVerif6 = self.dataPath + "/outputVerif/outputVerif6"
 
         ## --- Call the CLI --- ##
         # logic = GroupsLogic()
@@ -777,7 +907,7 @@ class GroupsTest(ScriptedLoadableModuleTest):
         #                 propValues=propertiesValues, landmark=landmarkDir)
 
         ## --- Compare results --- ##
-        if self.outputcomparison(outputDir6, outputVerif6, meshDir):
+        if self.outputcomparison(outputDir6, outputVerif6):
             self.delayDisplay('Test 6 passed!')
             return True
         else:
@@ -785,45 +915,9 @@ class GroupsTest(ScriptedLoadableModuleTest):
 
     ## Function outputComparison(...)
     # Compare the expected outputs (outputVerif) with those obtained (outputDir)
-    def outputcomparison(self, outputDir, outputVerif, inputDir):
-        listFilesOut = os.listdir(outputDir)
-        listFilesVerif = os.listdir(outputVerif)
-
-        ## Delete .DS_Store if there is one - for MacOS
-        if listFilesOut.count(".DS_Store"):
-            listFilesOut.remove(".DS_Store")
-        if listFilesVerif.count(".DS_Store"):
-            listFilesVerif.remove(".DS_Store")
-
-        ## Check number of outputs
-        nbFilesOut = len(listFilesOut)
-        nbFilesIn = len(os.listdir(inputDir))
-        if nbFilesOut != nbFilesIn:
-            print "Wrong number of outputs"
-            return False
-
-        ## Check files names
-        listFilesOutNames = list()
-        listFilesVerifNames = list()
-        for i in range(0, len(listFilesOut)):
-            listFilesOutNames.append('.'.join(listFilesOut[i].split('.')[:-1]))
-            listFilesVerifNames.append('.'.join(listFilesVerif[i].split('.')[:-1]))
-
-            if listFilesOutNames[i] != listFilesVerifNames[i]:
-                print "Erreur de noms"
-                return False
-
-        ## Compare files contents
-        taille = len(listFilesOut)
-        for i in range(0, taille):
-            fTest = open(outputDir + "/" + listFilesOut[i], "r")
-            contenuTest = fTest.read()
-
-            fVerif = open(outputVerif + "/" + listFilesVerif[i], "r")
-            contenuVerif = fVerif.read()
-
-            if contenuTest != contenuVerif:
-                print "Wrong contents"
-                return False
-
-        return True
+    # The .coeff files are paired by name and compared numerically, subject by subject in parallel,
+    # with the tolerances atol and rtol (see GroupsComparison); a diff of each subject is printed
+    def outputcomparison(self, outputDir, outputVerif):
+        comparison = GroupsComparison(outputDir, outputVerif, atol=self.atol, rtol=self.rtol).run()
+        print comparison.summary()
+        return comparison.passed()
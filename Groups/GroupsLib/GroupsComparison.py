@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Regression check of the outputs of Groups against reference outputs, without Slicer:
+    python GroupsComparison.py outputDir referenceDir [--atol 1e-5] [--rtol 1e-4] [--workers 0]
+The .coeff files of both directories are paired by name (sorted) and compared numerically:
+two values match if |output - reference| <= atol + rtol * |reference|, so that the last digits
+may differ (multithreaded or BLAS-backed engines). The directories are only read.
+The exit code is 0 if every subject matches, 1 otherwise.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+
+## Function readCoefficients(filename)
+#   Values of a .coeff file written by the CLI: pole (3 floats), degree, then the (degree + 1)^2
+#   latitude/longitude pairs
+#   Return (degree, values), values being the pole followed by the coefficients
+def readCoefficients(filename):
+    with open(filename, "r") as f:
+        tokens = f.read().split()
+    if len(tokens) < 4:
+        raise ValueError(filename + " is not a coefficient file")
+    degree = int(tokens[3])
+    values = [float(token) for token in tokens[:3] + tokens[4:]]
+    if len(values) != 3 + 2 * (degree + 1) * (degree + 1):
+        raise ValueError(filename + ": " + str(len(values) - 3) + " coefficients for degree " + str(degree))
+    return degree, values
+
+
+## Function compareCoefficients(name, outputFile, referenceFile, atol, rtol)
+#   Diff of one subject: dictionary name, status ("ok", "different" or "error"), values, different
+#   (number of values out of tolerance), maxAbs and maxRel (largest differences), worst (index of the
+#   largest difference, 0-2 for the pole) and message
+#   A module function, so that it can run in a process pool
+def compareCoefficients(name, outputFile, referenceFile, atol, rtol):
+    diff = {"name": name, "status": "ok", "values": 0, "different": 0, "maxAbs": 0.0, "maxRel": 0.0, "worst": None, "message": ""}
+    try:
+        degree, values = readCoefficients(outputFile)
+        referenceDegree, reference = readCoefficients(referenceFile)
+    except (IOError, ValueError) as e:
+        diff.update(status="error", message=str(e))
+        return diff
+    if degree != referenceDegree:
+        diff.update(status="different", message="degree " + str(degree) + " instead of " + str(referenceDegree))
+        return diff
+
+    diff["values"] = len(values)
+    for i, (value, expected) in enumerate(zip(values, reference)):
+        error = abs(value - expected)
+        if error > diff["maxAbs"]:
+            diff["maxAbs"] = error
+            diff["worst"] = i
+        if expected != 0:
+            diff["maxRel"] = max(diff["maxRel"], error / abs(expected))
+        if error > atol + rtol * abs(expected):
+            diff["different"] += 1
+    if diff["different"]:
+        diff["status"] = "different"
+        worst = diff["worst"]
+        if worst < 3:
+            where = "pole"
+        else:
+            where = ("latitude" if (worst - 3) % 2 == 0 else "longitude") + " " + str((worst - 3) // 2)
+        diff["message"] = where + ": " + repr(values[worst]) + " instead of " + repr(reference[worst])
+    return diff
+
+
+def _compareCoefficients(arguments):
+    return compareCoefficients(*arguments)
+
+
+#
+# GroupsComparison
+#
+
+class GroupsComparison(object):
+    """Comparison of the outputs of a run (outputDir) with reference outputs (referenceDir).
+  The files with one of the suffixes are paired by name; a file of only one directory is
+  reported as missing (reference without output) or extra (output without reference).
+  The subjects are compared in parallel by workers threads (0: number of cores), or processes
+  if processes is True (faster for large cohorts, but not inside Slicer).
+  results holds the diff of each subject (see compareCoefficients), sorted by name.
+  """
+
+    def __init__(self, outputDir, referenceDir, atol=1e-5, rtol=1e-4, suffixes=(".coeff",), workers=0, processes=False):
+        self.outputDir = outputDir
+        self.referenceDir = referenceDir
+        self.atol = atol
+        self.rtol = rtol
+        self.suffixes = tuple(suffixes)
+        self.workers = workers
+        self.processes = processes
+        self.results = list()
+
+    ## Function files(directory)
+    #   Name (without suffix) -> path of the output files of a directory
+    def files(self, directory):
+        files = dict()
+        if not os.path.isdir(directory):
+            return files
+        for file in sorted(os.listdir(directory)):
+            for suffix in self.suffixes:
+                if file.endswith(suffix) and not file.startswith("."):
+                    files[file[:len(file) - len(suffix)]] = os.path.join(directory, file)
+                    break
+        return files
+
+    ## Function run()
+    #   Compare the two directories, return self
+    def run(self):
+        import multiprocessing
+        import multiprocessing.pool
+
+        outputs = self.files(self.outputDir)
+        references = self.files(self.referenceDir)
+        names = sorted(set(outputs) | set(references))
+
+        tasks = list()
+        results = dict()
+        for name in names:
+            if name not in outputs:
+                results[name] = {"name": name, "status": "missing", "message": "no output for " + references[name]}
+            elif name not in references:
+                results[name] = {"name": name, "status": "extra", "message": "no reference for " + outputs[name]}
+            else:
+                tasks.append((name, outputs[name], references[name], self.atol, self.rtol))
+
+        workers = self.workers if self.workers > 0 else multiprocessing.cpu_count()
+        workers = min(workers, len(tasks))
+        if workers > 1:
+            pool = multiprocessing.Pool(workers) if self.processes else multiprocessing.pool.ThreadPool(workers)
+            try:
+                diffs = pool.map(_compareCoefficients, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            diffs = [_compareCoefficients(task) for task in tasks]
+        for diff in diffs:
+            results[diff["name"]] = diff
+
+        self.results = [results[name] for name in names]
+        return self
+
+    ## Function passed()
+    #   True if there is at least one subject and every subject matches its reference
+    def passed(self):
+        return len(self.results) > 0 and all(diff["status"] == "ok" for diff in self.results)
+
+    ## Function summary()
+    #   One line per subject: status, number of values out of tolerance, largest differences
+    def summary(self):
+        lines = ["%s vs %s (atol %g, rtol %g)" % (self.outputDir, self.referenceDir, self.atol, self.rtol)]
+        if not self.results:
+            lines.append("  no output file in the reference directory")
+        for diff in self.results:
+            if "values" in diff and diff["values"]:
+                line = "  %-40s %-9s %6d/%-6d max abs %.3g, max rel %.3g" % (diff["name"], diff["status"], diff["different"], diff["values"], diff["maxAbs"], diff["maxRel"])
+            else:
+                line = "  %-40s %-9s" % (diff["name"], diff["status"])
+            if diff["message"]:
+                line += "  " + diff["message"]
+            lines.append(line)
+        failed = len([diff for diff in self.results if diff["status"] != "ok"])
+        lines.append("%d subjects, %d failed" % (len(self.results), failed))
+        return "\n".join(lines)
+
+
+## Function main(argv)
+#   Command line entry point: compare the directories and print the summary
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the outputs of Groups with reference outputs")
+    parser.add_argument("outputDir")
+    parser.add_argument("referenceDir")
+    parser.add_argument("--atol", type=float, default=1e-5, help="absolute tolerance")
+    parser.add_argument("--rtol", type=float, default=1e-4, help="relative tolerance")
+    parser.add_argument("--workers", type=int, default=0, help="number of processes (0: number of cores)")
+    args = parser.parse_args(argv)
+
+    comparison = GroupsComparison(args.outputDir, args.referenceDir, atol=args.atol, rtol=args.rtol, workers=args.workers, processes=True).run()
+    print(comparison.summary())
+    return 0 if comparison.passed() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
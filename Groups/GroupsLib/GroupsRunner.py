@@ -0,0 +1,908 @@
+#!/usr/bin/env python
+"""
+Headless runner of the Groups CLI, without Slicer.
+It builds and checks the command line, runs the CLI as a subprocess, and parses its output
+(progress, telemetry, JSON report). GroupsLogic (Groups.py) is the Slicer adapter on top of it.
+It only depends on the standard library, and can be used from batch scripts:
+    python GroupsRunner.py modelsDir propertyDir sphereDir outputDir [--degree 5] [--maxIter 5000] ...
+The executable of the CLI is given by --executable, or the GROUPS_EXECUTABLE environment variable
+(default: Groups, looked up in the PATH).
+"""
+from __future__ import print_function
+
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    basestring
+except NameError:       # Python 3
+    basestring = str
+
+
+
+#
+# GroupsProcess
+#
+
+class GroupsProcess(object):
+    """Handle on one run of the Groups CLI, as a subprocess.
+  The process is started without blocking the caller. Its merged stdout is read by a
+  thread as it arrives and the "[iter] cost (ecost + fcost) mincost" lines printed
+  by GroupwiseRegistration::cost are parsed to report the progress.
+  The "[telemetry] iteration degree entropy fold mincost elapsed recomputed" records (CLI option
+  --telemetryInterval) are collected in telemetry, an in-memory time series.
+  The JSON report written by the CLI at the end of the run (reportFile) is loaded in report,
+  and decides whether the run completed.
+  The callbacks are called from the reader thread.
+  """
+
+    # Status of the job
+    Pending = "pending"
+    Running = "running"
+    Completed = "completed"
+    Failed = "failed"
+    Cancelled = "cancelled"
+    TimedOut = "timeout"
+
+    # [nIter] cost (ecost + fcost) mincost
+    costLineRegExp = re.compile(r"^\[(\d+)\] (\S+) \((\S+) \+ (\S+)\) (\S+)$")
+    # [telemetry] nIter m_degree_inc ecost fcost mincost elapsed nRecomputed
+    telemetryPrefix = "[telemetry] "
+    telemetryFields = ("stage", "iteration", "degree", "entropy", "fold", "mincost", "elapsed", "recomputed")
+
+    def __init__(self, executable, arguments, timeout=0, progressCallback=None, finishedCallback=None, telemetryFile=None, reportFile=None):
+        self.executable = executable
+        self.arguments = arguments
+        self.timeout = timeout
+        self.progressCallback = progressCallback
+        self.finishedCallback = finishedCallback
+
+        self.status = GroupsProcess.Pending
+        self.output = ""
+        self.exitCode = None
+        self.startTime = None
+        self.endTime = None
+
+        # Progress of the optimization
+        self.stage = 0          # incremental degree stage (the iteration counter is reset at each stage)
+        self.iteration = 0
+        self.cost = None
+        self.entropyCost = None
+        self.foldCost = None
+        self.minCost = None
+        self.degree = None
+        self.telemetry = list()     # one dictionary (telemetryFields) per record
+        self.telemetryFile = telemetryFile
+        self.reportFile = reportFile
+        self.report = None
+
+        self._buffer = ""
+        self._timer = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.process = None
+
+    ## Function start()
+    #   Launch the CLI, return immediately
+    def start(self):
+        self.status = GroupsProcess.Running
+        self.startTime = time.time()
+        try:
+            self.process = subprocess.Popen([self.executable] + list(self.arguments), stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        except OSError as e:
+            self.output = "Could not start " + self.executable + ": " + str(e) + "\n"
+            self.status = GroupsProcess.Failed
+            self._finish(None)
+            return
+
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+        if self.timeout > 0:
+            self._timer = threading.Timer(self.timeout, self.onTimeout)
+            self._timer.daemon = True
+            self._timer.start()
+
+    ## Function wait()
+    #   Block until the process is over (or the timeout is reached)
+    def wait(self):
+        # join() with a period, so that a KeyboardInterrupt is not delayed until the end of the run
+        while self._thread is not None and self._thread.is_alive():
+            self._thread.join(0.5)
+        return self.status
+
+    ## Function cancel()
+    #   Stop the CLI
+    def cancel(self):
+        self._stop(GroupsProcess.Cancelled)
+
+    ## Function onTimeout()
+    def onTimeout(self):
+        self._stop(GroupsProcess.TimedOut)
+
+    def _stop(self, status):
+        with self._lock:
+            if not self.isRunning():
+                return
+            self.status = status
+        try:
+            self.process.kill()
+        except OSError:
+            pass            # already over
+        # The reader thread reaches the end of the output and finishes the job
+
+    ## Function _read()
+    #   Reader thread: parse the output of the CLI line by line until it exits
+    def _read(self):
+        for line in iter(self.process.stdout.readline, ""):
+            self.output += line
+            self.parseLine(line.rstrip("\n"))
+        self.process.stdout.close()
+        exitCode = self.process.wait()
+        with self._lock:
+            running = self.isRunning()
+        if running:
+            self.onFinished(exitCode)
+        else:           # cancelled or timed out
+            self._finish(exitCode)
+
+    ## Function parseLine(line)
+    #   Update the progress from one line of the CLI output
+    def parseLine(self, line):
+        if line.startswith(GroupsProcess.telemetryPrefix):
+            return self.parseTelemetry(line[len(GroupsProcess.telemetryPrefix):])
+        match = GroupsProcess.costLineRegExp.match(line.strip())
+        if not match:
+            return False
+        iteration = int(match.group(1))
+        if iteration < self.iteration:
+            self.stage += 1
+        self.iteration = iteration
+        self.cost = float(match.group(2))
+        self.entropyCost = float(match.group(3))
+        self.foldCost = float(match.group(4))
+        self.minCost = float(match.group(5))
+        if self.progressCallback:
+            self.progressCallback(self)
+        return True
+
+    ## Function parseTelemetry(record)
+    #   Append one telemetry record to the time series
+    def parseTelemetry(self, record):
+        values = record.split()
+        # "recomputed" (number of subjects recomputed by the evaluation) is missing from the records of older CLIs
+        if len(values) not in (len(GroupsProcess.telemetryFields) - 2, len(GroupsProcess.telemetryFields) - 1):
+            return False
+        try:
+            iteration, degree = int(values[0]), int(values[1])
+            entropy, fold, minCost, elapsed = [float(value) for value in values[2:6]]
+            recomputed = int(values[6]) if len(values) > 6 else None
+        except ValueError:
+            return False
+        if iteration < self.iteration:
+            self.stage += 1
+        self.iteration = iteration
+        self.degree = degree
+        self.telemetry.append(dict(zip(GroupsProcess.telemetryFields, (self.stage, iteration, degree, entropy, fold, minCost, elapsed, recomputed))))
+        return True
+
+    ## Function saveTelemetry(filename)
+    #   Write the telemetry time series as JSON (.json) or CSV
+    def saveTelemetry(self, filename):
+        with open(filename, "w") as output:
+            if filename.endswith(".json"):
+                json.dump(self.telemetry, output, indent=1)
+            else:
+                output.write(','.join(GroupsProcess.telemetryFields) + '\n')
+                for record in self.telemetry:
+                    output.write(','.join(['' if record[field] is None else repr(record[field]) for field in GroupsProcess.telemetryFields]) + '\n')
+
+    ## Function onFinished(exitCode, exitStatus)
+    def onFinished(self, exitCode, exitStatus=None):
+        if not self.isRunning():
+            return
+        self.report = self.loadReport()
+        if self.report is not None:
+            completed = self.report.get("completed", False) and exitCode == 0
+        else:       # CLI without report
+            completed = self.output.endswith("All done!\n")
+        self.status = GroupsProcess.Completed if completed else GroupsProcess.Failed
+        self._finish(exitCode)
+
+    ## Function loadReport()
+    #   JSON report written by the CLI during this run (None if there is none)
+    def loadReport(self):
+        if not self.reportFile or not os.path.isfile(self.reportFile):
+            return None
+        if self.startTime is not None and os.path.getmtime(self.reportFile) < self.startTime - 1:
+            return None         # report of a previous run
+        try:
+            with open(self.reportFile) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            print("Could not read the report " + self.reportFile + ": " + str(e))
+            return None
+
+    def _finish(self, exitCode):
+        self.exitCode = exitCode
+        self.endTime = time.time()
+        if self._timer is not None:
+            self._stopTimer()
+        if self.telemetryFile:
+            try:
+                self.saveTelemetry(self.telemetryFile)
+            except IOError as e:
+                print("Could not write the telemetry " + self.telemetryFile + ": " + str(e))
+        if self.finishedCallback:
+            self.finishedCallback(self)
+
+    def _stopTimer(self):
+        self._timer.cancel()
+
+    def isRunning(self):
+        return self.status == GroupsProcess.Running
+
+    def succeeded(self):
+        return self.status == GroupsProcess.Completed
+
+    ## Function elapsedTime()
+    #   Wall time of the run in seconds
+    def elapsedTime(self):
+        if self.startTime is None:
+            return 0
+        if self.endTime is None:
+            return time.time() - self.startTime
+        return self.endTime - self.startTime
+
+
+#
+# GroupsReport
+#
+
+class GroupsReport(dict):
+    """Report of a run of the Groups CLI, returned by GroupsRunner.runGroups.
+  It holds the JSON report written by the CLI (GroupsReport.json in the output directory):
+  elapsed, peak_rss (bytes), phases (name, seconds, thread_seconds, calls, rss_growth, peak_rss_growth), counters (cost, closest_face, ssyev), ...
+  and the status of the job: succeeded, status, exitCode, wallTime.
+  Like the boolean returned before, it is true if and only if the run succeeded.
+  """
+
+    fileName = "GroupsReport.json"
+
+    def __init__(self, job=None, **values):
+        dict.__init__(self)
+        if job is not None:
+            if job.report:
+                self.update(job.report)
+            self.update(succeeded=job.succeeded(), status=job.status, exitCode=job.exitCode, wallTime=job.elapsedTime())
+        self.update(values)
+        self.setdefault("succeeded", False)
+
+    def __nonzero__(self):
+        return bool(self["succeeded"])
+
+    __bool__ = __nonzero__
+
+    ## Function phase(name)
+    #   Dictionary (seconds, thread_seconds, calls, rss_growth, peak_rss_growth) of a phase of the run, None if it is not in the report
+    def phase(self, name):
+        for phase in self.get("phases", []):
+            if phase["name"] == name:
+                return phase
+        return None
+
+
+#
+# GroupsRunner
+#
+
+class GroupsRunner(object):
+    """Build, check and run the command lines of the Groups CLI.
+  The jobs are GroupsProcess instances (jobClass): GroupsLogic, the Slicer adapter,
+  runs them as QProcess instead.
+  """
+
+    jobClass = GroupsProcess
+    executable = None
+
+    def __init__(self, executable=None):
+        self.executable = executable
+
+    ## Function runGroups(...)
+    #   Blocking call of the CLI Groups: thin wrapper around runGroupsAsync()
+    #   Return the GroupsReport of the run (time and memory of its phases, counters), which is true
+    #   if Groups ran until the end and false otherwise
+    def runGroups(self, modelsDir, propertyDir, sphereDir, outputDir, procalign=False, properties=0, propValues=0, degree=0, maxIter=0, timeout=0,
+                  telemetryInterval=0, telemetryFile=None, resume=True, outputFormat="text", propertyCacheDir=None, nThreads=0, basisMode="full", incrementalCovariance=True, optimizer="newuoa", blockPasses=0,
+                  samplingLevels=None, timeBudget=0, stageMaxIter=None, stageTime=None, convergenceWindow=0, convergenceTol=None):
+        print("--- function runGroups() ---")
+
+        job = self.runGroupsAsync(modelsDir, propertyDir, sphereDir, outputDir, procalign=procalign, properties=properties,
+                                  propValues=propValues, degree=degree, maxIter=maxIter, timeout=timeout,
+                                  telemetryInterval=telemetryInterval, telemetryFile=telemetryFile, resume=resume,
+                                  outputFormat=outputFormat, propertyCacheDir=propertyCacheDir, nThreads=nThreads,
+                                  basisMode=basisMode, incrementalCovariance=incrementalCovariance, optimizer=optimizer,
+                                  blockPasses=blockPasses, samplingLevels=samplingLevels, timeBudget=timeBudget,
+                                  stageMaxIter=stageMaxIter, stageTime=stageTime, convergenceWindow=convergenceWindow,
+                                  convergenceTol=convergenceTol)
+        if job is None:
+            return GroupsReport(status="invalid inputs")
+        job.wait()
+
+        print("\n\n --------------------------- \n")
+        print(job.output)
+        print("\n\n --------------------------- \n")
+        return GroupsReport(job)
+
+    ## Function runGroupsAsync(...)
+    #   Check if directories are ok
+    #   Create the command line
+    #   Start the CLI Groups without waiting for it
+    #   Return a job handle (jobClass, None if the inputs are invalid)
+    def runGroupsAsync(self, modelsDir, propertyDir, sphereDir, outputDir, procalign=False, properties=0, propValues=0, degree=0, maxIter=0,
+                       timeout=0, progressCallback=None, finishedCallback=None, telemetryInterval=0, telemetryFile=None, resume=True,
+                       outputFormat="text", propertyCacheDir=None, nThreads=0, basisMode="full", incrementalCovariance=True, optimizer="newuoa", blockPasses=0,
+                       samplingLevels=None, timeBudget=0, stageMaxIter=None, stageTime=None, convergenceWindow=0, convergenceTol=None):
+        """
+        Calling Groups CLI
+            Arguments:
+             --surfaceDir: Directory with input models
+             --propertyDir: Property folder (txt files from SPHARM)
+             --sphereDir: Sphere folder
+             --outputDir: Output directory
+             --filter: Properties to consider
+             -w: weights associated with each property
+             -d: Degree of deformation field
+             --maxIter: Maximum number of iteration
+             --optimizer: "newuoa" (derivative-free), "lbfgs" (L-BFGS with finite-difference gradients, not with fullCovariance)
+                          or "block" (newuoa per subject)
+             --blockPasses: Maximum number of sweeps over the subjects per degree of the block optimizer (0: default, 3)
+             --samplingLevels: Icosahedron level of the property sampling per stage, from degree 3 to the final joint optimization
+                               (list or "2,3,4"; the last level is repeated; None: level 4 for all the stages)
+             --timeBudget: Total time of the run in seconds, shared among the stages: each one stops at its best solution (0: no limit)
+             --stageMaxIter: Maximum number of cost evaluations per stage (list or "2000,1000"; the last one is repeated; None: maxIter)
+             --stageTime: Maximum time in seconds per stage (list or "60,120"; the last one is repeated; None: no limit)
+             --convergenceWindow: Stop a stage once the minimum cost did not improve by more than convergenceTol (relative)
+                                  over this number of evaluations (0: disabled)
+             --convergenceTol: Relative improvement of the convergence criterion (None: default, 1e-4)
+             --telemetryInterval: Number of cost evaluations between two telemetry records (0: no telemetry)
+             --resume: Restart an interrupted run of outputDir from its checkpoint (if resume is True)
+             --outputFormat: "text" (one .coeff file per subject), "binary" (GroupsCoefficients.bin, see loadCoefficients) or "both"
+             --propertyCacheDir: Directory of the binary property caches (see buildPropertyCache), written if missing
+             --nThreads: Number of threads of the CLI for the per-subject computations (0: number of cores)
+             --basis: Storage of the spherical harmonic basis: "full" (fastest), "half" (half the memory) or "onthefly" (no storage)
+             --fullCovariance: Recompute the whole covariance at each evaluation (if incrementalCovariance is False)
+            Job options:
+             timeout: Maximum duration of the run in seconds (0: no limit)
+             progressCallback: Called with the job each time a new [iter] cost line is read
+             finishedCallback: Called with the job once the process is over
+             telemetryFile: CSV (or JSON if the name ends with .json) file where the telemetry is saved at the end
+        """
+        if optimizer == "lbfgs" and not incrementalCovariance:
+            print("The lbfgs optimizer needs the incremental covariance")
+            return None
+        index = self.indexInputs(modelsDir, propertyDir, sphereDir, procalign, properties, propValues, outputDir=outputDir)
+        if not index.isValid():
+            return None
+
+        # An interrupted run restarts from its last checkpoint instead of zero coefficients
+        resumeDegree = self.interruptedDegree(outputDir) if resume else None
+        if resumeDegree is not None:
+            print("Resuming the interrupted run of " + outputDir + " at degree " + str(resumeDegree))
+
+        arguments = self.buildArguments(modelsDir, propertyDir, sphereDir, outputDir, properties, propValues, degree, maxIter, index=index,
+                                        telemetryInterval=telemetryInterval, resume=resumeDegree is not None,
+                                        outputFormat=outputFormat, propertyCacheDir=propertyCacheDir, nThreads=nThreads,
+                                        basisMode=basisMode, incrementalCovariance=incrementalCovariance, optimizer=optimizer,
+                                        blockPasses=blockPasses, samplingLevels=samplingLevels, timeBudget=timeBudget,
+                                        stageMaxIter=stageMaxIter, stageTime=stageTime, convergenceWindow=convergenceWindow,
+                                        convergenceTol=convergenceTol)
+
+        job = self.jobClass(self.groupsPath(), arguments, timeout=timeout, progressCallback=progressCallback, finishedCallback=finishedCallback,
+                            telemetryFile=telemetryFile, reportFile=os.path.join(outputDir, GroupsReport.fileName))
+        job.start()
+        return job
+
+    ## Function buildPropertyCache(...)
+    #   Convert the property files into binary caches (with their mean/min/max/sdev) in cacheDir,
+    #   so that the next runs with propertyCacheDir=cacheDir do not parse the text files
+    #   Return True if every property file was cached
+    def buildPropertyCache(self, modelsDir, propertyDir, sphereDir, cacheDir, procalign=False, properties=0, timeout=0):
+        index = self.indexInputs(modelsDir, propertyDir, sphereDir, procalign, properties)
+        if not index.isValid():
+            return False
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+        arguments = self.buildArguments(modelsDir, propertyDir, sphereDir, cacheDir, properties, index=index, propertyCacheDir=cacheDir)
+        arguments.append("--buildPropertyCache")
+        job = self.jobClass(self.groupsPath(), arguments, timeout=timeout)
+        job.start()
+        job.wait()
+        print(job.output)
+        return job.succeeded() and job.exitCode == 0
+
+    ## Function checkInputs(...)
+    #   Check if directories contents correctly match with models Directory
+    #   Every problem is printed, not only the first one
+    def checkInputs(self, modelsDir, propertyDir, sphereDir, procalign=False, properties=0, propValues=0):
+        index = self.indexInputs(modelsDir, propertyDir, sphereDir, procalign, properties, propValues)
+        return index.isValid()
+
+    ## Function indexInputs(...)
+    #   Build the basename -> {mesh, properties, sphere} index of the input directories
+    #   If outputDir is given, the index is cached there as a manifest (Groups.manifest):
+    #   it is reused as long as the input directories did not change
+    #   The properties of the manifest are those of propertyFilter(properties, propValues), in the order of the weights
+    #   The errors found are printed; the index can then be given to buildArguments()
+    def indexInputs(self, modelsDir, propertyDir, sphereDir, procalign=False, properties=0, propValues=0, outputDir=None):
+        filters = self.propertyFilter(properties, propValues)[0].split(',')
+        if outputDir:
+            manifestFile = os.path.join(outputDir, "Groups.manifest")
+            index = GroupsInputIndex.load(manifestFile, modelsDir, propertyDir, sphereDir, procalign=procalign, filters=filters)
+            if index is not None:
+                return index
+
+        index = GroupsInputIndex(modelsDir, propertyDir, sphereDir, procalign=procalign, filters=filters)
+        for error in index.errors:
+            print(error)
+        if outputDir and index.isValid():
+            try:
+                index.save(manifestFile)
+            except (IOError, OSError) as e:
+                print("Could not write the manifest " + manifestFile + ": " + str(e))
+        return index
+
+    ## Function loadCoefficients(filename)
+    #   Read a binary coefficient container written by the CLI (--outputFormat binary or both)
+    #   The coefficients are memory-mapped, without any parsing, as a float32 NumPy array of shape
+    #   ((degree + 1)^2, nSubj, 2): coefficients[:, subj, 0] are the latitudes and [:, subj, 1] the longitudes
+    #   Return a dictionary: names, poles (nSubj x 3), degree, coefficients
+    def loadCoefficients(self, filename):
+        import numpy
+
+        with open(filename, "rb") as container:
+            magic = container.read(8)
+            if magic != b"GRPCOEF1":
+                raise ValueError(filename + " is not a Groups coefficient container")
+            nSubj, degree, offset, length = struct.unpack("<4i", container.read(16))
+            poles = numpy.frombuffer(container.read(4 * 3 * nSubj), dtype="<f4").reshape(nSubj, 3)
+            names = container.read(length).decode("utf-8").split("\n")[:-1]
+
+        coefficients = numpy.memmap(filename, dtype="<f4", mode="r", offset=offset, shape=((degree + 1) * (degree + 1), nSubj, 2))
+        return {"names": names, "poles": poles, "degree": degree, "coefficients": coefficients}
+
+    ## Function interruptedDegree(outputDir)
+    #   Incremental degree at which the last run in outputDir was interrupted,
+    #   read from the checkpoint written by the CLI (None if there is nothing to resume)
+    def interruptedDegree(self, outputDir):
+        try:
+            with open(os.path.join(outputDir, "Groups.checkpoint"), "r") as checkpoint:
+                values = dict(line.split(None, 1) for line in checkpoint.read().splitlines() if line.strip())
+            if values.get("status", "").strip() != "running":
+                return None
+            return int(values["degree"])
+        except (IOError, ValueError, KeyError):
+            return None
+
+    ## Function groupsPath()
+    #   Path of the CLI Groups executable: executable given to the runner, else
+    #   the GROUPS_EXECUTABLE environment variable, else Groups in the PATH
+    def groupsPath(self):
+        return self.executable or os.environ.get("GROUPS_EXECUTABLE") or "Groups"
+
+    ## Function propertyFilter(properties, propValues)
+    #   Return the properties to consider and their weights (comma separated strings)
+    def propertyFilter(self, properties=0, propValues=0):
+        if properties and propValues:
+            # If # of properties and # of weights aren't the same, we cut those at the end
+            if properties.count(',') > propValues.count(','):
+                while properties.count(',') > propValues.count(','):
+                    properties = (','.join(properties.split(',')[:-1]))
+            elif propValues.count(',') > properties.count(','):
+                while propValues.count(',') > properties.count(','):
+                    propValues = (','.join(propValues.split(',')[:-1]))
+            return properties, propValues
+        # If no properties specified - Default: each property with weight=1
+        return "medialMeshArea.txt,medialMeshPartialArea.txt,medialMeshRadius.txt,medialMeshPartialRadius.txt,paraPhi.txt,paraTheta.txt", "1.0,1.0,1.0,1.0,1.0,1.0"
+
+    ## Function buildArguments(...)
+    #   Create the command line
+    #   If an input index is given, the CLI does not scan the directories again: it reads the manifest
+    #   of the index if there is one with the same properties, else the files are passed as explicit lists
+    def buildArguments(self, modelsDir, propertyDir, sphereDir, outputDir, properties=0, propValues=0, degree=0, maxIter=0, index=None,
+                       telemetryInterval=0, resume=False, outputFormat="text", propertyCacheDir=None, nThreads=0, basisMode="full", incrementalCovariance=True, optimizer="newuoa", blockPasses=0,
+                       samplingLevels=None, timeBudget=0, stageMaxIter=None, stageTime=None, convergenceWindow=0, convergenceTol=None):
+        ############################################
+        # ----- Creation of the command line ----- #
+        properties, propValues = self.propertyFilter(properties, propValues)
+
+        arguments = list()
+        if index is None:
+            arguments.append("--surfaceDir")
+            arguments.append(modelsDir)
+            arguments.append("--propertyDir")
+            arguments.append(propertyDir)
+            arguments.append("--sphereDir")
+            arguments.append(sphereDir)
+        elif index.manifestFile and index.filters == properties.split(','):
+            arguments.append("--manifest")
+            arguments.append(index.manifestFile)
+        else:
+            # Properties are listed in the order of the filter, so that they match the weights
+            arguments.append("--surface")
+            arguments.append(','.join(index.meshFiles()))
+            arguments.append("--property")
+            arguments.append(','.join(index.propertyFiles(properties.split(','))))
+            arguments.append("--sphere")
+            arguments.append(','.join(index.sphereFiles()))
+        arguments.append("--outputDir")
+        arguments.append(outputDir)
+
+        if index is None:
+            arguments.append("--filter")
+            arguments.append(properties)
+        arguments.append("-w")
+        arguments.append(propValues)
+
+        if degree:
+            arguments.append("-d")
+            arguments.append(int(degree))
+        else:           # Default: degree=5
+            arguments.append("-d")
+            arguments.append(5)
+
+        if maxIter:
+            arguments.append("--maxIter")
+            arguments.append(maxIter)
+        else:           # Default: # maximum of iteration = 5000
+            arguments.append("--maxIter")
+            arguments.append(5000)
+
+        if optimizer != "newuoa":
+            arguments.append("--optimizer")
+            arguments.append(optimizer)
+        if blockPasses:
+            arguments.append("--blockPasses")
+            arguments.append(int(blockPasses))
+
+        if samplingLevels:
+            arguments.append("--samplingLevels")
+            arguments.append(self.listArgument(samplingLevels, int))
+
+        # Budgets of the stages of the incremental optimization
+        if timeBudget:
+            arguments.append("--timeBudget")
+            arguments.append(float(timeBudget))
+        if stageMaxIter:
+            arguments.append("--stageMaxIter")
+            arguments.append(self.listArgument(stageMaxIter, int))
+        if stageTime:
+            arguments.append("--stageTime")
+            arguments.append(self.listArgument(stageTime, float))
+        if convergenceWindow:
+            arguments.append("--convergenceWindow")
+            arguments.append(int(convergenceWindow))
+            if convergenceTol is not None:
+                arguments.append("--convergenceTol")
+                arguments.append(float(convergenceTol))
+
+        if telemetryInterval:
+            arguments.append("--telemetryInterval")
+            arguments.append(int(telemetryInterval))
+
+        if resume:
+            arguments.append("--resume")
+
+        if outputFormat != "text":
+            arguments.append("--outputFormat")
+            arguments.append(outputFormat)
+
+        if propertyCacheDir:
+            arguments.append("--propertyCacheDir")
+            arguments.append(propertyCacheDir)
+
+        if nThreads:
+            arguments.append("--nThreads")
+            arguments.append(int(nThreads))
+
+        if basisMode != "full":
+            arguments.append("--basis")
+            arguments.append(basisMode)
+
+        if not incrementalCovariance:
+            arguments.append("--fullCovariance")
+
+        return [str(argument) for argument in arguments]
+
+    ## Function listArgument(values, type)
+    #   Value of a vector option of the CLI: "a,b,c" from a list, or from a string already in this form
+    def listArgument(self, values, type):
+        if isinstance(values, basestring):
+            values = [value for value in values.split(',') if value.strip()]
+        return ','.join(str(type(value)) for value in values)
+
+
+#
+# GroupsInputIndex
+#
+
+## Function listDirectory(directory)
+#   Names of the files of a directory, read in one pass (hidden files like .DS_Store are skipped)
+def listDirectory(directory):
+    if hasattr(os, "scandir"):
+        return [entry.name for entry in os.scandir(directory) if not entry.name.startswith(".") and not entry.is_dir()]
+    return [name for name in os.listdir(directory) if not name.startswith(".")]
+
+
+class GroupsInputIndex(object):
+    """Index basename -> {mesh, properties, sphere} of the inputs of Groups.
+  Each directory is read once. For each shape, files should have the same basename:
+        Mesh: [name]_surfSPHARM.vtk (or [name]_surfSPHARM_procalign.vtk)
+        Properties: nProperties x [name]_[...]_[prop].txt
+        Sphere: [name]_surf_para.vtk (or [name]_[...].vtk)
+  Every missing, extra or duplicated file is reported in errors.
+  A valid index can be saved as a manifest, reloaded by the next runs as long as the
+  directories did not change, and read directly by the CLI (--manifest).
+  """
+
+    manifestVersion = "1"
+
+    def __init__(self, modelsDir, propertyDir, sphereDir, procalign=False, filters=None, nProperties=6, scan=True):
+        self.modelsDir = modelsDir
+        self.propertyDir = propertyDir
+        self.sphereDir = sphereDir
+        self.procalign = bool(procalign)
+        self.filters = list(filters or list())
+        self.nProperties = nProperties
+        self.subjects = dict()      # basename -> {"mesh": file, "properties": [files], "sphere": [files]}
+        self.extraFiles = list()    # files which do not belong to any shape
+        self.errors = list()
+        self.stamps = list()
+        self.manifestFile = None
+        if scan:
+            self.scan()
+
+    ## Function directoryStamps()
+    #   (role, mtime, size, path) of each input directory: they change as soon as a file is added, removed or renamed
+    def directoryStamps(self):
+        stamps = list()
+        for role, directory in (("models", self.modelsDir), ("property", self.propertyDir), ("sphere", self.sphereDir)):
+            info = os.stat(directory)
+            stamps.append((role, repr(info.st_mtime), str(info.st_size), directory))
+        return stamps
+
+    ## Function scan()
+    #   Read the directories and check the correspondences
+    def scan(self):
+        procalign = self.procalign
+        filters = self.filters
+        nProperties = self.nProperties
+        modelsDir = self.modelsDir
+        propertyDir = self.propertyDir
+        sphereDir = self.sphereDir
+        for role, directory in (("Models", modelsDir), ("Properties", propertyDir), ("Sphere", sphereDir)):
+            if not os.path.isdir(directory):
+                self.errors.append(role + ". Directory " + str(directory) + " does not exist")
+        if len(self.errors):
+            return self
+        # Taken before reading the directories: a change during the scan makes the manifest stale
+        self.stamps = self.directoryStamps()
+
+        if procalign:
+            modelsExtension = "_surfSPHARM_procalign.vtk"
+        else:
+            modelsExtension = "_surfSPHARM.vtk"
+
+        for file in listDirectory(modelsDir):
+            if file.endswith(modelsExtension):
+                self.subjects[file[:len(file) - len(modelsExtension)]] = {"mesh": file, "properties": list(), "sphere": list()}
+            else:
+                self._extra(modelsDir, file)
+        if not len(self.subjects):
+            self.errors.append("Models. No model found in " + modelsDir)
+
+        for file in listDirectory(propertyDir):
+            name = '_'.join(file.split('_')[:-2])
+            if name in self.subjects:
+                self.subjects[name]["properties"].append(file)
+            else:
+                self._extra(propertyDir, file)
+
+        suffix = "_surf_para.vtk"
+        for file in listDirectory(sphereDir):
+            if file.endswith(suffix):
+                name = '_'.join(file.split('_')[:-2])
+            else:
+                name = '_'.join(file.split('_')[:-1])
+            if name in self.subjects:
+                self.subjects[name]["sphere"].append(file)
+            else:
+                self._extra(sphereDir, file)
+
+        for name in self.names():
+            subject = self.subjects[name]
+            # There should be nProperties files for each model
+            if len(subject["properties"]) != nProperties:
+                self.errors.append("Properties. " + str(len(subject["properties"])) + " properties instead of " + str(nProperties) + " for " + name)
+            for filter in filters or list():
+                if not any(filter in file for file in subject["properties"]):
+                    self.errors.append("Properties. Missing " + filter + " for " + name)
+            # There should be exactly one sphere with the same basename
+            if len(subject["sphere"]) != 1:
+                self.errors.append("Sphere. Wrong correspondence between name files " + name + " (" + str(len(subject["sphere"])) + " spheres)")
+        return self
+
+    ## Function save(manifestFile)
+    #   Write the index as a manifest (properties in the order of the filters)
+    #   The file is written next to it then renamed, so a reader never sees a partial manifest
+    def save(self, manifestFile):
+        lines = ["# Groups manifest",
+                 "version " + GroupsInputIndex.manifestVersion,
+                 "procalign " + str(int(self.procalign)),
+                 "nProperties " + str(self.nProperties),
+                 "filter " + ','.join(self.filters)]
+        for stamp in self.stamps:
+            lines.append("directory " + ' '.join(stamp))
+        for name, mesh, sphere in zip(self.names(), self.meshFiles(), self.sphereFiles()):
+            lines.append("subject " + name)
+            lines.append("surface " + mesh)
+            lines.append("sphere " + sphere)
+            for file in self.subjectPropertyFiles(name, self.filters):
+                lines.append("property " + file)
+
+        tmpFile = manifestFile + ".tmp"
+        with open(tmpFile, "w") as manifest:
+            manifest.write('\n'.join(lines) + '\n')
+        if os.name == "nt" and os.path.exists(manifestFile):
+            os.remove(manifestFile)
+        os.rename(tmpFile, manifestFile)
+        self.manifestFile = manifestFile
+
+    ## Function load(manifestFile, ...)
+    #   Index read from a manifest, None if there is no manifest, or if it does not match
+    #   the parameters or the current state of the directories
+    @classmethod
+    def load(cls, manifestFile, modelsDir, propertyDir, sphereDir, procalign=False, filters=None, nProperties=6):
+        index = cls(modelsDir, propertyDir, sphereDir, procalign=procalign, filters=filters, nProperties=nProperties, scan=False)
+        try:
+            with open(manifestFile, "r") as manifest:
+                lines = manifest.read().splitlines()
+            header = dict()
+            stamps = list()
+            subject = None
+            for line in lines:
+                if not line or line.startswith("#"):
+                    continue
+                keyword, value = line.split(' ', 1) if ' ' in line else (line, "")
+                if keyword == "directory":
+                    stamps.append(tuple(value.split(' ', 3)))
+                elif keyword == "subject":
+                    subject = {"mesh": None, "properties": list(), "sphere": list()}
+                    index.subjects[value] = subject
+                elif keyword == "surface":
+                    subject["mesh"] = os.path.basename(value)
+                elif keyword == "sphere":
+                    subject["sphere"].append(os.path.basename(value))
+                elif keyword == "property":
+                    subject["properties"].append(os.path.basename(value))
+                else:
+                    header[keyword] = value
+            if header.get("version") != cls.manifestVersion or header.get("procalign") != str(int(index.procalign)) or \
+               header.get("nProperties") != str(nProperties) or header.get("filter") != ','.join(index.filters):
+                return None
+            index.stamps = index.directoryStamps()
+            if stamps != index.stamps or not len(index.subjects):
+                return None
+        except (IOError, OSError, ValueError, TypeError, AttributeError):
+            return None
+        index.manifestFile = manifestFile
+        return index
+
+    def _extra(self, directory, file):
+        self.extraFiles.append(os.path.join(directory, file))
+        self.errors.append("Extra file. " + os.path.join(directory, file) + " does not match any model")
+
+    def isValid(self):
+        return not len(self.errors)
+
+    ## Function names()
+    #   Sorted basenames of the shapes
+    def names(self):
+        return sorted(self.subjects.keys())
+
+    def meshFiles(self):
+        return [os.path.join(self.modelsDir, self.subjects[name]["mesh"]) for name in self.names()]
+
+    def sphereFiles(self):
+        return [os.path.join(self.sphereDir, self.subjects[name]["sphere"][0]) for name in self.names()]
+
+    ## Function propertyFiles(filters)
+    #   Property files of all the shapes, shape by shape, in the order of the filters
+    def propertyFiles(self, filters):
+        files = list()
+        for name in self.names():
+            files += self.subjectPropertyFiles(name, filters)
+        return files
+
+    ## Function subjectPropertyFiles(name, filters)
+    #   Property files of one shape, in the order of the filters
+    def subjectPropertyFiles(self, name, filters):
+        files = list()
+        properties = sorted(self.subjects[name]["properties"])
+        for filter in filters:
+            for file in properties:
+                if filter in file:
+                    files.append(os.path.join(self.propertyDir, file))
+                    break
+        return files
+
+
+## Function main(argv)
+#   Command line entry point: check the inputs, run the CLI and print its report
+#   The exit code is 0 if the run succeeded, 1 if it failed, 2 if the inputs are invalid
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the Groups CLI without Slicer")
+    parser.add_argument("modelsDir", help="directory of the input models")
+    parser.add_argument("propertyDir", help="directory of the property files")
+    parser.add_argument("sphereDir", help="directory of the spheres")
+    parser.add_argument("outputDir", help="directory of the outputs")
+    parser.add_argument("--executable", help="Groups CLI (default: $GROUPS_EXECUTABLE, else Groups in the PATH)")
+    parser.add_argument("--procalign", action="store_true", help="use the _surfSPHARM_procalign.vtk models")
+    parser.add_argument("--properties", default=0, help="comma separated property filters (default: the 6 SPHARM properties)")
+    parser.add_argument("--weights", default=0, help="comma separated weights of the properties")
+    parser.add_argument("--degree", type=int, default=0)
+    parser.add_argument("--maxIter", type=int, default=0)
+    parser.add_argument("--optimizer", default="newuoa", choices=("newuoa", "lbfgs", "block"))
+    parser.add_argument("--blockPasses", type=int, default=0)
+    parser.add_argument("--samplingLevels", help="e.g. 2,3,4")
+    parser.add_argument("--timeBudget", type=float, default=0)
+    parser.add_argument("--stageMaxIter", help="e.g. 2000,1000")
+    parser.add_argument("--stageTime", help="e.g. 60,120")
+    parser.add_argument("--convergenceWindow", type=int, default=0)
+    parser.add_argument("--convergenceTol", type=float)
+    parser.add_argument("--telemetryInterval", type=int, default=0)
+    parser.add_argument("--telemetryFile")
+    parser.add_argument("--noResume", action="store_true", help="do not restart an interrupted run from its checkpoint")
+    parser.add_argument("--outputFormat", default="text", choices=("text", "binary", "both"))
+    parser.add_argument("--propertyCacheDir")
+    parser.add_argument("--nThreads", type=int, default=0)
+    parser.add_argument("--basis", default="full", choices=("full", "half", "onthefly"))
+    parser.add_argument("--fullCovariance", action="store_true")
+    parser.add_argument("--timeout", type=float, default=0, help="maximum duration of the run in seconds (0: no limit)")
+    parser.add_argument("--checkOnly", action="store_true", help="only check the inputs")
+    args = parser.parse_args(argv)
+
+    runner = GroupsRunner(args.executable)
+    if args.checkOnly:
+        return 0 if runner.checkInputs(args.modelsDir, args.propertyDir, args.sphereDir, args.procalign, args.properties, args.weights) else 2
+
+    if not os.path.isdir(args.outputDir):
+        os.makedirs(args.outputDir)
+    report = runner.runGroups(args.modelsDir, args.propertyDir, args.sphereDir, args.outputDir, procalign=args.procalign,
+                              properties=args.properties, propValues=args.weights, degree=args.degree, maxIter=args.maxIter,
+                              timeout=args.timeout, telemetryInterval=args.telemetryInterval, telemetryFile=args.telemetryFile,
+                              resume=not args.noResume, outputFormat=args.outputFormat, propertyCacheDir=args.propertyCacheDir,
+                              nThreads=args.nThreads, basisMode=args.basis, incrementalCovariance=not args.fullCovariance,
+                              optimizer=args.optimizer, blockPasses=args.blockPasses, samplingLevels=args.samplingLevels,
+                              timeBudget=args.timeBudget, stageMaxIter=args.stageMaxIter, stageTime=args.stageTime,
+                              convergenceWindow=args.convergenceWindow, convergenceTol=args.convergenceTol)
+    # As a dict: json would print {} for a failed report, which is false
+    print(json.dumps(dict(report), indent=1, sort_keys=True))
+    if report.get("status") == "invalid inputs":
+        return 2
+    return 0 if report else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
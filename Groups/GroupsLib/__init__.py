@@ -0,0 +1,2 @@
+from .GroupsComparison import GroupsComparison, compareCoefficients, readCoefficients
+from .GroupsRunner import GroupsInputIndex, GroupsProcess, GroupsReport, GroupsRunner, listDirectory
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Tests of GroupsLib.GroupsComparison, on small coefficient files:
+    python GroupsComparisonTest.py
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from GroupsLib import GroupsComparison, compareCoefficients, readCoefficients
+
+
+## Function writeCoefficients(filename, values, degree=1)
+#   .coeff file as written by the CLI: pole, degree, then the latitude/longitude pairs
+def writeCoefficients(filename, values, degree=1):
+    with open(filename, "w") as f:
+        f.write(' '.join(repr(value) for value in values[:3]) + "\n" + str(degree) + "\n")
+        for i in range(3, len(values), 2):
+            f.write(' '.join(repr(value) for value in values[i:i + 2]) + "\n")
+
+
+# pole and the (1 + 1)^2 coefficients of degree 1
+REFERENCE = [0.0, 0.0, 1.0, 0.5, -0.25, 0.125, 0.0, 1e-3, 2.0, -4.0, 100.0]
+
+
+class GroupsComparisonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outputDir = os.path.join(self.directory, "output")
+        self.referenceDir = os.path.join(self.directory, "reference")
+        os.makedirs(self.outputDir)
+        os.makedirs(self.referenceDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compare(self, values, reference=REFERENCE, atol=1e-5, rtol=1e-4, degree=1):
+        writeCoefficients(os.path.join(self.outputDir, "subj.coeff"), values, degree)
+        writeCoefficients(os.path.join(self.referenceDir, "subj.coeff"), reference)
+        return compareCoefficients("subj", os.path.join(self.outputDir, "subj.coeff"), os.path.join(self.referenceDir, "subj.coeff"), atol, rtol)
+
+    def test_readCoefficients(self):
+        filename = os.path.join(self.referenceDir, "subj.coeff")
+        writeCoefficients(filename, REFERENCE)
+        self.assertEqual(readCoefficients(filename), (1, REFERENCE))
+        writeCoefficients(filename, REFERENCE[:-2])
+        self.assertRaises(ValueError, readCoefficients, filename)
+
+    def test_identical(self):
+        diff = self.compare(REFERENCE)
+        self.assertEqual(diff["status"], "ok")
+        self.assertEqual((diff["values"], diff["different"], diff["maxAbs"]), (len(REFERENCE), 0, 0))
+
+    def test_tolerances(self):
+        # |output - reference| <= atol + rtol * |reference|
+        values = list(REFERENCE)
+        values[10] += 0.9 * (1e-5 + 1e-4 * 100)    # relative tolerance of a large value
+        values[6] += 0.9e-5                         # absolute tolerance of a zero
+        self.assertEqual(self.compare(values)["status"], "ok")
+
+        values[6] += 0.2e-5
+        diff = self.compare(values)
+        self.assertEqual(diff["status"], "different")
+        self.assertEqual(diff["different"], 1)
+        self.assertEqual(diff["worst"], 10)
+        self.assertTrue(diff["message"].startswith("longitude 3: "))
+        self.assertEqual(self.compare(values, atol=1e-4)["status"], "ok")
+
+    def test_pole(self):
+        values = list(REFERENCE)
+        values[2] = -1.0
+        diff = self.compare(values)
+        self.assertEqual(diff["status"], "different")
+        self.assertTrue(diff["message"].startswith("pole: "))
+
+    def test_degree(self):
+        values = REFERENCE[:3] + [0.0] * 18
+        diff = self.compare(values, degree=2)
+        self.assertEqual(diff["status"], "different")
+        self.assertEqual(diff["message"], "degree 2 instead of 1")
+
+    def test_directories(self):
+        for name in ("a", "b", "c"):
+            writeCoefficients(os.path.join(self.referenceDir, name + ".coeff"), REFERENCE)
+        for name in ("a", "c", "d"):
+            writeCoefficients(os.path.join(self.outputDir, name + ".coeff"), REFERENCE)
+        writeCoefficients(os.path.join(self.outputDir, "c.coeff"), REFERENCE[:-1] + [101.0])
+        open(os.path.join(self.outputDir, "Groups.log"), "w").close()
+
+        for workers in (1, 2):
+            comparison = GroupsComparison(self.outputDir, self.referenceDir, workers=workers).run()
+            self.assertEqual([(diff["name"], diff["status"]) for diff in comparison.results],
+                             [("a", "ok"), ("b", "missing"), ("c", "different"), ("d", "extra")])
+            self.assertFalse(comparison.passed())
+            self.assertTrue(comparison.summary().endswith("4 subjects, 3 failed"))
+
+        os.remove(os.path.join(self.referenceDir, "b.coeff"))
+        os.remove(os.path.join(self.referenceDir, "c.coeff"))
+        os.remove(os.path.join(self.outputDir, "c.coeff"))
+        os.remove(os.path.join(self.outputDir, "d.coeff"))
+        self.assertTrue(GroupsComparison(self.outputDir, self.referenceDir).run().passed())
+
+    def test_empty(self):
+        # nothing to compare is a failure, not a success
+        comparison = GroupsComparison(self.outputDir, os.path.join(self.directory, "missing")).run()
+        self.assertEqual(comparison.results, [])
+        self.assertFalse(comparison.passed())
+
+    def test_unreadable(self):
+        writeCoefficients(os.path.join(self.referenceDir, "subj.coeff"), REFERENCE)
+        with open(os.path.join(self.outputDir, "subj.coeff"), "w") as f:
+            f.write("nan\n")
+        comparison = GroupsComparison(self.outputDir, self.referenceDir).run()
+        self.assertEqual(comparison.results[0]["status"], "error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Tests of GroupsLib.GroupsRunner which do not need the CLI nor Slicer:
+    python GroupsRunnerTest.py
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from GroupsLib import GroupsInputIndex, GroupsProcess, GroupsReport, GroupsRunner
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROPERTIES = ["medialMeshArea.txt", "medialMeshPartialArea.txt", "medialMeshRadius.txt",
+              "medialMeshPartialRadius.txt", "paraPhi.txt", "paraTheta.txt"]
+
+
+## Function createInputs(directory, names)
+#   Empty input files of Groups for the shapes names: models, properties and spheres directories
+#   Return (modelsDir, propertyDir, sphereDir)
+def createInputs(directory, names):
+    modelsDir = os.path.join(directory, "models")
+    propertyDir = os.path.join(directory, "properties")
+    sphereDir = os.path.join(directory, "spheres")
+    for subdirectory in (modelsDir, propertyDir, sphereDir):
+        os.makedirs(subdirectory)
+    for name in names:
+        open(os.path.join(modelsDir, name + "_surfSPHARM.vtk"), "w").close()
+        open(os.path.join(sphereDir, name + "_surf_para.vtk"), "w").close()
+        for prop in PROPERTIES:
+            open(os.path.join(propertyDir, name + "_pp_" + prop), "w").close()
+    return modelsDir, propertyDir, sphereDir
+
+
+## Function manifestProperties(manifestFile)
+#   Subject -> property files of a manifest
+def manifestProperties(manifestFile):
+    subjects = dict()
+    with open(manifestFile, "r") as manifest:
+        for line in manifest.read().splitlines():
+            if line.startswith("subject "):
+                subject = subjects.setdefault(line.split(' ', 1)[1], list())
+            elif line.startswith("property "):
+                subject.append(line.split(' ', 1)[1])
+    return subjects
+
+
+class GroupsRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.names = ["subj1", "subj2", "subj3"]
+        self.modelsDir, self.propertyDir, self.sphereDir = createInputs(self.directory, self.names)
+        self.outputDir = os.path.join(self.directory, "output")
+        os.makedirs(self.outputDir)
+        self.runner = GroupsRunner()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def checkManifest(self, properties, propValues):
+        index = self.runner.indexInputs(self.modelsDir, self.propertyDir, self.sphereDir, False, properties, propValues, outputDir=self.outputDir)
+        self.assertTrue(index.isValid())
+        arguments = self.runner.buildArguments(self.modelsDir, self.propertyDir, self.sphereDir, self.outputDir, properties, propValues, index=index)
+        self.assertIn("--manifest", arguments)
+        self.assertNotIn("--filter", arguments)
+
+        # the CLI checks # of properties per subject == # of weights
+        weights = arguments[arguments.index("-w") + 1].split(',')
+        subjects = manifestProperties(index.manifestFile)
+        self.assertEqual(sorted(subjects.keys()), self.names)
+        for name, files in subjects.items():
+            self.assertEqual(len(files), len(weights))
+        return subjects
+
+    def test_manifestDefaultProperties(self):
+        subjects = self.checkManifest(0, 0)
+        self.assertEqual(len(subjects["subj1"]), 6)
+
+    def test_manifestFilteredProperties(self):
+        subjects = self.checkManifest("medialMeshRadius.txt,paraPhi.txt", "1.0,2.0")
+        self.assertTrue(subjects["subj2"][0].endswith("subj2_pp_medialMeshRadius.txt"))
+        self.assertTrue(subjects["subj2"][1].endswith("subj2_pp_paraPhi.txt"))
+
+    def test_manifestFilterChange(self):
+        # a manifest written for other properties is not reused
+        self.checkManifest("medialMeshRadius.txt,paraPhi.txt", "1.0,2.0")
+        subjects = self.checkManifest("paraTheta.txt", "1.0")
+        self.assertEqual(len(subjects["subj3"]), 1)
+        subjects = self.checkManifest(0, 0)
+        self.assertEqual(len(subjects["subj3"]), 6)
+
+    def touch(self, directory):
+        # the stamps of the directories change with their content; forced forward for the filesystems with coarse times
+        info = os.stat(directory)
+        os.utime(directory, (info.st_atime, info.st_mtime + 10))
+
+    def loadManifest(self, procalign=False, nProperties=6):
+        return GroupsInputIndex.load(os.path.join(self.outputDir, "Groups.manifest"), self.modelsDir, self.propertyDir, self.sphereDir,
+                                     procalign=procalign, filters=self.runner.propertyFilter()[0].split(','), nProperties=nProperties)
+
+    def test_manifestReused(self):
+        index = self.runner.indexInputs(self.modelsDir, self.propertyDir, self.sphereDir, outputDir=self.outputDir)
+        loaded = self.loadManifest()
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.names(), index.names())
+        self.assertEqual(loaded.propertyFiles(index.filters), index.propertyFiles(index.filters))
+        self.assertEqual(loaded.sphereFiles(), index.sphereFiles())
+
+    def test_manifestInvalidation(self):
+        self.runner.indexInputs(self.modelsDir, self.propertyDir, self.sphereDir, outputDir=self.outputDir)
+        # other parameters
+        self.assertIsNone(self.loadManifest(procalign=True))
+        self.assertIsNone(self.loadManifest(nProperties=5))
+        self.assertIsNotNone(self.loadManifest())
+
+        # a file added to an input directory
+        open(os.path.join(self.propertyDir, "subj4_pp_paraPhi.txt"), "w").close()
+        self.touch(self.propertyDir)
+        self.assertIsNone(self.loadManifest())
+        index = self.runner.indexInputs(self.modelsDir, self.propertyDir, self.sphereDir, outputDir=self.outputDir)
+        self.assertFalse(index.isValid())
+
+        # back to a valid state: the manifest is written again
+        os.remove(os.path.join(self.propertyDir, "subj4_pp_paraPhi.txt"))
+        self.touch(self.propertyDir)
+        self.runner.indexInputs(self.modelsDir, self.propertyDir, self.sphereDir, outputDir=self.outputDir)
+        self.assertIsNotNone(self.loadManifest())
+
+    def test_missingDirectory(self):
+        index = self.runner.indexInputs(self.modelsDir, os.path.join(self.directory, "missing"), self.sphereDir, outputDir=self.outputDir)
+        self.assertFalse(index.isValid())
+        self.assertTrue(any("missing" in error for error in index.errors))
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_loadCoefficients(self):
+        # container of 2 subjects at degree 1, as written by CoefficientWriter::saveContainer
+        names = b"subj1\nsubj2\n"
+        offset = (8 + 4 * 4 + 4 * 3 * 2 + len(names) + 15) // 16 * 16
+        values = [0.25 * i - 1 for i in range(4 * 2 * 2)]
+        filename = os.path.join(self.outputDir, "Groups.coeffs")
+        with open(filename, "wb") as container:
+            container.write(b"GRPCOEF1" + struct.pack("<4i", 2, 1, offset, len(names)))
+            container.write(struct.pack("<6f", 0, 0, 1, 1, 0, 0) + names)
+            container.write(b"\0" * (offset - container.tell()) + struct.pack("<%df" % len(values), *values))
+
+        solution = self.runner.loadCoefficients(filename)
+        self.assertEqual(solution["names"], ["subj1", "subj2"])
+        self.assertEqual(solution["degree"], 1)
+        self.assertEqual(solution["poles"].tolist(), [[0, 0, 1], [1, 0, 0]])
+        self.assertEqual(solution["coefficients"].shape, (4, 2, 2))
+        self.assertEqual(solution["coefficients"][1, 0].tolist(), [values[4], values[5]])  # basis function 1 of subj1
+        del solution
+
+        with open(filename, "r+b") as container:
+            container.write(b"GRPCOEF0")
+        self.assertRaises(ValueError, self.runner.loadCoefficients, filename)
+
+
+# Output of a run of the CLI: two stages, telemetry every 5 evaluations, JSON report
+FAKE_CLI = """
+import json, sys
+print("Property: 6")
+for stage in range(2):
+    for i in range(0, 12, 5):
+        print("[%d] %g (%g + 0) %g" % (i, 10.0 - stage - 0.1 * i, 10.0 - stage - 0.1 * i, 10.0 - stage - 0.1 * i))
+        print("[telemetry] %d %d %g 0 %g %g 3" % (i, 3 + stage, 10.0 - stage - 0.1 * i, 10.0 - stage - 0.1 * i, 0.01 * i))
+print("[telemetry] 12 5 8.5 0 8.5 0.2")
+print("[telemetry] not a record")
+json.dump({"completed": True, "elapsed": 0.2, "phases": [{"name": "init", "seconds": 0.1, "thread_seconds": 0.1, "calls": 1,
+                                                        "rss_growth": 1024, "peak_rss_growth": 2048}],
+           "counters": {"cost": 6}}, open(sys.argv[1], "w"))
+print("All done!")
+"""
+
+
+class GroupsProcessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.reportFile = os.path.join(self.directory, GroupsReport.fileName)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parseLine(self):
+        job = GroupsProcess("Groups", [])
+        progress = list()
+        job.progressCallback = lambda job: progress.append(job.iteration)
+        self.assertTrue(job.parseLine("[10] 1.5 (1.25 + 0.25) 1.125"))
+        self.assertEqual((job.iteration, job.cost, job.entropyCost, job.foldCost, job.minCost), (10, 1.5, 1.25, 0.25, 1.125))
+        self.assertFalse(job.parseLine("Sampling level: 3"))
+        # the iteration counter is reset at each stage
+        self.assertTrue(job.parseLine("[0] 1 (1 + 0) 1"))
+        self.assertEqual(job.stage, 1)
+        self.assertEqual(progress, [10, 0])
+
+    def test_parseTelemetry(self):
+        job = GroupsProcess("Groups", [])
+        self.assertTrue(job.parseLine("[telemetry] 20 4 -3.5 0 -3.75 12.5 7"))
+        self.assertTrue(job.parseLine("[telemetry] 30 4 -3.5 0 -3.75 13"))     # older CLI: no recomputed
+        self.assertFalse(job.parseLine("[telemetry] 30 4 -3.5 0"))
+        self.assertFalse(job.parseLine("[telemetry] 30 four -3.5 0 -3.75 13"))
+        self.assertEqual(len(job.telemetry), 2)
+        record = job.telemetry[0]
+        self.assertEqual((record["iteration"], record["degree"], record["mincost"], record["elapsed"], record["recomputed"]), (20, 4, -3.75, 12.5, 7))
+        self.assertIsNone(job.telemetry[1]["recomputed"])
+
+        filename = os.path.join(self.directory, "telemetry.csv")
+        job.saveTelemetry(filename)
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(GroupsProcess.telemetryFields))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].endswith(","))
+
+    def test_run(self):
+        telemetryFile = os.path.join(self.directory, "telemetry.json")
+        job = GroupsProcess(sys.executable, ["-c", FAKE_CLI, self.reportFile], reportFile=self.reportFile, telemetryFile=telemetryFile)
+        job.start()
+        self.assertEqual(job.wait(), GroupsProcess.Completed)
+        self.assertEqual(job.exitCode, 0)
+        self.assertEqual(job.stage, 1)
+        self.assertEqual(len(job.telemetry), 7)
+        self.assertEqual([record["stage"] for record in job.telemetry], [0, 0, 0, 1, 1, 1, 1])
+        with open(telemetryFile) as f:
+            self.assertEqual(json.load(f), job.telemetry)
+
+        report = GroupsReport(job)
+        self.assertTrue(report)
+        self.assertEqual(report["status"], GroupsProcess.Completed)
+        self.assertEqual(report.phase("init")["calls"], 1)
+        self.assertIsNone(report.phase("stage_3"))
+        self.assertEqual(json.loads(json.dumps(dict(report)))["counters"], {"cost": 6})
+
+    def test_failedRun(self):
+        # a completed report is not enough if the CLI exits with an error
+        script = "import json, sys; json.dump({'completed': True}, open(sys.argv[1], 'w')); sys.exit(3)"
+        job = GroupsProcess(sys.executable, ["-c", script, self.reportFile], reportFile=self.reportFile)
+        job.start()
+        self.assertEqual(job.wait(), GroupsProcess.Failed)
+        report = GroupsReport(job)
+        self.assertFalse(report)
+        self.assertEqual(json.loads(json.dumps(dict(report)))["exitCode"], 3)
+
+        # without report, the run completed if the CLI printed its last line
+        job = GroupsProcess(sys.executable, ["-c", "print('Fatal error: no subject is provided!')"])
+        job.start()
+        self.assertEqual(job.wait(), GroupsProcess.Failed)
+
+    def test_missingExecutable(self):
+        job = GroupsProcess(os.path.join(self.directory, "Groups"), [])
+        job.start()
+        self.assertEqual(job.wait(), GroupsProcess.Failed)
+        self.assertIsNone(job.exitCode)
+        self.assertFalse(GroupsReport(job))
+
+
+if __name__ == "__main__":
+    unittest.main()